@@ -0,0 +1,458 @@
+
+"""
+.. moduleauthor:: Chris Bowman <chris.bowman.physics@gmail.com>
+"""
+
+import sys
+from time import time
+
+from numpy import array, exp, log, sqrt, cov, cumsum, searchsorted, isfinite, where, inf
+from numpy import atleast_2d, identity, full_like, argsort, delete, concatenate, expm1, maximum, arange
+from numpy.random import normal, random, randint
+from scipy.linalg import cholesky, eigh
+from scipy.special import logsumexp
+
+from inference.mcmc import BatchEvaluator
+from inference.plotting import matrix_plot
+
+
+
+
+class SmcSampler(object):
+    """
+    Implementation of tempered sequential Monte-Carlo (SMC), which samples from the posterior
+    and estimates the model evidence.
+
+    A population of particles drawn from the prior is moved through a sequence of distributions
+    proportional to the prior multiplied by the likelihood raised to a power (the 'inverse
+    temperature') which increases from zero to one. At each iteration, the next inverse
+    temperature is chosen such that the effective sample size of the re-weighted particles
+    falls to a target fraction of the number of particles. The particles are then resampled
+    according to their weights, and moved using several steps of a random-walk Metropolis
+    kernel whose proposal covariance is estimated from the particles (as in adaptive-Metropolis).
+
+    The mutation steps are applied to all particles at once, so the likelihood is evaluated
+    for the whole population in each step, either through a vectorised likelihood or across
+    a pool of processes.
+
+    :param func log_likelihood: \
+        a function which takes the vector of model parameters as a ``numpy.ndarray``,
+        and returns the log-likelihood.
+
+    :param func log_prior: \
+        a function which takes the vector of model parameters as a ``numpy.ndarray``,
+        and returns the normalised log-prior probability.
+
+    :param particles: \
+        A 2D ``numpy.ndarray`` of shape (number of particles, number of parameters) containing
+        a sample drawn from the prior.
+
+    :param float target_ess: \
+        The fraction of the number of particles to which the effective sample size is allowed to
+        fall when choosing the next inverse temperature.
+
+    :param int mutation_steps: The number of Metropolis-Hastings steps applied to each particle per iteration.
+
+    :param bool vectorised: \
+        If set to ``True``, the log-likelihood and log-prior are instead called with a 2D
+        ``numpy.ndarray`` of parameter vectors, and must return a 1D array of values.
+
+    :param int n_processes: \
+        The number of processes across which the likelihood evaluations are distributed
+        when it is not vectorised.
+    """
+    def __init__(self, log_likelihood = None, log_prior = None, particles = None, target_ess = 0.5,
+                 mutation_steps = 5, vectorised = False, n_processes = 1):
+        self.likelihood = BatchEvaluator(function = log_likelihood, vectorised = vectorised, n_processes = n_processes)
+        self.prior = BatchEvaluator(function = log_prior, vectorised = vectorised)
+        self.target_ess = target_ess
+        self.mutation_steps = mutation_steps
+
+        self.particles = array(particles, dtype = float)
+        self.N, self.L = self.particles.shape
+        self.log_prior = self.prior(self.particles)
+        if not isfinite(self.log_prior).all():
+            raise ValueError('the log-prior must be finite for all of the given particles')
+        self.log_like = self.likelihood(self.particles)
+
+        self.beta = 0.
+        self.log_evidence = 0.
+        self.scale = 2.38 / sqrt(self.L)
+
+        # diagnostic information
+        self.temperatures = [0.]
+        self.acceptance = []
+        self.likelihood_evaluations = self.N
+
+        self.print_status = True
+
+    def run(self, max_iterations = 1000):
+        """
+        Advance the sampler until the inverse temperature reaches one.
+
+        :param int max_iterations: The maximum number of iterations.
+        """
+        t_start = time()
+        for k in range(max_iterations):
+            if self.beta >= 1.:
+                break
+
+            delta = self.next_temperature()
+            log_w = self.incremental_weights(delta)
+            self.log_evidence += logsumexp(log_w) - log(self.N)
+            self.beta = min(self.beta + delta, 1.)
+            self.temperatures.append(self.beta)
+
+            self.resample(log_w)
+            self.mutate()
+
+            if self.print_status:
+                msg = '\r  SmcSampler:   [ iteration {}  |  inverse temperature {:.3g}  |  time elapsed: {:.1f} sec ]'
+                sys.stdout.write(msg.format(k+1, self.beta, time() - t_start))
+                sys.stdout.flush()
+
+        if self.print_status:
+            sys.stdout.write('\n')
+
+    def incremental_weights(self, delta):
+        # particles with zero likelihood are given zero weight
+        finite = isfinite(self.log_like)
+        return where(finite, delta * where(finite, self.log_like, 0.), -inf)
+
+    def effective_fraction(self, delta):
+        log_w = self.incremental_weights(delta)
+        return exp(2*logsumexp(log_w) - logsumexp(2*log_w)) / self.N
+
+    def next_temperature(self):
+        """
+        Finds the increase in inverse temperature for which the effective sample
+        size falls to the target fraction using bisection.
+        """
+        upr = 1. - self.beta
+        if self.effective_fraction(upr) >= self.target_ess:
+            return upr
+
+        lwr = 0.
+        for i in range(60):
+            mid = 0.5*(lwr + upr)
+            if self.effective_fraction(mid) < self.target_ess:
+                upr = mid
+            else:
+                lwr = mid
+        return max(lwr, 1e-12)
+
+    def resample(self, log_w):
+        """
+        Resamples the particles according to the given log-weights using systematic resampling.
+        """
+        w = exp(log_w - logsumexp(log_w))
+        c = cumsum(w)
+        c[-1] = 1.
+        indices = searchsorted(c, (random() + array(range(self.N))) / self.N)
+        self.particles = self.particles[indices,:]
+        self.log_prior = self.log_prior[indices]
+        self.log_like = self.log_like[indices]
+
+    def mutate(self):
+        """
+        Applies several random-walk Metropolis-Hastings steps to all particles, using a
+        proposal covariance estimated from the particles. The proposal scale is adjusted
+        after each step to bring the acceptance rate towards 0.234.
+        """
+        C = atleast_2d(cov(self.particles.T))
+        C += identity(self.L) * (1e-12 * max(C.diagonal().mean(), 1e-300))
+        chol = cholesky(C, lower = True)
+
+        for k in range(self.mutation_steps):
+            props = self.particles + self.scale * normal(size = self.particles.shape).dot(chol.T)
+            lp = self.prior(props)
+
+            # only evaluate the likelihood where the prior is non-zero
+            ll = full_like(lp, -inf)
+            valid = isfinite(lp)
+            if valid.any():
+                ll[valid] = self.likelihood(props[valid,:])
+                self.likelihood_evaluations += valid.sum()
+
+            current = self.log_prior + self.beta * self.log_like
+            proposed = lp + self.beta * ll
+            accept = valid & (log(random(size = self.N)) < proposed - current)
+
+            self.particles[accept,:] = props[accept,:]
+            self.log_prior[accept] = lp[accept]
+            self.log_like[accept] = ll[accept]
+
+            rate = accept.mean()
+            self.acceptance.append(rate)
+            # the scale is limited, as the target rate may not be reachable
+            self.scale = min(max(self.scale * exp(rate - 0.234), 1e-4), 10.)
+
+    def get_sample(self):
+        """
+        Returns the current particles, which form a sample from the posterior once ``run`` has completed.
+
+        :return: A 2D ``numpy.ndarray`` of shape (number of particles, number of parameters).
+        """
+        return self.particles.copy()
+
+    def matrix_plot(self, **kwargs):
+        matrix_plot(samples = [k for k in self.particles.T], **kwargs)
+
+    def close(self):
+        """
+        Shut down the process pool used to evaluate the likelihood, if one has been created.
+        """
+        self.likelihood.close()
+
+
+
+
+
+
+class NestedSampler(object):
+    """
+    Implementation of nested sampling, which estimates the model evidence and
+    produces a weighted sample from the posterior.
+
+    A set of 'live' points drawn from the prior is maintained, and at each iteration
+    the points with the lowest likelihood are removed and replaced by new points drawn
+    from the prior subject to the constraint that their likelihood exceeds that of the
+    removed points. The prior volume enclosed by the live points shrinks by a predictable
+    factor with each removed point, which allows the evidence to be estimated as a sum
+    over the removed points.
+
+    New points are generated by constrained random-walks starting from copies of the
+    surviving live points. Each step of the walk moves along one of the principal-component
+    directions of the live points (as in ``PcaChain``), with any bounds enforced by
+    reflection. Several points can be replaced at each iteration, in which case the walks
+    are advanced together and the likelihood is evaluated for all of them at once, either
+    through a vectorised likelihood or across a pool of processes.
+
+    :param func log_likelihood: \
+        a function which takes the vector of model parameters as a ``numpy.ndarray``,
+        and returns the log-likelihood.
+
+    :param func log_prior: \
+        a function which takes the vector of model parameters as a ``numpy.ndarray``,
+        and returns the normalised log-prior probability.
+
+    :param live_points: \
+        A 2D ``numpy.ndarray`` of shape (number of live points, number of parameters) containing
+        a sample drawn from the prior.
+
+    :param bounds: \
+        A list of [lower, upper] limit pairs for each parameter. Steps which cross the
+        limits are reflected back inside them.
+
+    :param int n_replace: The number of live points replaced at each iteration.
+
+    :param int walk_steps: The number of steps in the random-walk used to generate each new point.
+
+    :param float tolerance: \
+        The sampler stops when the estimated evidence remaining in the live points falls
+        below this fraction of the current evidence estimate.
+
+    :param bool vectorised: \
+        If set to ``True``, the log-likelihood and log-prior are instead called with a 2D
+        ``numpy.ndarray`` of parameter vectors, and must return a 1D array of values.
+
+    :param int n_processes: \
+        The number of processes across which the likelihood evaluations are distributed
+        when it is not vectorised.
+    """
+    def __init__(self, log_likelihood = None, log_prior = None, live_points = None, bounds = None, n_replace = 1,
+                 walk_steps = 20, tolerance = 0.01, vectorised = False, n_processes = 1):
+        self.likelihood = BatchEvaluator(function = log_likelihood, vectorised = vectorised, n_processes = n_processes)
+        self.prior = BatchEvaluator(function = log_prior, vectorised = vectorised)
+
+        self.live = array(live_points, dtype = float)
+        self.n_live, self.L = self.live.shape
+        self.live_prior = self.prior(self.live)
+        if not isfinite(self.live_prior).all():
+            raise ValueError('the log-prior must be finite for all of the given live points')
+        self.live_like = self.likelihood(self.live)
+
+        if not (0 < n_replace < self.n_live // 2):
+            raise ValueError('the number of points replaced per iteration must be less than half the number of live points')
+        self.n_replace = n_replace
+        self.walk_steps = walk_steps
+        self.tolerance = tolerance
+
+        if bounds is not None:
+            self.lower = array([k[0] for k in bounds], dtype = float)
+            self.upper = array([k[1] for k in bounds], dtype = float)
+            self.width = self.upper - self.lower
+            self.process_proposal = self.impose_boundaries
+        else:
+            self.process_proposal = self.pass_through
+
+        # storage for the removed points
+        self.dead_points = []
+        self.dead_like = []
+        self.dead_log_weights = []
+
+        self.log_volume = 0.
+        self.step_scale = 1.
+        self.iterations = 0
+        self.likelihood_evaluations = self.n_live
+        self.print_status = True
+
+    def run(self, max_iterations = 100000):
+        """
+        Advance the sampler until the remaining evidence falls below the tolerance.
+
+        :param int max_iterations: The maximum number of iterations.
+        """
+        t_start = time()
+        for k in range(max_iterations):
+            if self.remaining_fraction() < self.tolerance:
+                break
+            self.iterate()
+
+            if self.print_status and k % 100 == 0:
+                msg = '\r  NestedSampler:   [ iteration {}  |  log-evidence {:.4g}  |  time elapsed: {:.1f} sec ]'
+                sys.stdout.write(msg.format(self.iterations, self.log_evidence, time() - t_start))
+                sys.stdout.flush()
+
+        if self.print_status:
+            sys.stdout.write('\n')
+
+    def iterate(self):
+        """
+        Removes the live points with the lowest likelihood, and replaces them with
+        new points from the likelihood-constrained prior.
+        """
+        removed = argsort(self.live_like)[:self.n_replace]
+        for j, i in enumerate(removed):
+            # the live points are removed one at a time, so the prior volume
+            # shrinks according to the number of points remaining
+            shrinkage = 1. / (self.n_live - j)
+            self.dead_points.append(self.live[i,:].copy())
+            self.dead_like.append(self.live_like[i])
+            self.dead_log_weights.append(self.live_like[i] + self.log_volume + log(-expm1(-shrinkage)))
+            self.log_volume -= shrinkage
+
+        threshold = self.live_like[removed[-1]]
+        survivors = delete(arange(self.n_live), removed)
+        starts = survivors[randint(len(survivors), size = self.n_replace)]
+        new_points, new_prior, new_like = self.constrained_walk(starts, threshold)
+
+        self.live[removed,:] = new_points
+        self.live_prior[removed] = new_prior
+        self.live_like[removed] = new_like
+        self.iterations += 1
+
+    def constrained_walk(self, starts, threshold):
+        """
+        Generates new points by random-walks from the live points with the given indices,
+        which sample the prior subject to the likelihood exceeding the given threshold.
+        """
+        X = self.live[starts,:].copy()
+        lp = self.live_prior[starts].copy()
+        ll = self.live_like[starts].copy()
+        k = len(starts)
+
+        # find the principal-component directions of the live points
+        values, vectors = eigh(atleast_2d(cov(self.live.T)))
+        values = maximum(values, 1e-300)
+
+        accepted = 0
+        for s in range(self.walk_steps):
+            j = randint(self.L, size = k)
+            steps = (self.step_scale * sqrt(values[j]) * normal(size = k))[:,None] * vectors[:,j].T
+            props = self.process_proposal(X + steps)
+
+            lp_new = self.prior(props)
+            valid = isfinite(lp_new) & (log(random(size = k)) < lp_new - lp)
+            ll_new = full_like(lp_new, -inf)
+            if valid.any():
+                ll_new[valid] = self.likelihood(props[valid,:])
+                self.likelihood_evaluations += valid.sum()
+
+            accept = valid & (ll_new > threshold)
+            X[accept,:] = props[accept,:]
+            lp[accept] = lp_new[accept]
+            ll[accept] = ll_new[accept]
+            accepted += accept.sum()
+
+        # adjust the step size towards an acceptance rate of 50%, limiting it to at most
+        # ten times the spread of the live points, as the target rate may not be reachable
+        self.step_scale = min(max(self.step_scale * exp(accepted / (self.walk_steps * k) - 0.5), 1e-4), 10.)
+        return X, lp, ll
+
+    def impose_boundaries(self, prop):
+        d = prop - self.lower
+        n = (d // self.width) % 2
+        return self.lower + (1 - 2*n)*(d % self.width) + n*self.width
+
+    def pass_through(self, prop):
+        return prop
+
+    def log_weights(self):
+        # the live points share the remaining prior volume equally
+        live_weights = self.live_like + self.log_volume - log(self.n_live)
+        return concatenate([array(self.dead_log_weights), live_weights])
+
+    @property
+    def log_evidence(self):
+        """
+        The estimated log-evidence, including the contribution of the current live points.
+        """
+        return logsumexp(self.log_weights())
+
+    @property
+    def log_evidence_error(self):
+        """
+        The estimated uncertainty in the log-evidence, based on the information
+        gained in moving from the prior to the posterior.
+        """
+        log_w = self.log_weights()
+        log_z = logsumexp(log_w)
+        like = concatenate([array(self.dead_like), self.live_like])
+        p = exp(log_w - log_z)
+        finite = p > 0.
+        H = (p[finite] * like[finite]).sum() - log_z
+        return sqrt(max(H, 0.) / self.n_live)
+
+    def remaining_fraction(self):
+        """
+        Returns an upper-bound on the fraction of the evidence contained in the
+        live points, relative to the evidence of the removed points.
+        """
+        if len(self.dead_log_weights) == 0:
+            return inf
+        return exp(self.live_like.max() + self.log_volume - logsumexp(self.dead_log_weights))
+
+    def get_sample(self):
+        """
+        Returns the removed and live points along with their posterior weights.
+
+        :return: \
+            A 2D ``numpy.ndarray`` of shape (number of points, number of parameters), and
+            a 1D ``numpy.ndarray`` of the normalised weights.
+        """
+        points = concatenate([array(self.dead_points).reshape([-1, self.L]), self.live], axis = 0)
+        log_w = self.log_weights()
+        return points, exp(log_w - logsumexp(log_w))
+
+    def get_resampled(self, n = None):
+        """
+        Returns an equally-weighted posterior sample generated by systematic resampling.
+
+        :param int n: The size of the sample. If not specified, the number of points with non-negligible weight is used.
+        """
+        points, weights = self.get_sample()
+        if n is None:
+            n = int(1. / (weights**2).sum())
+        c = cumsum(weights)
+        c[-1] = 1.
+        return points[searchsorted(c, (random() + arange(n)) / n),:]
+
+    def matrix_plot(self, **kwargs):
+        matrix_plot(samples = [k for k in self.get_resampled().T], **kwargs)
+
+    def close(self):
+        """
+        Shut down the process pool used to evaluate the likelihood, if one has been created.
+        """
+        self.likelihood.close()
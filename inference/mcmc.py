@@ -4,22 +4,30 @@
 """
 
 import sys
+from abc import ABC, abstractmethod
+from os import makedirs, listdir, remove
+from os.path import join, isdir, isfile
 from warnings import warn
-from copy import copy, deepcopy
+from copy import copy
 from multiprocessing import Process, Pipe, Event, Pool
 from time import time
 from random import choice
 
 import matplotlib.pyplot as plt
-from numpy import array, arange, zeros
+from numpy import array, arange, zeros, diag, concatenate, maximum, cumsum, outer
 from numpy import exp, log, mean, sqrt, argmax, diff, dot, cov, var, percentile, linspace, identity
-from numpy import isfinite, sort, argsort, savez, savez_compressed, load
+from numpy import isfinite, sort, argsort, savez, savez_compressed, load, nan, full, isnan, inf, pi
+from numpy import expm1, log1p, minimum, argpartition, memmap, where, unique
+from numpy import save as save_array
 from numpy.fft import rfft, irfft
-from numpy.random import normal, random, shuffle, seed, randint
-from scipy.linalg import eigh
+from numpy.random import normal, random, shuffle, seed, randint, permutation, get_state, set_state
+from scipy.linalg import eigh, cholesky
+from scipy.special import stdtr, logsumexp
+from scipy.optimize import minimize
 
-from inference.pdf_tools import UnimodalPdf, GaussianKDE
+from inference.pdf_tools import UnimodalPdf, GaussianKDE, sample_hdi
 from inference.plotting import matrix_plot, trace_plot, transition_matrix_plot
+from inference.gp_tools import GpRegressor
 
 
 
@@ -119,7 +127,9 @@ class Parameter(object):
         if self.try_count > self.max_tries: self.adjust_sigma(0.25)
         # generate the proposed value
         prop = self.samples[-1] + self.sigma * normal()
+        return self.reflect(prop)
 
+    def reflect(self, prop):
         # we now pass the proposal through a 'reflecting' function where
         # proposals falling outside the boundary are reflected inside
         d = prop - self.lower
@@ -129,6 +139,18 @@ class Parameter(object):
         else:
             return self.upper - d % self.width
 
+    def constrain(self, prop):
+        """
+        Applies any boundaries or non-negativity constraint on the parameter
+        to a proposed value, in the same way as the proposal methods.
+        """
+        if self.bounded:
+            return self.reflect(prop)
+        elif self._non_negative:
+            return abs(prop)
+        else:
+            return prop
+
     def submit_accept_prob(self, p):
         self.num += 1
         self.avg += p
@@ -163,6 +185,15 @@ class Parameter(object):
         self.var = 0
         self.num = 0
 
+    def set_sigma(self, sigma):
+        # if the parameter has no samples beyond its starting value, the
+        # initial width is replaced, otherwise the change is recorded
+        if len(self.samples) == 1:
+            self.sigma = sigma
+            self.sigma_values = [copy(sigma)]
+        else:
+            self.adjust_sigma(sigma / self.sigma)
+
     def add_sample(self, s):
         self.samples.append(s)
         self.try_count = 0
@@ -193,7 +224,9 @@ class Parameter(object):
 
     def load_items(self, dictionary, param_id):
         i = 'param_' + str(param_id)
-        self.samples = list(dictionary[i + 'samples'])
+        # samples saved in the directory format are instead loaded into a SampleStore by the chain
+        if i + 'samples' in dictionary:
+            self.samples = list(dictionary[i + 'samples'])
         self.sigma = float(dictionary[i + 'sigma'])
         self.avg = float(dictionary[i + 'avg'])
         self.var = float(dictionary[i + 'var'])
@@ -225,6 +258,167 @@ class Parameter(object):
 
 
 
+class SampleStore(object):
+    """
+    Stores the samples of all the parameters of a chain in a single 2D array which
+    grows in size as required, so that the sample (or any burn / thin slice of it)
+    can be accessed as an array view without copying.
+
+    Individual parameters can append their samples separately through the list-like
+    view returned by ``column``, or complete points can be appended using ``append``.
+
+    :param int n_params: The number of parameters.
+
+    :param data: \
+        Optionally, an existing 2D array of samples with shape (number of samples, number
+        of parameters) which becomes the initial contents of the store.
+    """
+    def __init__(self, n_params = None, data = None):
+        if data is None:
+            self.data = zeros([1024, n_params])
+            self.counts = zeros(n_params, dtype = int)
+        else:
+            self.data = data
+            self.counts = full(data.shape[1], data.shape[0], dtype = int)
+
+    def grow(self, size):
+        if size > self.data.shape[0]:
+            new_data = zeros([max(size, 2*self.data.shape[0]), self.data.shape[1]])
+            new_data[:self.data.shape[0],:] = self.data
+            self.data = new_data
+
+    def append(self, point):
+        n = self.counts.max()
+        self.grow(n + 1)
+        self.data[n,:] = point
+        self.counts[:] = n + 1
+
+    def append_value(self, i, value):
+        self.grow(self.counts[i] + 1)
+        self.data[self.counts[i], i] = value
+        self.counts[i] += 1
+
+    def get(self, burn, thin):
+        return self[burn::thin]
+
+    def column(self, i):
+        return SampleColumn(self, i)
+
+    def __len__(self):
+        return self.counts.min()
+
+    def __getitem__(self, index):
+        return self.data[:len(self)][index]
+
+    def __setitem__(self, index, value):
+        self.data[:len(self)][index] = value
+
+    def __array__(self, dtype = None, copy = None):
+        return self.data[:len(self)] if dtype is None else self.data[:len(self)].astype(dtype)
+
+
+
+
+class SampleColumn(object):
+    """
+    A list-like view of the samples of one parameter held in a ``SampleStore``,
+    which is used as the ``samples`` attribute of ``Parameter`` objects belonging
+    to a chain.
+    """
+    def __init__(self, store, i):
+        self.store = store
+        self.i = i
+
+    def append(self, value):
+        self.store.append_value(self.i, value)
+
+    def __len__(self):
+        return self.store.counts[self.i]
+
+    def __getitem__(self, index):
+        return self.store.data[:len(self), self.i][index]
+
+    def __setitem__(self, index, value):
+        self.store.data[:len(self), self.i][index] = value
+
+    def __iter__(self):
+        return iter(self.store.data[:len(self), self.i])
+
+    def __array__(self, dtype = None, copy = None):
+        values = self.store.data[:len(self), self.i]
+        return values if dtype is None or dtype == values.dtype else values.astype(dtype)
+
+
+
+
+# items which are stored as separate .npy files when a chain is saved as a directory
+chain_array_keys = ['samples', 'probs', 'blobs', 'theta']
+
+
+def save_chain_directory(directory, items):
+    """
+    Saves the items of a chain in a directory, where the arrays whose size grows with
+    the length of the chain are stored as separate .npy files so that they can be
+    memory-mapped when loaded, and all other items are stored in a single .npz file.
+
+    An existing directory is only overwritten if it contains a previously saved chain.
+    """
+    if isdir(directory) and len(listdir(directory)) > 0 and not isfile(join(directory, 'attributes.npz')):
+        raise ValueError('the directory {} is not empty, and does not contain a saved chain'.format(directory))
+    makedirs(directory, exist_ok = True)
+
+    attributes = {}
+    for key, value in items.items():
+        if value is None:
+            # unset items are left out, as they would be stored as object arrays
+            continue
+        if key in chain_array_keys:
+            save_array(join(directory, key + '.npy'), array(value))
+        else:
+            attributes[key] = value
+    savez(join(directory, 'attributes.npz'), **attributes)
+
+    # remove any arrays left by a previous save which are not part of this chain
+    for key in chain_array_keys:
+        path = join(directory, key + '.npy')
+        if items.get(key) is None and isfile(path):
+            remove(path)
+
+
+def load_chain_directory(directory):
+    """
+    Loads the items of a chain saved using ``save_chain_directory``, where the
+    arrays stored as .npy files are memory-mapped rather than read into memory.
+    """
+    items = dict(load(join(directory, 'attributes.npz')))
+    for key in chain_array_keys:
+        path = join(directory, key + '.npy')
+        if isfile(path):
+            # copy-on-write mapping allows the chain to be modified without changing the file
+            items[key] = load(path, mmap_mode = 'c')
+    return items
+
+
+def load_probabilities(probs):
+    # memory-mapped probabilities are wrapped to provide the list-like interface used by the chains
+    if isinstance(probs, memmap):
+        return SampleStore(data = probs[:,None]).column(0)
+    else:
+        return list(probs)
+
+
+def reflect_into_bounds(prop, lower, width):
+    # proposals falling outside the bounds are reflected back inside, where
+    # n is the parity of the number of reflections needed for each parameter
+    d = prop - lower
+    n = (d // width) % 2
+    return lower + (1 - 2*n)*(d % width) + n*width
+
+
+
+
+
+
 class MarkovChain(object):
     """
     Implementation of the metropolis-hastings algorithm using a multivariate-normal proposal distribution.
@@ -241,13 +435,22 @@ class MarkovChain(object):
         vector of standard deviations which serve as initial guesses for the widths of the proposal
         distribution for each model parameter. If not specified, the starting widths will be approximated
         as 1% of the values in 'start'.
+
+    :param emulator: \
+        An instance of ``PosteriorEmulator``. If given, delayed-acceptance is used, where
+        proposals are first screened using the emulator, and the posterior is only evaluated
+        for proposals which pass the screening.
     """
-    def __init__(self, posterior = None, start = None, widths = None, temperature = 1.):
+    def __init__(self, posterior = None, start = None, widths = None, temperature = 1., emulator = None):
 
         if start is None:
             start = []
 
         self.inv_temp = 1. / temperature
+        self.emulator = emulator
+        self.prefetcher = None
+        self.blobs = None
+        self.sort_cache = None
 
         if posterior is not None:
             self.posterior = posterior
@@ -259,6 +462,7 @@ class MarkovChain(object):
 
             # create a list of parameter objects
             self.params = [Parameter(value = v, sigma = s) for v, s in zip(start, widths)]
+            self.attach_sample_store()
 
             # create storage
             self.n = 1  # tracks total length of the chain
@@ -267,7 +471,18 @@ class MarkovChain(object):
 
             # add starting point as first step in chain
             if len(self.params) != 0:
-                self.probs.append(self.posterior(array([p.samples[-1] for p in self.params]))*self.inv_temp)
+                start = array([p.samples[-1] for p in self.params])
+                if hasattr(self.posterior, 'propose'):
+                    self.probs.append(self.posterior.propose(start)*self.inv_temp)
+                    self.posterior.commit()
+                else:
+                    self.probs.append(self.posterior(start)*self.inv_temp)
+
+                # derived quantities are stored if the posterior provides them
+                if hasattr(self.posterior, 'blob'):
+                    self.current_blob = self.posterior.blob
+                    self.blobs = BlobStore()
+                    self.blobs.append(self.current_blob)
 
                 # check posterior value of chain starting point is finite
                 if not isfinite(self.probs[0]):
@@ -285,23 +500,179 @@ class MarkovChain(object):
         Draws samples from the proposal distribution until one is
         found which satisfies the metropolis-hastings criteria.
         """
+        theta = array(self.get_last())
         while True:
+            if self.prefetcher is not None:
+                self.prefetcher.update(self.predict_proposals, theta, self.probs[-1])
             proposal = array([p.proposal() for p in self.params])
-            pval = self.posterior(proposal) * self.inv_temp
-
-            if pval > self.probs[-1]:
+            accept, pval, _ = self.metropolis_test(theta, proposal, self.probs[-1])
+            if accept:
                 break
-            else:
-                test = random()
-                acceptance_prob = exp(pval-self.probs[-1])
-                if test < acceptance_prob:
-                    break
+
+        if self.prefetcher is not None:
+            self.prefetcher.reset()
 
         for p, v in zip(self.params, proposal):
             p.add_sample(v)
 
+        self.probs.append(pval)
+        self.record_blob()
         self.n += 1
 
+    def metropolis_test(self, theta, proposal, p_old):
+        """
+        Performs the Metropolis-Hastings test for moving from the current position
+        to a proposed position.
+
+        The acceptance threshold is drawn before the posterior is evaluated, so that
+        posteriors which support early rejection can stop evaluating once the proposal
+        is certain to be rejected. If an emulator has been given, the proposal must
+        first pass a screening test based on the emulated log-probabilities, and the
+        threshold of the second stage is adjusted so that the chain still targets the
+        exact posterior (delayed-acceptance).
+
+        :return: \
+            A boolean indicating whether the proposal was accepted, the log-probability
+            of the proposal (or an upper bound on it, see ``evaluate``) and an estimate of
+            the acceptance probability. If the posterior supports early rejection, the
+            estimate is 1 if the proposal was accepted and 0 otherwise.
+        """
+        threshold = p_old + log(random())
+        emulate = self.emulator is not None and self.emulator.ready
+        if emulate:
+            # first-stage screening using the emulator
+            ds = self.emulator(proposal) - self.emulator(theta)
+            screen_prob = exp(min(ds, 0.))
+            if random() > screen_prob:
+                self.emulator.screened += 1
+                return False, -inf, screen_prob
+            self.emulator.passed += 1
+            threshold += ds
+
+        p_new = self.evaluate(proposal, threshold)
+        accept = p_new > threshold
+        self.resolve_evaluation(accept)
+
+        if self.emulator is not None and self.evaluation_completed:
+            self.emulator.add_point(proposal, p_new)
+
+        if hasattr(self.posterior, 'bounded_evaluation'):
+            # the exact log-probability is not known for proposals which are rejected early,
+            # so the outcome of the test is used as an unbiased estimate of the acceptance
+            # probability for every proposal
+            accept_prob = float(accept)
+        elif emulate:
+            accept_prob = screen_prob * exp(min(p_new - p_old - ds, 0.))
+        else:
+            accept_prob = exp(min(p_new - p_old, 0.))
+        return accept, p_new, accept_prob
+
+    def evaluate(self, theta, threshold):
+        """
+        Returns the tempered log-probability of the given parameters. If the posterior
+        supports early rejection (see ``DecomposedPosterior``), the evaluation may stop
+        as soon as the log-probability is known to fall below the given threshold, in
+        which case an upper bound on the log-probability is returned instead.
+
+        Whether the returned value is the exact log-probability is stored in the
+        ``evaluation_completed`` attribute.
+
+        If the posterior supports incremental evaluation (see ``IncrementalPosterior``),
+        the evaluation is proposed to the posterior, and must be followed by a call to
+        ``resolve_evaluation`` once it is known whether the point is accepted.
+        """
+        self.evaluation_completed = True
+        if hasattr(self.posterior, 'propose'):
+            return self.posterior.propose(theta) * self.inv_temp
+
+        if self.prefetcher is not None:
+            result = self.prefetcher.lookup(theta, threshold)
+            if result is not None:
+                value, self.evaluation_completed = result
+                return value * self.inv_temp
+
+        if hasattr(self.posterior, 'bounded_evaluation'):
+            value = self.posterior.bounded_evaluation(theta, threshold / self.inv_temp)
+            self.evaluation_completed = getattr(self.posterior, 'completed', value >= threshold / self.inv_temp)
+            return value * self.inv_temp
+        else:
+            return self.posterior(theta) * self.inv_temp
+
+    def resolve_evaluation(self, accept):
+        """
+        Informs an incremental posterior whether the most recently evaluated point
+        was accepted, so that its cached quantities can be updated or discarded.
+        """
+        if hasattr(self.posterior, 'propose'):
+            if accept:
+                self.posterior.commit()
+            else:
+                self.posterior.rollback()
+
+        if accept and self.blobs is not None:
+            self.current_blob = self.posterior.blob
+
+    def record_blob(self):
+        """
+        Stores the derived quantities for the current position of the chain, if the
+        posterior provides them (see ``BlobPosterior``).
+        """
+        if self.blobs is not None:
+            self.blobs.append(self.current_blob)
+
+    def predict_proposals(self, n, theta, p_old):
+        """
+        Predicts the next *n* proposals and acceptance thresholds which will be generated
+        if each of them is rejected, without changing the state of the random number
+        generator. Used for speculative evaluation of proposals when prefetching.
+        """
+        state = get_state()
+        proposals = []
+        thresholds = []
+        for j in range(n):
+            proposals.append(array([p.constrain(p.samples[-1] + p.sigma * normal()) for p in self.params]))
+            thresholds.append(p_old + log(random()))
+        set_state(state)
+        return proposals, thresholds
+
+    def enable_prefetching(self, n_processes, depth = None):
+        """
+        Enable speculative evaluation of proposals across a pool of processes.
+
+        Before each proposal is tested, the next *depth* proposals which the chain will make
+        if each is rejected are predicted, and the posterior is evaluated for all of them in
+        parallel. The chain then proceeds exactly as it would in serial, using the prefetched
+        values wherever the prediction was correct. The resulting chain is therefore identical
+        to one produced without prefetching, but requires fewer sequential posterior evaluations.
+
+        Prefetching is only worthwhile when the posterior is expensive to evaluate, and
+        the posterior must be picklable. It provides no speed-up when used together with
+        a ``PosteriorEmulator``, and evaluations performed by the worker processes do not
+        contribute to the counters of a ``DecomposedPosterior``.
+
+        :param int n_processes: The number of processes used to evaluate the posterior.
+
+        :param int depth: \
+            The number of proposals evaluated speculatively in each batch. If not
+            specified, this is equal to the number of processes.
+        """
+        if self.blobs is not None:
+            raise ValueError('prefetching cannot be used with a posterior which provides derived quantities')
+        if getattr(self, 'slice_sampling', False):
+            raise ValueError('prefetching cannot be used together with slice-sampling updates')
+        if hasattr(self.posterior, 'propose'):
+            raise ValueError('prefetching cannot be used with an incremental posterior')
+        self.disable_prefetching()
+        self.prefetcher = Prefetcher(self.posterior, n_processes = n_processes, depth = depth, inv_temp = self.inv_temp)
+
+    def disable_prefetching(self):
+        """
+        Disable speculative evaluation of proposals, and shut down the process pool.
+        """
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+            self.prefetcher = None
+
     def advance(self, m):
         """
         Advances the chain by taking *m* new steps.
@@ -338,6 +709,41 @@ class MarkovChain(object):
             sys.stdout.flush()
             sys.stdout.write('\n')
 
+    def stream(self, n_steps, block = 100):
+        """
+        Advances the chain by *n_steps* steps, yielding each block of new samples as soon
+        as it has been produced, so that the sample can be monitored, processed or written
+        to disk while the chain runs. For example:
+
+        .. code-block:: python
+
+            for samples, probs in chain.stream(10000, block = 500):
+                ...
+
+        :param int n_steps: The total number of steps the chain will advance.
+
+        :param int block: The number of steps in each yielded block.
+
+        :return: \
+            A generator which yields the samples in each block as a ``numpy.ndarray`` of shape
+            (number of steps, number of parameters) alongside a 1D ``numpy.ndarray`` of the
+            corresponding log-probabilities.
+        """
+        if block < 1:
+            raise ValueError('block must be a positive integer')
+        while n_steps > 0:
+            m = min(block, n_steps)
+            for i in range(m):
+                self.take_step()
+            n_steps -= m
+            yield self.latest_steps(m)
+
+    def latest_steps(self, m):
+        """
+        Returns the samples and log-probabilities for the last *m* steps of the chain as arrays.
+        """
+        return self.store[-m:], array(self.probs[-m:])
+
     def run_for(self, minutes = 0, hours = 0, days = 0):
         """
         Advances the chain for a chosen amount of computation time
@@ -392,6 +798,42 @@ class MarkovChain(object):
     def replace_last(self, theta):
         for p,t in zip(self.params, theta):
             p.samples[-1] = t
+        # the cached probability ordering is no longer valid
+        self.sort_cache = None
+
+    def attach_sample_store(self, data = None):
+        """
+        Moves the samples of all parameters into a single ``SampleStore``, which the
+        parameters then use to store any new samples. Optionally, an existing 2D array
+        of samples can be given, which is used as the contents of the store.
+        """
+        if len(self.params) == 0: return
+        if data is None:
+            data = array([array(p.samples, dtype = float) for p in self.params]).T
+        self.store = SampleStore(data = data)
+        for i, p in enumerate(self.params):
+            p.samples = self.store.column(i)
+
+    def get_sample_array(self, burn = None, thin = None):
+        """
+        Return the sample generated by the chain as an array. The array is a view of the
+        stored sample, so no copy is made, and it should not be modified.
+
+        :param int burn: \
+            Number of samples to discard from the start of the chain. If not specified,
+            the value of self.burn is used instead.
+
+        :param int thin: \
+            Instead of returning every sample which is not discarded as part of the burn-in,
+            every *m*'th sample is returned for a specified integer *m*. If not specified,
+            the value of self.thin is used instead.
+
+        :return: \
+            The sample as a ``numpy.ndarray`` of shape (number of samples, number of parameters).
+        """
+        if burn is None: burn = self.burn
+        if thin is None: thin = self.thin
+        return self.store.get(burn, thin)
 
     def get_parameter(self, n, burn = None, thin = None):
         """
@@ -408,11 +850,10 @@ class MarkovChain(object):
             every *m*'th sample is returned for a specified integer *m*. If not specified,
             the value of self.thin is used instead.
 
-        :return: List of samples for parameter *n*'th parameter.
+        :return: \
+            The samples for the *n*'th parameter, as a ``numpy.ndarray`` view of the stored sample.
         """
-        if burn is None: burn = self.burn
-        if thin is None: thin = self.thin
-        return self.params[n].samples[burn::thin]
+        return self.get_sample_array(burn, thin)[:,n]
 
     def get_probabilities(self, burn = None, thin = None):
         """
@@ -433,6 +874,30 @@ class MarkovChain(object):
         if thin is None: thin = self.thin
         return self.probs[burn::thin]
 
+    def get_blobs(self, burn = None, thin = None):
+        """
+        Return the derived quantities stored for each step in the chain, when the
+        posterior provides them (see ``BlobPosterior``).
+
+        :param int burn: \
+            Number of steps to discard from the start of the chain. If not specified, the
+            value of self.burn is used instead.
+
+        :param int thin: \
+            Instead of returning every step which is not discarded as part of the burn-in,
+            every *m*'th step is returned for a specified integer *m*. If not specified,
+            the value of self.thin is used instead.
+
+        :return: \
+            The derived quantities as a ``numpy.ndarray``, where the first dimension
+            corresponds to the steps of the chain.
+        """
+        if self.blobs is None:
+            raise ValueError('the posterior sampled by this chain does not provide derived quantities')
+        if burn is None: burn = self.burn
+        if thin is None: thin = self.thin
+        return self.blobs.get(burn, thin)
+
     def get_sample(self, burn = None, thin = None):
         """
         Return the sample generated by the chain as a list of tuples
@@ -448,9 +913,7 @@ class MarkovChain(object):
 
         :return: List containing sample points stored as tuples.
         """
-        if burn is None: burn = self.burn
-        if thin is None: thin = self.thin
-        return list(zip( *[ p.samples[burn::thin] for p in self.params] ))
+        return list(zip( *self.get_sample_array(burn, thin).T ))
 
     def get_interval(self, interval = None, burn = None, thin = None, samples = None):
         """
@@ -479,36 +942,61 @@ class MarkovChain(object):
         if burn is None: burn = self.burn
         if interval is None: interval = 0.95
 
-        # get the sorting indices for the probabilities
-        probs = array(self.probs[burn:])
-        inds = probs.argsort()
-        # sort the sample by probability
-        arrays = [array(p.samples[burn:])[inds] for p in self.params]
-        probs = probs[inds]
-        # trim lowest-probability samples
-        cutoff = int(len(probs) * (1 - interval))
-        arrays = [a[cutoff:] for a in arrays]
-        probs = probs[cutoff:]
+        # get the indices of the highest-probability samples in order of increasing probability
+        n_samples = len(self.probs) - burn
+        cutoff = int(n_samples * (1 - interval))
+        inds = self.highest_probability_indices(n_samples - cutoff, burn)
+
         # if a specific number of samples is requested we override the thin value
         if samples is not None:
-            thin = max(len(probs) // samples, 1)
+            thin = max(len(inds) // samples, 1)
         elif thin is None: thin = self.thin
 
         # thin the sample
-        arrays = [a[::thin] for a in arrays]
-        probs = probs[::thin]
+        inds = inds[::thin]
 
         if samples is not None:
             # we may need to trim some extra samples to meet the requested number,
             # but as they arranged in order of increasing probability, we must remove
             # elements at random in order not to introduce bias.
-            n_trim = len(probs) - samples
+            n_trim = len(inds) - samples
             if n_trim > 0:
-                trim = sort( argsort( random(size=len(probs)) )[n_trim:] )
-                arrays = [a[trim] for a in arrays]
-                probs = probs[trim]
+                trim = sort( argsort( random(size=len(inds)) )[n_trim:] )
+                inds = inds[trim]
+
+        sample = self.get_sample_array(burn = 0, thin = 1)[inds,:]
+        return list(zip( *sample.T )), self.sort_cache['probs'][inds]
 
-        return list(zip( *arrays )), probs
+    def highest_probability_indices(self, k, burn):
+        """
+        Returns the indices of the *k* highest-probability samples after the burn-in, in
+        order of increasing probability.
+
+        Only the highest-probability samples are sorted, after being found by partial
+        selection, and the result is cached so that repeated calls are fast until the
+        chain takes new steps.
+        """
+        n = len(self.probs)
+        if self.sort_cache is None or self.sort_cache['n'] != n:
+            self.sort_cache = {'n' : n, 'probs' : array(self.probs, dtype = float), 'order' : zeros(0, dtype = int)}
+        cache = self.sort_cache
+        if k <= 0: return cache['order'][:0]
+
+        if cache.get('burn') != burn:
+            cache['burn'] = burn
+            cache['top'] = cache['order'][cache['order'] >= burn]
+
+        if len(cache['top']) < k:
+            # the top (k + burn) samples of the whole chain must contain the
+            # top k samples which follow the burn-in
+            probs = cache['probs']
+            m = min(n, k + burn)
+            order = argpartition(probs, n - m)[n-m:]
+            cache['order'] = order[probs[order].argsort()]
+            cache['top'] = cache['order'][cache['order'] >= burn]
+
+        top = cache['top']
+        return top[len(top)-k:]
 
     def mode(self):
         """
@@ -517,7 +1005,7 @@ class MarkovChain(object):
         :return: Tuple containing parameter values.
         """
         ind = argmax(self.probs)
-        return [p.samples[ind] for p in self.params]
+        return list(self.get_sample_array(burn = 0, thin = 1)[ind,:])
 
     def set_non_negative(self, parameter, flag = True):
         """
@@ -715,11 +1203,32 @@ class MarkovChain(object):
         samples = [ self.get_parameter(i, burn=burn, thin=thin) for i in params ]
         trace_plot(samples, **kwargs)
 
-    def save(self, filename):
+    def save(self, filename, as_directory = False):
         """
         Save the entire state of the chain object as an .npz file.
 
         :param str filename: file path to which the chain will be saved.
+
+        :param bool as_directory: \
+            If set to ``True``, the chain is instead saved as a directory of .npy files
+            at the given path, which ``load`` opens using memory-mapping, so that only
+            the parts of the sample which are accessed are read from disk.
+        """
+        # build the dict
+        D = {}
+        for key, value in self.get_items():
+            D[key] = value
+
+        if as_directory:
+            self.save_directory(filename, D)
+        else:
+            # save as npz
+            savez(filename, **D)
+
+    def get_items(self):
+        """
+        Returns a list of (key, value) pairs describing the state of the chain, which are
+        stored by ``save``. Sub-classes extend this list with any additional state.
         """
         # get the chain attributes
         items = [
@@ -731,48 +1240,102 @@ class MarkovChain(object):
             ('inv_temp', self.inv_temp),
             ('print_status', self.print_status) ]
 
+        if self.blobs is not None:
+            items.append(('blobs', self.blobs.get(0, 1)))
+
         # get the parameter attributes
         for i, p in enumerate(self.params):
             items.extend( p.get_items(param_id=i) )
+        return items
 
-        # build the dict
-        D = {}
-        for key, value in items:
-            D[key] = value
-
-        # save as npz
-        savez(filename, **D)
+    def save_directory(self, directory, D):
+        # the samples of all parameters are saved together as a single array
+        for i in range(self.L):
+            D.pop('param_' + str(i) + 'samples')
+        D['samples'] = self.get_sample_array(burn = 0, thin = 1)
+        save_chain_directory(directory, D)
 
     @classmethod
     def load(cls, filename, posterior = None):
         """
         Load a chain object which has been previously saved using the save() method.
 
-        :param str filename: file path of the .npz file containing the chain object data.
+        :param str filename: \
+            file path of the .npz file containing the chain object data, or of the
+            directory if the chain was saved with ``as_directory = True``, in which case
+            the sample is memory-mapped rather than read into memory.
+
         :param posterior: The posterior which was sampled by the chain. This argument need \
                           only be specified if new samples are to be added to the chain.
         """
         # load the data and create a chain instance
-        D = load(filename)
+        D = load_chain_directory(filename) if isdir(filename) else load(filename)
         chain = cls(posterior=posterior)
+        chain.load_items(D)
+        return chain
 
+    def load_items(self, D):
+        """
+        Restores the state of the chain from the items stored by ``save``.
+        """
         # re-build the chain's attributes
-        chain.n = int(D['n'])
-        chain.L = int(D['L'])
-        chain.probs = list(D['probs'])
-        chain.inv_temp = float(D['inv_temp'])
-        chain.burn = int(D['burn'])
-        chain.thin = int(D['thin'])
-        chain.print_status = bool(D['print_status'])
+        self.n = int(D['n'])
+        self.L = int(D['L'])
+        self.probs = load_probabilities(D['probs'])
+        self.inv_temp = float(D['inv_temp'])
+        self.burn = int(D['burn'])
+        self.thin = int(D['thin'])
+        self.print_status = bool(D['print_status'])
+        if 'blobs' in D:
+            self.blobs = BlobStore(D['blobs'])
+            self.current_blob = self.blobs.data[self.blobs.n-1]
 
         # re-build all the parameter objects
-        chain.params = []
-        for i in range(chain.L):
+        self.params = []
+        for i in range(self.L):
             p = Parameter()
             p.load_items(dictionary=D, param_id=i)
-            chain.params.append(p)
+            self.params.append(p)
+        self.attach_sample_store(D['samples'] if 'samples' in D else None)
 
-        return chain
+    def get_tuning(self):
+        """
+        Returns the adapted tuning settings of the chain as a dictionary.
+        """
+        return {
+            'sigma' : array([p.sigma for p in self.params]),
+            'chk_int' : array([p.chk_int for p in self.params])
+        }
+
+    def set_tuning(self, tuning):
+        """
+        Applies tuning settings produced by the ``get_tuning`` method of another chain.
+        """
+        if len(tuning['sigma']) != self.L:
+            raise ValueError('the tuning settings are for a different number of parameters')
+        for p, s, c in zip(self.params, tuning['sigma'], tuning['chk_int']):
+            p.set_sigma(float(s))
+            p.chk_int = int(c)
+
+    def save_tuning(self, filename):
+        """
+        Save the adapted tuning settings of the chain (e.g. the proposal widths) as an .npz
+        file, so that a new chain sampling a similar posterior can start already tuned.
+
+        :param str filename: file path to which the tuning settings will be saved.
+        """
+        savez(filename, chain_type = type(self).__name__, **self.get_tuning())
+
+    def load_tuning(self, filename):
+        """
+        Load tuning settings which have been previously saved using the ``save_tuning`` method.
+
+        :param str filename: file path of the .npz file containing the tuning settings.
+        """
+        D = load(filename)
+        if str(D['chain_type']) != type(self).__name__:
+            warn('tuning settings saved by a {} are being loaded into a {}'.format(D['chain_type'], type(self).__name__))
+        self.set_tuning(D)
 
     def estimate_burn_in(self):
         # first get an estimate based on when the chain first reaches
@@ -818,76 +1381,1108 @@ class MarkovChain(object):
 
 
 
-class GibbsChain(MarkovChain):
+class DecomposedPosterior(object):
     """
-    A class for sampling from distributions using Gibbs-sampling.
+    Represents a log-posterior as the sum of a log-prior and one or more log-likelihood
+    'blocks', which allows the samplers ``MarkovChain``, ``GibbsChain`` and ``PcaChain``
+    to reject proposals early.
+
+    These chains draw the acceptance threshold for each proposal before the posterior
+    is evaluated. The log-prior is evaluated first, followed by each of the likelihood
+    blocks in turn. If an upper bound is known for each block, the evaluation is stopped
+    as soon as the partial sum plus the upper bounds of the remaining blocks falls below
+    the threshold, as the proposal is then certain to be rejected. In particular, the
+    likelihood is not evaluated at all for proposals which the prior alone rules out.
+
+    Counts of the number of evaluations which were completed, skipped entirely (no
+    likelihood blocks evaluated) or truncated (only some blocks evaluated) are stored
+    in the ``full_evaluations``, ``skipped_evaluations`` and ``truncated_evaluations``
+    attributes. The ``completed`` attribute indicates whether the most recent bounded
+    evaluation returned the exact log-probability rather than an upper bound.
+
+    :param func prior: \
+        A function which takes the vector of model parameters as a ``numpy.ndarray``,
+        and returns the log-prior probability.
+
+    :param likelihood_blocks: \
+        A list of functions which each take the vector of model parameters and return a
+        log-likelihood term, such that the total log-likelihood is the sum of the terms.
+        The blocks are evaluated in the given order, so cheap blocks or blocks which are
+        most likely to cause a rejection should be placed first.
+
+    :param block_maxima: \
+        A list of upper bounds on the value returned by each of the likelihood blocks.
+        If not specified, all bounds are taken to be zero, which is the case for Gaussian
+        likelihoods written as ``-0.5*(z**2).sum()``. A bound of ``numpy.inf`` may be given
+        for blocks with no known upper bound.
+    """
+    def __init__(self, prior, likelihood_blocks, block_maxima = None):
+        self.prior = prior
+        self.blocks = list(likelihood_blocks) if hasattr(likelihood_blocks, '__len__') else [likelihood_blocks]
+        if block_maxima is None:
+            block_maxima = zeros(len(self.blocks))
+        if len(block_maxima) != len(self.blocks):
+            raise ValueError('block_maxima must have the same length as likelihood_blocks')
+        # upper bound on the sum of all blocks after the first k have been evaluated
+        self.remaining_maxima = concatenate([cumsum(array(block_maxima, dtype = float)[::-1])[::-1], [0.]])
+
+        self.full_evaluations = 0
+        self.skipped_evaluations = 0
+        self.truncated_evaluations = 0
+        self.completed = True
+
+    def __call__(self, theta):
+        return self.prior(theta) + sum(f(theta) for f in self.blocks)
+
+    def bounded_evaluation(self, theta, threshold):
+        """
+        Evaluate the log-posterior, stopping as soon as its value is certain to be
+        below the given threshold.
 
-    In Gibbs sampling, each "step" in the chain consists of a series of 1D Metropolis-Hastings
-    updates, one for each parameter, such that after each step all parameters have been adjusted.
+        :param theta: The vector of model parameters as a ``numpy.ndarray``.
+        :param float threshold: The log-probability threshold.
 
-    This allows Metropolis-Hastings update acceptance rate data to be collected independently for
-    each parameter, thereby allowing the proposal width of each parameter to be tuned individually.
+        :return: \
+            The log-posterior probability if the evaluation was completed, otherwise
+            an upper bound on the log-posterior probability which is below the threshold.
+        """
+        self.completed = False
+        total = self.prior(theta)
+        if total + self.remaining_maxima[0] < threshold:
+            self.skipped_evaluations += 1
+            return total + self.remaining_maxima[0]
+
+        last = len(self.blocks) - 1
+        for k, f in enumerate(self.blocks):
+            total += f(theta)
+            if k < last and total + self.remaining_maxima[k+1] < threshold:
+                self.truncated_evaluations += 1
+                return total + self.remaining_maxima[k+1]
+
+        self.full_evaluations += 1
+        self.completed = True
+        return total
+
+    def rejection_summary(self):
+        """
+        Returns the fractions of bounded evaluations which were skipped or truncated.
 
-    :param func posterior: \
-        a function which takes the vector of model parameters as a ``numpy.ndarray``,
-        and returns the posterior log-probability.
+        :return: A dictionary with keys 'skipped' and 'truncated'.
+        """
+        total = max(self.full_evaluations + self.skipped_evaluations + self.truncated_evaluations, 1)
+        return {'skipped' : self.skipped_evaluations / total,
+                'truncated' : self.truncated_evaluations / total}
 
-    :param start: \
-        vector of model parameters which correspond to the parameter-space coordinates at which
-        the chain will start.
 
-    :param widths: \
-        vector of standard deviations which serve as initial guesses for the widths of the proposal
-        distribution for each model parameter. If not specified, the starting widths will be
-        approximated as 5% of the values in 'start'.
-    """
-    def __init__(self, *args, **kwargs):
-        super(GibbsChain, self).__init__(*args, **kwargs)
-        # we need to adjust the target acceptance rate to 50%
-        # which is optimal for gibbs sampling:
-        if hasattr(self, 'params'):
-            for p in self.params:
-                p.target_rate = 0.5
 
-    def take_step(self):
-        """
-        Take a 1D metropolis-hastings step for each parameter
-        """
-        p_old = self.probs[-1]
-        prop = array([p.samples[-1] for p in self.params])
 
-        for i, p in enumerate(self.params):
 
-            while True:
-                prop[i] = p.proposal()
-                p_new = self.posterior(prop) * self.inv_temp
 
-                if p_new > p_old:
-                    p.submit_accept_prob(1.)
-                    break
-                else:
-                    test = random()
-                    acceptance_prob = exp(p_new-p_old)
-                    p.submit_accept_prob(acceptance_prob)
-                    if test < acceptance_prob:
-                        break
+class PosteriorEmulator(object):
+    """
+    A Gaussian-process emulator of the log-posterior probability, which is used by
+    the ``MarkovChain``, ``GibbsChain`` and ``PcaChain`` samplers to perform
+    delayed-acceptance MCMC.
+
+    In delayed-acceptance, each proposal is first subjected to a Metropolis-Hastings
+    test using the emulated log-probabilities, and the exact posterior is evaluated only
+    for proposals which pass this first stage. A second test using the exact posterior
+    then corrects for the error in the emulator, so the chain still samples from the
+    exact posterior. When the emulator is accurate, most of the proposals which would
+    be rejected are screened out without evaluating the posterior.
+
+    The emulator is trained on the posterior evaluations made by the chain. Once
+    ``min_points`` evaluations have been collected, a ``GpRegressor`` is fitted, and
+    is rebuilt as each new evaluation arrives. The hyper-parameters are re-optimised
+    only every ``refit_interval`` new evaluations, and are otherwise re-used, so each
+    rebuild is cheap. The emulator stops updating once ``max_points`` evaluations have
+    been collected, which bounds the cost of using it.
+
+    :param int min_points: \
+        The number of posterior evaluations required before the emulator is used.
+
+    :param int max_points: \
+        The maximum number of posterior evaluations used to train the emulator.
+
+    :param int refit_interval: \
+        The number of new evaluations after which the hyper-parameters are re-optimised.
+
+    :param float clip: \
+        Log-probability values lower than the current maximum value by more than ``clip``
+        are raised to that level before training, as very low values are both difficult to
+        emulate and irrelevant to the screening.
+
+    :param float noise: \
+        The standard deviation of the noise assumed on the log-probability values,
+        which regularises the fit when training points are close together.
+    """
+    def __init__(self, min_points = 30, max_points = 300, refit_interval = 50, clip = 50., noise = 0.05):
+        self.min_points = min_points
+        self.max_points = max_points
+        self.refit_interval = refit_interval
+        self.clip = clip
+        self.noise = noise
+
+        self.x = []
+        self.y = []
+        self.gp = None
+        self.last_refit = 0
+
+        # counters for proposals which failed / passed the first-stage screening
+        self.screened = 0
+        self.passed = 0
 
-            p_old = deepcopy(p_new)  # NOTE - is deepcopy needed?
+    @property
+    def ready(self):
+        return self.gp is not None
 
-        for v, p in zip(prop, self.params):
-            p.add_sample(v)
+    def __call__(self, theta):
+        mu, sig = self.gp(theta)
+        return mu[0]
 
-        self.probs.append(p_new)
-        self.n += 1
+    def add_point(self, theta, log_prob):
+        """
+        Add a new posterior evaluation to the training data and update the emulator.
 
+        :param theta: The vector of model parameters as a ``numpy.ndarray``.
+        :param float log_prob: The log-probability at ``theta``.
+        """
+        if len(self.y) >= self.max_points or not isfinite(log_prob):
+            return
+        self.x.append(array(theta, dtype = float))
+        self.y.append(log_prob)
+        if len(self.y) >= self.min_points:
+            self.update()
+
+    def update(self):
+        y = array(self.y)
+        y = maximum(y, y.max() - self.clip)
+        errors = zeros(len(y)) + self.noise
+        if self.gp is None or len(y) - self.last_refit >= self.refit_interval:
+            self.gp = GpRegressor(self.x, y, y_err = errors)
+            self.last_refit = len(y)
+        else:
+            self.gp = GpRegressor(self.x, y, y_err = errors, hyperpars = self.gp.hyperpars)
 
+    def screening_rate(self):
+        """
+        Returns the fraction of screened proposals which were rejected by the emulator.
+        """
+        return self.screened / max(self.screened + self.passed, 1)
 
 
 
 
-class PcaChain(MarkovChain):
-    """
-    A class which performs Gibbs sampling over the eigenvectors of the covariance matrix.
+
+
+class IncrementalPosterior(ABC):
+    """
+    Base class for posteriors which cache intermediate quantities (for example the
+    contributions of separate components to a forward-model prediction), so that
+    when only some of the parameters change, only the affected quantities need
+    to be re-calculated.
+
+    Chains which sample a posterior derived from this class evaluate each proposed point
+    using ``propose``, and then call either ``commit`` if the point was accepted, or
+    ``rollback`` if it was rejected. The cached quantities therefore always correspond
+    to the current position of the chain, and updates which change one parameter (as in
+    ``GibbsChain``) only cost the re-calculation of the quantities which depend on it.
+
+    Subclasses must implement the following methods:
+
+    - ``initial_state(theta)`` which calculates the cached quantities from scratch.
+    - ``update_state(state, theta, changed)`` which returns the cached quantities for the
+      parameters ``theta``, given the quantities ``state`` for the current position and
+      an array of the indices of the parameters which have changed. The given state must
+      not be modified in-place, as it is still required if the proposal is rejected.
+    - ``log_probability(theta, state)`` which returns the posterior log-probability
+      using the cached quantities.
+
+    As the cached quantities track the position of a single chain, an instance should
+    not be shared between chains. Incremental evaluation is not combined with
+    early-rejection, and chains sampling an incremental posterior cannot use prefetching.
+    """
+    theta = None
+    state = None
+    pending = None
+
+    def __call__(self, theta):
+        return self.log_probability(theta, self.initial_state(theta))
+
+    def propose(self, theta):
+        """
+        Returns the log-probability of the given parameters, calculated using an update
+        of the cached quantities. The updated quantities are stored until either
+        ``commit`` or ``rollback`` is called.
+        """
+        theta = array(theta, dtype = float)
+        if self.state is None or theta.shape != self.theta.shape:
+            state = self.initial_state(theta)
+        else:
+            changed = (theta != self.theta).nonzero()[0]
+            state = self.update_state(self.state, theta, changed)
+        self.pending = (theta, state)
+        return self.log_probability(theta, state)
+
+    def commit(self):
+        """
+        Replace the cached quantities with those of the most recently proposed parameters.
+        """
+        if self.pending is not None:
+            self.theta, self.state = self.pending
+            self.pending = None
+
+    def rollback(self):
+        """
+        Discard the cached quantities of the most recently proposed parameters.
+        """
+        self.pending = None
+
+    @abstractmethod
+    def initial_state(self, theta):
+        pass
+
+    @abstractmethod
+    def update_state(self, state, theta, changed):
+        pass
+
+    @abstractmethod
+    def log_probability(self, theta, state):
+        pass
+
+
+
+
+
+
+class BlobPosterior(object):
+    """
+    Wraps a posterior function which also returns derived quantities ('blobs'), such as
+    model predictions, so that they can be stored by the chain for each sample rather
+    than being re-calculated afterwards.
+
+    Chains which sample an instance of this class store the derived quantities for
+    each step alongside the posterior log-probability, and they can be retrieved using
+    the ``get_blobs`` method of the chain. This is supported by ``MarkovChain``,
+    ``GibbsChain``, ``BlockGibbsChain``, ``AdaptiveMetropolisChain``, ``PcaChain`` and
+    ``HamiltonianChain`` (including when used by ``ParallelTempering``), but cannot be
+    combined with prefetching or used by ``ChromaticGibbsChain``.
+
+    :param func function: \
+        A function which takes the vector of model parameters as a ``numpy.ndarray``, and
+        returns the posterior log-probability followed by the derived quantities, which
+        can be a float or an array-like of fixed shape.
+    """
+    def __init__(self, function):
+        self.function = function
+        self.blob = None  # derived quantities from the most recent evaluation
+
+    def __call__(self, theta):
+        log_prob, blob = self.function(theta)
+        self.blob = array(blob, dtype = float)
+        return log_prob
+
+
+
+
+class BlobStore(object):
+    """
+    Stores derived quantities in a single array which grows in size as required,
+    so that sliced access does not require any copying.
+    """
+    def __init__(self, data = None):
+        if data is None:
+            self.data = None
+            self.n = 0
+        else:
+            self.data = data
+            self.n = self.data.shape[0]
+
+    def append(self, blob):
+        if self.data is None:
+            self.data = zeros((1024,) + blob.shape)
+        elif self.n == self.data.shape[0]:
+            self.data = concatenate([self.data, zeros(self.data.shape)])
+        self.data[self.n] = blob
+        self.n += 1
+
+    def get(self, burn, thin):
+        return self.data[:self.n][burn::thin]
+
+
+
+
+class GibbsChain(MarkovChain):
+    """
+    A class for sampling from distributions using Gibbs-sampling.
+
+    In Gibbs sampling, each "step" in the chain consists of a series of 1D Metropolis-Hastings
+    updates, one for each parameter, such that after each step all parameters have been adjusted.
+
+    This allows Metropolis-Hastings update acceptance rate data to be collected independently for
+    each parameter, thereby allowing the proposal width of each parameter to be tuned individually.
+
+    :param func posterior: \
+        a function which takes the vector of model parameters as a ``numpy.ndarray``,
+        and returns the posterior log-probability.
+
+    :param start: \
+        vector of model parameters which correspond to the parameter-space coordinates at which
+        the chain will start.
+
+    :param widths: \
+        vector of standard deviations which serve as initial guesses for the widths of the proposal
+        distribution for each model parameter. If not specified, the starting widths will be
+        approximated as 5% of the values in 'start'.
+
+    :param bool slice_sampling: \
+        If set to ``True``, each parameter is updated using 1D slice-sampling (with the
+        'stepping-out' and 'shrinkage' procedures) instead of a Metropolis-Hastings step.
+        Slice-sampling updates always move the parameter, and require a predictable number
+        of posterior evaluations. The initial slice width for each parameter is given by
+        its proposal width, and is subsequently adapted from the sample. Slice-sampling
+        cannot be combined with an emulator or with prefetching.
+    """
+    def __init__(self, *args, slice_sampling = False, **kwargs):
+        super(GibbsChain, self).__init__(*args, **kwargs)
+        # we need to adjust the target acceptance rate to 50%
+        # which is optimal for gibbs sampling:
+        if hasattr(self, 'params'):
+            for p in self.params:
+                p.target_rate = 0.5
+
+        # settings for slice-sampling updates
+        if slice_sampling and self.emulator is not None:
+            raise ValueError('slice-sampling updates cannot be used together with an emulator')
+        self.slice_sampling = slice_sampling
+        self.max_steps_out = 4  # maximum number of times the slice interval is expanded
+        if hasattr(self, 'L'):
+            self.expansions = zeros(self.L, dtype = int)
+            self.contractions = zeros(self.L, dtype = int)
+            self.slice_updates = zeros(self.L, dtype = int)
+
+    def get_items(self):
+        items = super(GibbsChain, self).get_items()
+        # settings and adaptation counters of the slice-sampling updates
+        items.extend([
+            ('slice_sampling', self.slice_sampling),
+            ('max_steps_out', self.max_steps_out),
+            ('expansions', self.expansions),
+            ('contractions', self.contractions),
+            ('slice_updates', self.slice_updates) ])
+        return items
+
+    def load_items(self, D):
+        super(GibbsChain, self).load_items(D)
+        if 'slice_sampling' in D:
+            self.slice_sampling = bool(D['slice_sampling'])
+            self.max_steps_out = int(D['max_steps_out'])
+            self.expansions = array(D['expansions'], dtype = int)
+            self.contractions = array(D['contractions'], dtype = int)
+            self.slice_updates = array(D['slice_updates'], dtype = int)
+        else:
+            self.expansions = zeros(self.L, dtype = int)
+            self.contractions = zeros(self.L, dtype = int)
+            self.slice_updates = zeros(self.L, dtype = int)
+
+    def take_step(self):
+        """
+        Take a 1D metropolis-hastings step for each parameter
+        """
+        if self.slice_sampling:
+            self.take_slice_step()
+            return
+
+        p_old = self.probs[-1]
+        theta = array([p.samples[-1] for p in self.params], dtype = float)
+
+        for i, p in enumerate(self.params):
+            prop = theta.copy()
+            while True:
+                if self.prefetcher is not None:
+                    self.prefetcher.update(self.predict_coordinate_proposals, theta, p_old, i)
+                prop[i] = p.proposal()
+                accept, p_new, accept_prob = self.metropolis_test(theta, prop, p_old)
+                p.submit_accept_prob(accept_prob)
+                if accept:
+                    break
+
+            if self.prefetcher is not None:
+                self.prefetcher.reset()
+            theta = prop
+            p_old = p_new
+
+        for v, p in zip(theta, self.params):
+            p.add_sample(v)
+
+        self.probs.append(p_new)
+        self.record_blob()
+        self.n += 1
+
+    def take_slice_step(self):
+        """
+        Take a 1D slice-sampling step for each parameter
+        """
+        p_old = self.probs[-1]
+        theta = array([p.samples[-1] for p in self.params], dtype = float)
+        for i in range(self.L):
+            theta, p_old = self.slice_update(theta, p_old, i)
+
+        for v, p in zip(theta, self.params):
+            p.add_sample(v)
+
+        self.probs.append(p_old)
+        self.record_blob()
+        self.n += 1
+
+    def slice_update(self, theta, p_old, i):
+        p = self.params[i]
+        x0 = theta[i]
+        w = p.sigma
+        prop = theta.copy()
+
+        def above_slice(x):
+            prop[i] = x
+            above = self.evaluate(prop, log_y) > log_y
+            self.resolve_evaluation(False)
+            return above
+
+        # draw the height of the slice
+        log_y = p_old + log(random())
+
+        # find the limits imposed by any constraints on the parameter
+        if p.bounded:
+            lwr_limit, upr_limit = p.lower, p.upper
+        elif p.non_negative:
+            lwr_limit, upr_limit = 0., inf
+        else:
+            lwr_limit, upr_limit = -inf, inf
+
+        # randomly position the initial interval around the current value, then
+        # step outwards until both ends lie outside the slice
+        lwr = x0 - w * random()
+        upr = lwr + w
+        j = int(self.max_steps_out * random())
+        k = self.max_steps_out - 1 - j
+        while j > 0 and lwr > lwr_limit and above_slice(lwr):
+            lwr -= w
+            j -= 1
+            self.expansions[i] += 1
+        while k > 0 and upr < upr_limit and above_slice(upr):
+            upr += w
+            k -= 1
+            self.expansions[i] += 1
+        lwr = max(lwr, lwr_limit)
+        upr = min(upr, upr_limit)
+
+        # sample uniformly from the interval, shrinking it after each rejected point
+        while True:
+            x1 = lwr + (upr - lwr) * random()
+            prop[i] = x1
+            p_new = self.evaluate(prop, log_y)
+            self.resolve_evaluation(p_new > log_y)
+            if p_new > log_y:
+                break
+            if x1 < x0:
+                lwr = x1
+            else:
+                upr = x1
+            self.contractions[i] += 1
+
+        self.update_slice_width(i)
+        return prop, p_new
+
+    def update_slice_width(self, i):
+        """
+        Periodically adjusts the slice width of a parameter so that the number of times the
+        slice interval is expanded balances the number of times it is contracted. Widths
+        which are too small lead to many expansions, and widths which are too large lead to
+        many contractions.
+        """
+        p = self.params[i]
+        self.slice_updates[i] += 1
+        if self.slice_updates[i] >= p.chk_int:
+            total = self.expansions[i] + self.contractions[i]
+            ratio = 2. * max(self.expansions[i], 1) / max(total, 1)
+            if 0.8 < ratio < 1.25: # width is close to optimal, so check less often
+                p.chk_int = int((p.growth_factor * p.chk_int) * 0.1) * 10
+            else:
+                p.adjust_sigma(min(max(ratio, 0.1), 10.))
+            self.expansions[i] = 0
+            self.contractions[i] = 0
+            self.slice_updates[i] = 0
+
+    def predict_coordinate_proposals(self, n, theta, p_old, i):
+        """
+        Predicts the next *n* proposals and thresholds for the update of the *i*'th
+        parameter without changing the state of the random number generator.
+        """
+        state = get_state()
+        p = self.params[i]
+        proposals = []
+        thresholds = []
+        for j in range(n):
+            prop = theta.copy()
+            prop[i] = p.constrain(p.samples[-1] + p.sigma * normal())
+            proposals.append(prop)
+            thresholds.append(p_old + log(random()))
+        set_state(state)
+        return proposals, thresholds
+
+
+
+
+
+
+class ChromaticGibbsChain(GibbsChain):
+    """
+    A class for Gibbs sampling of posteriors with conditional-independence structure,
+    where groups of conditionally independent parameters are updated concurrently
+    ('chromatic' Gibbs sampling).
+
+    The parameters are partitioned into 'colours', such that no two parameters of the
+    same colour appear together in any term of the posterior. Each step in the chain
+    updates the colours in turn, and all parameters of a colour are updated at the same
+    time using 1D Metropolis-Hastings updates. Only the terms of the posterior which
+    involve the parameter being updated (its 'local' log-probability) are evaluated,
+    and the local log-probabilities for all parameters of a colour are evaluated as a
+    batch - either through a single vectorised call, or across a pool of processes.
+
+    :param func posterior: \
+        a function which takes the vector of model parameters as a ``numpy.ndarray``,
+        and returns the posterior log-probability. This is only evaluated at the starting
+        position, after which the log-probability is tracked using the local log-probabilities.
+
+    :param func local_posterior: \
+        a function which takes the vector of model parameters as a ``numpy.ndarray`` and
+        the index of a parameter, and returns the sum of all terms in the posterior
+        log-probability which depend on that parameter.
+
+    :param start: \
+        vector of model parameters which correspond to the parameter-space coordinates at which
+        the chain will start.
+
+    :param widths: \
+        vector of standard deviations which serve as initial guesses for the widths of the proposal
+        distribution for each model parameter. If not specified, the starting widths will be
+        approximated as 5% of the values in 'start'.
+
+    :param colouring: \
+        A list of lists of integers, where each list contains the indices of the parameters
+        with the same colour. Every parameter must be given exactly one colour.
+
+    :param dependencies: \
+        A list which contains, for each parameter, the indices of the other parameters with
+        which it appears in a term of the posterior. If a colouring is not given, one is
+        generated from the dependencies using ``greedy_colouring``.
+
+    :param bool vectorised: \
+        If set to ``True``, ``local_posterior`` is instead called once per batch with a 2D
+        ``numpy.ndarray`` of parameter vectors and a 1D array of parameter indices, and must
+        return a 1D array containing the local log-probability for each.
+
+    :param int n_processes: \
+        The number of processes across which the local log-probabilities are evaluated when
+        ``local_posterior`` is not vectorised. It must be picklable if this is greater than 1.
+    """
+    def __init__(self, posterior = None, local_posterior = None, start = None, widths = None, colouring = None,
+                 dependencies = None, temperature = 1., vectorised = False, n_processes = 1):
+        super(ChromaticGibbsChain, self).__init__(posterior = posterior, start = start, widths = widths, temperature = temperature)
+        if self.blobs is not None:
+            # the chain is advanced using the local log-probabilities, so the derived quantities are never updated
+            raise ValueError('ChromaticGibbsChain cannot be used with a posterior which provides derived quantities')
+        self.local_posterior = local_posterior
+        self.vectorised = vectorised
+        self.evaluator = BatchEvaluator(function = LocalEvaluation(local_posterior), n_processes = n_processes)
+
+        if posterior is not None:
+            if colouring is None:
+                if dependencies is None:
+                    raise ValueError('either a colouring or the dependencies of the parameters must be given')
+                colouring = greedy_colouring(dependencies)
+
+            colouring = [list(c) for c in colouring]
+            coloured = [i for c in colouring for i in c]
+            if sorted(coloured) != list(range(self.L)):
+                raise ValueError('each parameter must be given exactly one colour')
+
+            if dependencies is not None:
+                colours = zeros(self.L, dtype = int)
+                for k, c in enumerate(colouring):
+                    colours[c] = k
+                for i, d in enumerate(dependencies):
+                    if any(colours[j] == colours[i] for j in d if j != i):
+                        raise ValueError('dependent parameters cannot share the same colour')
+
+            self.colouring = [array(c, dtype = int) for c in colouring]
+
+    def get_items(self):
+        items = super(ChromaticGibbsChain, self).get_items()
+        items.append(('vectorised', self.vectorised))
+        items.append(('n_colours', len(self.colouring)))
+        for k, c in enumerate(self.colouring):
+            items.append(('colour_{}_indices'.format(k), c))
+        return items
+
+    def load_items(self, D):
+        super(ChromaticGibbsChain, self).load_items(D)
+        self.vectorised = bool(D['vectorised'])
+        self.colouring = [array(D['colour_{}_indices'.format(k)], dtype = int) for k in range(int(D['n_colours']))]
+
+    @classmethod
+    def load(cls, filename, posterior = None, local_posterior = None, n_processes = 1):
+        """
+        Load a chain object which has been previously saved using the save() method.
+
+        :param str filename: \
+            file path of the .npz file containing the chain object data, or of the
+            directory if the chain was saved with ``as_directory = True``.
+
+        :param posterior: The posterior which was sampled by the chain. This argument need \
+                          only be specified if new samples are to be added to the chain.
+
+        :param local_posterior: The local log-probability function used by the chain. This \
+                                argument need only be specified if new samples are to be \
+                                added to the chain.
+
+        :param int n_processes: \
+            The number of processes across which the local log-probabilities are evaluated
+            when ``local_posterior`` is not vectorised.
+        """
+        D = load_chain_directory(filename) if isdir(filename) else load(filename)
+        # the colouring is restored from the file, so the posterior is attached after construction
+        chain = cls(local_posterior = local_posterior, n_processes = n_processes)
+        chain.posterior = posterior
+        chain.load_items(D)
+        return chain
+
+    def take_step(self):
+        """
+        Take a 1D metropolis-hastings step for each parameter, updating the parameters
+        of each colour concurrently.
+        """
+        p_old = self.probs[-1]
+        theta = array([p.samples[-1] for p in self.params], dtype = float)
+
+        for colour in self.colouring:
+            # the local log-probabilities at the current position only change
+            # when the parameters of another colour are updated
+            current = self.evaluate_local([theta] * len(colour), colour)
+            pending = arange(len(colour))
+            while len(pending) > 0:
+                indices = colour[pending]
+                proposals = []
+                for i in indices:
+                    prop = theta.copy()
+                    prop[i] = self.params[i].proposal()
+                    proposals.append(prop)
+
+                thresholds = current[pending] + log(random(size = len(pending)))
+                values = self.evaluate_local(proposals, indices)
+
+                rejected = []
+                for k, i, prop, v, t in zip(pending, indices, proposals, values, thresholds):
+                    self.params[i].submit_accept_prob(exp(min(v - current[k], 0.)))
+                    if v > t:
+                        theta[i] = prop[i]
+                        p_old += v - current[k]
+                    else:
+                        rejected.append(k)
+                pending = array(rejected, dtype = int)
+
+        for v, p in zip(theta, self.params):
+            p.add_sample(v)
+
+        self.probs.append(p_old)
+        self.n += 1
+
+    def evaluate_local(self, points, indices):
+        """
+        Returns the tempered local log-probabilities for a batch of parameter vectors,
+        where the local log-probability of the parameter with the corresponding index
+        is evaluated at each vector.
+        """
+        if self.vectorised:
+            values = self.local_posterior(array(points), array(indices))
+        else:
+            values = self.evaluator(list(zip(points, indices)))
+        return array(values, dtype = float).reshape(len(indices)) * self.inv_temp
+
+    def close(self):
+        """
+        Shut down the process pool used to evaluate the local log-probabilities, if one has been created.
+        """
+        self.evaluator.close()
+
+
+
+
+
+
+class LocalEvaluation(object):
+    """
+    Picklable wrapper which evaluates a local log-probability function for
+    a (parameter vector, parameter index) pair.
+    """
+    def __init__(self, local_posterior):
+        self.local_posterior = local_posterior
+
+    def __call__(self, task):
+        theta, i = task
+        return self.local_posterior(theta, i)
+
+
+
+
+
+
+def greedy_colouring(dependencies):
+    """
+    Generates a colouring of the parameters such that no two dependent parameters share
+    the same colour, using a greedy algorithm where the parameters with the most
+    dependencies are coloured first.
+
+    :param dependencies: \
+        A list which contains, for each parameter, the indices of the other parameters
+        on which it depends. Dependencies are treated as symmetric.
+
+    :return: A list of lists of integers, each containing the indices of the parameters of one colour.
+    """
+    L = len(dependencies)
+    neighbours = [set() for i in range(L)]
+    for i, d in enumerate(dependencies):
+        for j in d:
+            if j != i:
+                neighbours[i].add(j)
+                neighbours[j].add(i)
+
+    colours = full(L, -1, dtype = int)
+    for i in sorted(range(L), key = lambda k: -len(neighbours[k])):
+        used = {colours[j] for j in neighbours[i]}
+        c = 0
+        while c in used: c += 1
+        colours[i] = c
+
+    return [list(arange(L)[colours == c]) for c in range(colours.max() + 1)]
+
+
+
+
+
+
+class ProposalCovariance(object):
+    """
+    Maintains a running estimate of the covariance of a group of parameters, and
+    uses it to generate steps from a multivariate-normal proposal distribution.
+
+    Until ``adapt_start`` samples have been collected, the proposal covariance is
+    diagonal with the given initial widths. After this, the proposal covariance is
+    the estimated covariance multiplied by a scale factor, which starts at the
+    value of 2.38^2 / d (where d is the number of parameters) that is optimal for
+    Gaussian targets, and is then adjusted to bring the acceptance rate towards its
+    target. The Cholesky factor of the covariance is only re-calculated every
+    ``update_interval`` samples.
+
+    :param widths: \
+        The initial standard deviations of the proposal distribution for each parameter.
+
+    :param int adapt_start: \
+        The number of samples which must be collected before the estimated covariance
+        is used. If not specified, a value of 10 times the number of parameters (with
+        a minimum of 100) is used.
+
+    :param int update_interval: \
+        The number of samples between updates of the Cholesky factor.
+
+    :param float target_rate: \
+        The target acceptance rate. If not specified, a value of 0.234 is used for multiple
+        parameters, or 0.44 for a single parameter.
+    """
+    def __init__(self, widths, adapt_start = None, update_interval = 20, target_rate = None):
+        self.d = len(widths)
+        self.mean = zeros(self.d)
+        self.scatter = zeros([self.d, self.d])
+        self.count = 0
+
+        self.adapt_start = max(10 * self.d, 100) if adapt_start is None else adapt_start
+        self.update_interval = update_interval
+        self.target_rate = (0.234 if self.d > 1 else 0.44) if target_rate is None else target_rate
+
+        self.base_scale = 2.38**2 / self.d
+        self.log_scale_adjust = 0.
+        self.scale_updates = 0
+        self.chol = diag(array(widths, dtype = float))
+        self.adapted = False
+
+    @property
+    def scale(self):
+        return self.base_scale * exp(self.log_scale_adjust)
+
+    def add_sample(self, x):
+        """
+        Update the running mean and covariance estimates with a new sample.
+        """
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.scatter += outer(delta, x - self.mean)
+        if self.count >= self.adapt_start and self.count % self.update_interval == 0:
+            self.update_cholesky()
+
+    def covariance(self):
+        return self.scatter / max(self.count - 1, 1)
+
+    def update_cholesky(self):
+        C = self.covariance()
+        # add a small diagonal term to ensure the matrix is positive-definite
+        C += identity(self.d) * (1e-10 * max(C.diagonal().mean(), 1e-300))
+        try:
+            self.chol = cholesky(C, lower = True)
+            self.adapted = True
+        except Exception:
+            pass
+
+    def submit_accept_prob(self, p):
+        """
+        Adjust the proposal scale factor towards the target acceptance rate, using
+        diminishing adaptation so that adjustments become smaller over time. The
+        adjustment is limited, as the target rate may not be reachable (e.g. for a
+        nearly uniform distribution over a bounded region).
+        """
+        if self.adapted:
+            self.scale_updates += 1
+            self.log_scale_adjust += (p - self.target_rate) / sqrt(self.scale_updates)
+            self.log_scale_adjust = min(max(self.log_scale_adjust, -10.), 10.)
+
+    def draw(self):
+        """
+        Returns a step drawn from the proposal distribution.
+        """
+        z = normal(size = self.d)
+        if self.adapted:
+            return sqrt(self.scale) * dot(self.chol, z)
+        else:
+            return dot(self.chol, z)
+
+    def widths(self):
+        """
+        Returns the standard deviation of the proposal distribution for each parameter.
+        """
+        w = sqrt((self.chol**2).sum(axis = 1))
+        return w * sqrt(self.scale) if self.adapted else w
+
+    def get_items(self, block_id):
+        i = 'block_' + str(block_id) + '_'
+        items = [
+            (i+'mean', self.mean),
+            (i+'scatter', self.scatter),
+            (i+'count', self.count),
+            (i+'adapt_start', self.adapt_start),
+            (i+'update_interval', self.update_interval),
+            (i+'target_rate', self.target_rate),
+            (i+'log_scale_adjust', self.log_scale_adjust),
+            (i+'scale_updates', self.scale_updates),
+            (i+'chol', self.chol),
+            (i+'adapted', self.adapted) ]
+        return items
+
+    def load_items(self, dictionary, block_id):
+        i = 'block_' + str(block_id) + '_'
+        self.mean = array(dictionary[i+'mean'], dtype = float)
+        self.scatter = array(dictionary[i+'scatter'], dtype = float)
+        self.count = int(dictionary[i+'count'])
+        self.d = len(self.mean)
+        self.adapt_start = int(dictionary[i+'adapt_start'])
+        self.update_interval = int(dictionary[i+'update_interval'])
+        self.target_rate = float(dictionary[i+'target_rate'])
+        self.base_scale = 2.38**2 / self.d
+        self.log_scale_adjust = float(dictionary[i+'log_scale_adjust'])
+        self.scale_updates = int(dictionary[i+'scale_updates'])
+        self.chol = array(dictionary[i+'chol'], dtype = float)
+        self.adapted = bool(dictionary[i+'adapted'])
+
+
+
+
+
+
+class BlockGibbsChain(MarkovChain):
+    """
+    A class for Gibbs sampling where parameters are updated in user-defined groups ('blocks').
+
+    Each step in the chain consists of one Metropolis-Hastings update for each block, where
+    all parameters in the block are changed together using a multivariate-normal proposal.
+    The proposal covariance of each block is adapted from the sample (see ``ProposalCovariance``),
+    so strongly correlated parameters placed in the same block can be sampled efficiently. Each
+    step requires one posterior evaluation per block, rather than at least one per parameter.
+
+    :param func posterior: \
+        a function which takes the vector of model parameters as a ``numpy.ndarray``,
+        and returns the posterior log-probability.
+
+    :param start: \
+        vector of model parameters which correspond to the parameter-space coordinates at which
+        the chain will start.
+
+    :param widths: \
+        vector of standard deviations which serve as initial guesses for the widths of the proposal
+        distribution for each model parameter. If not specified, the starting widths will be
+        approximated as 5% of the values in 'start'.
+
+    :param groups: \
+        A list of lists of integers, where each list contains the indices of the parameters in
+        one block. Any parameters which are not included in a block are updated individually.
+    """
+    def __init__(self, *args, groups = None, **kwargs):
+        super(BlockGibbsChain, self).__init__(*args, **kwargs)
+
+        if hasattr(self, 'params'):
+            groups = [] if groups is None else [list(g) for g in groups]
+            grouped = [i for g in groups for i in g]
+            if len(grouped) != len(set(grouped)) or any(not (0 <= i < self.L) for i in grouped):
+                raise ValueError('each parameter index may appear in at most one of the given groups')
+            groups.extend([[i] for i in range(self.L) if i not in grouped])
+            self.groups = [array(g, dtype = int) for g in groups]
+            self.proposals = [ProposalCovariance([self.params[i].sigma for i in g]) for g in self.groups]
+
+    def take_step(self):
+        """
+        Take a Metropolis-Hastings step for each block of parameters
+        """
+        p_old = self.probs[-1]
+        theta = array([p.samples[-1] for p in self.params], dtype = float)
+
+        for g, pc in zip(self.groups, self.proposals):
+            prop = theta.copy()
+            prop[g] += pc.draw()
+            for i in g:
+                prop[i] = self.params[i].constrain(prop[i])
+
+            accept, p_new, accept_prob = self.metropolis_test(theta, prop, p_old)
+            pc.submit_accept_prob(accept_prob)
+            if accept:
+                theta = prop
+                p_old = p_new
+
+        for v, p in zip(theta, self.params):
+            p.add_sample(v)
+
+        for g, pc in zip(self.groups, self.proposals):
+            updated = pc.adapted
+            pc.add_sample(theta[g])
+            # record the proposal widths whenever the covariance is re-estimated
+            if pc.adapted and (not updated or pc.count % pc.update_interval == 0):
+                for i, w in zip(g, pc.widths()):
+                    self.params[i].adjust_sigma(w / self.params[i].sigma)
+
+        self.probs.append(p_old)
+        self.record_blob()
+        self.n += 1
+
+    def get_items(self):
+        items = super(BlockGibbsChain, self).get_items()
+        items.append(('n_groups', len(self.groups)))
+        for k, (g, pc) in enumerate(zip(self.groups, self.proposals)):
+            items.append(('block_{}_indices'.format(k), g))
+            items.extend( pc.get_items(block_id=k) )
+        return items
+
+    def load_items(self, D):
+        super(BlockGibbsChain, self).load_items(D)
+        # re-build the groups and their adapted proposal distributions
+        self.groups = []
+        self.proposals = []
+        for k in range(int(D['n_groups'])):
+            g = array(D['block_{}_indices'.format(k)], dtype = int)
+            pc = ProposalCovariance(widths = zeros(len(g)))
+            pc.load_items(dictionary = D, block_id = k)
+            self.groups.append(g)
+            self.proposals.append(pc)
+
+    def get_tuning(self):
+        tuning = super(BlockGibbsChain, self).get_tuning()
+        for k, (g, pc) in enumerate(zip(self.groups, self.proposals)):
+            tuning['block_{}_indices'.format(k)] = g
+            tuning['block_{}_chol'.format(k)] = pc.chol
+            tuning['block_{}_log_scale_adjust'.format(k)] = pc.log_scale_adjust
+            tuning['block_{}_adapted'.format(k)] = pc.adapted
+        return tuning
+
+    def set_tuning(self, tuning):
+        super(BlockGibbsChain, self).set_tuning(tuning)
+        for k, (g, pc) in enumerate(zip(self.groups, self.proposals)):
+            key = 'block_{}_'.format(k)
+            if key + 'indices' not in tuning or list(tuning[key + 'indices']) != list(g):
+                raise ValueError('the tuning settings are for a different set of parameter groups')
+            pc.chol = array(tuning[key + 'chol'])
+            pc.log_scale_adjust = float(tuning[key + 'log_scale_adjust'])
+            pc.adapted = bool(tuning[key + 'adapted'])
+
+
+
+
+
+
+class AdaptiveMetropolisChain(BlockGibbsChain):
+    """
+    Implementation of the adaptive-Metropolis algorithm, where each step of the chain
+    is a single Metropolis-Hastings update of all parameters using a multivariate-normal
+    proposal distribution.
+
+    The proposal covariance is adapted from the sample as the chain advances (see
+    ``ProposalCovariance``), with a scale factor which starts at 2.38^2 / d for d
+    parameters and is adjusted to reach the target acceptance rate. This allows
+    strongly correlated posteriors to be sampled efficiently, while requiring
+    only one posterior evaluation per step. If a proposal is rejected, the
+    current position is repeated in the chain.
+
+    :param func posterior: \
+        a function which takes the vector of model parameters as a ``numpy.ndarray``,
+        and returns the posterior log-probability.
+
+    :param start: \
+        vector of model parameters which correspond to the parameter-space coordinates at which
+        the chain will start.
+
+    :param widths: \
+        vector of standard deviations which are used as the proposal widths until enough samples
+        have been collected to estimate the covariance. If not specified, the starting widths
+        will be approximated as 5% of the values in 'start'.
+
+    :param int adapt_start: \
+        The number of steps after which the estimated covariance is used. If not specified,
+        a value of 10 times the number of parameters (with a minimum of 100) is used.
+
+    :param float target_rate: \
+        The target acceptance rate of the proposals. If not specified, a value of 0.44 is
+        used for a single parameter, and 0.234 otherwise.
+    """
+    def __init__(self, posterior = None, start = None, widths = None, temperature = 1., emulator = None,
+                 adapt_start = None, target_rate = None):
+        groups = None if start is None else [list(range(len(start)))]
+        super(AdaptiveMetropolisChain, self).__init__(posterior, start, widths, temperature, emulator, groups = groups)
+
+        if hasattr(self, 'params') and self.L > 0:
+            self.proposals = [ProposalCovariance([p.sigma for p in self.params], adapt_start = adapt_start,
+                                                 target_rate = target_rate)]
+
+    @property
+    def proposal_covariance(self):
+        """
+        The covariance matrix of the proposal distribution currently in use.
+        """
+        pc = self.proposals[0]
+        S = dot(pc.chol, pc.chol.T)
+        return S * pc.scale if pc.adapted else S
+
+
+
+
+
+
+class PcaChain(MarkovChain):
+    """
+    A class which performs Gibbs sampling over the eigenvectors of the covariance matrix.
 
     The PcaChain sampler uses 'principal component analysis' (PCA) to improve
     the performance of Gibbs sampling in cases where strong linear correlation
@@ -964,7 +2559,7 @@ class PcaChain(MarkovChain):
         # re-estimate the covariance and find its eigenvectors
         data = array( [ self.get_parameter(i)[self.last_update:] for i in range(self.L)] )
         if hasattr(self, 'covar'):
-            nu = min(2*self.dir_update_interval/self.last_update, 0.5)
+            nu = min(2*self.dir_update_interval/max(self.last_update, 1), 0.5)
             self.covar = self.covar*(1-nu) + nu*cov(data)
         else:
             self.covar = cov(data)
@@ -1007,20 +2602,17 @@ class PcaChain(MarkovChain):
         # loop over each eigenvector and take a step along each
         for v, p in zip(self.directions,self.params):
             while True:
+                if self.prefetcher is not None:
+                    self.prefetcher.update(self.predict_direction_proposals, theta0, p_old, v, p.sigma)
                 prop = theta0 + v*p.sigma*normal()
                 prop = self.process_proposal(prop)
-                p_new = self.posterior(prop) * self.inv_temp
-
-                if p_new > p_old:
-                    p.submit_accept_prob(1.)
+                accept, p_new, accept_prob = self.metropolis_test(theta0, prop, p_old)
+                p.submit_accept_prob(accept_prob)
+                if accept:
                     break
-                else:
-                    test = random()
-                    acceptance_prob = exp(p_new-p_old)
-                    p.submit_accept_prob(acceptance_prob)
-                    if test < acceptance_prob:
-                        break
 
+            if self.prefetcher is not None:
+                self.prefetcher.reset()
             theta0 = copy(prop)
             p_old = copy(p_new)
 
@@ -1029,16 +2621,36 @@ class PcaChain(MarkovChain):
             p.add_sample(v)
 
         self.probs.append(p_new)
+        self.record_blob()
         self.n += 1
 
         if self.n == self.next_update:
             self.update_directions()
 
-    def save(self, filename):
+    def predict_direction_proposals(self, n, theta, p_old, v, sigma):
+        """
+        Predicts the next *n* proposals and thresholds for the step along the
+        direction *v* without changing the state of the random number generator.
+        """
+        state = get_state()
+        proposals = []
+        thresholds = []
+        for j in range(n):
+            proposals.append(self.process_proposal(theta + v*sigma*normal()))
+            thresholds.append(p_old + log(random()))
+        set_state(state)
+        return proposals, thresholds
+
+    def save(self, filename, as_directory = False):
         """
         Save the entire state of the chain object as an .npz file.
 
         :param str filename: file path to which the chain will be saved.
+
+        :param bool as_directory: \
+            If set to ``True``, the chain is instead saved as a directory of .npy files
+            at the given path, which ``load`` opens using memory-mapping, so that only
+            the parts of the sample which are accessed are read from disk.
         """
         # get the chain attributes
         items = [
@@ -1058,6 +2670,9 @@ class PcaChain(MarkovChain):
             ('directions', array(self.directions)),
             ('covar', self.covar) ]
 
+        if self.blobs is not None:
+            items.append(('blobs', self.blobs.get(0, 1)))
+
         # get the parameter attributes
         for i, p in enumerate(self.params):
             items.extend( p.get_items(param_id=i) )
@@ -1065,26 +2680,34 @@ class PcaChain(MarkovChain):
         D = {} # build the dict
         for key, value in items:
             D[key] = value
-        # save as npz
-        savez(filename, **D)
+
+        if as_directory:
+            self.save_directory(filename, D)
+        else:
+            # save as npz
+            savez(filename, **D)
 
     @classmethod
     def load(cls, filename, posterior = None):
         """
         Load a chain object which has been previously saved using the save() method.
 
-        :param str filename: file path of the .npz file containing the chain object data.
+        :param str filename: \
+            file path of the .npz file containing the chain object data, or of the
+            directory if the chain was saved with ``as_directory = True``, in which case
+            the sample is memory-mapped rather than read into memory.
+
         :param posterior: The posterior which was sampled by the chain. This argument need \
                           only be specified if new samples are to be added to the chain.
         """
         # load the data and create a chain instance
-        D = load(filename)
+        D = load_chain_directory(filename) if isdir(filename) else load(filename)
         chain = cls(posterior=posterior)
 
         # re-build the chain's attributes
         chain.n = int(D['n'])
         chain.L = int(D['L'])
-        chain.probs = list(D['probs'])
+        chain.probs = load_probabilities(D['probs'])
         chain.burn = int(D['burn'])
         chain.thin = int(D['thin'])
         chain.inv_temp = float(D['inv_temp'])
@@ -1097,6 +2720,9 @@ class PcaChain(MarkovChain):
         chain.update_history = list(D['update_history'])
         chain.directions = [ D['directions'][i,:] for i in range(D['directions'].shape[0]) ]
         chain.covar = D['covar']
+        if 'blobs' in D:
+            chain.blobs = BlobStore(D['blobs'])
+            chain.current_blob = chain.blobs.data[chain.blobs.n-1]
 
         # re-build all the parameter objects
         chain.params = []
@@ -1104,8 +2730,22 @@ class PcaChain(MarkovChain):
             p = Parameter()
             p.load_items(dictionary=D, param_id=i)
             chain.params.append(p)
+        chain.attach_sample_store(D['samples'] if 'samples' in D else None)
         return chain
 
+    def get_tuning(self):
+        tuning = super(PcaChain, self).get_tuning()
+        tuning['directions'] = array(self.directions)
+        if hasattr(self, 'covar'):
+            tuning['covar'] = self.covar
+        return tuning
+
+    def set_tuning(self, tuning):
+        super(PcaChain, self).set_tuning(tuning)
+        self.directions = [v for v in array(tuning['directions'])]
+        if 'covar' in tuning:
+            self.covar = array(tuning['covar'])
+
     def set_non_negative(self, *args, **kwargs):
         warn("""
              The set_non_negative method is not available for PcaChain:
@@ -1121,9 +2761,7 @@ class PcaChain(MarkovChain):
              """)
 
     def impose_boundaries(self, prop):
-        d = prop - self.lower
-        n = (d // self.width) % 2
-        return self.lower + (1-2*n)*(d % self.width) + n*self.width
+        return reflect_into_bounds(prop, self.lower, self.width)
 
     def pass_through(self, prop):
         return prop
@@ -1133,6 +2771,256 @@ class PcaChain(MarkovChain):
 
 
 
+class SubsamplingChain(MarkovChain):
+    """
+    A Metropolis-Hastings sampler for posteriors where the log-likelihood is a sum over
+    a large number of data points (or blocks of data), which decides whether to accept
+    each proposal using only as much of the data as is required.
+
+    Each accept / reject decision is made using the sequential test of Korattikara et al.
+    (2014, 'Austerity in MCMC land'). The mean difference in the log-likelihood terms
+    between the proposed and current positions is estimated from a growing random subset
+    of the data blocks, and the test stops as soon as the decision can be made with the
+    required confidence, or when all blocks have been used, in which case the decision
+    is exact. The log-likelihood terms at the current position are cached, so each block
+    is evaluated at most once per position.
+
+    The average fraction of data blocks evaluated in each step of the chain is available
+    through the ``data_fraction`` method.
+
+    :param func log_prior: \
+        A function which takes the vector of model parameters as a ``numpy.ndarray``
+        and returns the log-prior probability.
+
+    :param func log_likelihood: \
+        A function with the signature ``log_likelihood(theta, indices)`` which returns a
+        ``numpy.ndarray`` of the log-likelihood of each of the data blocks specified by the
+        array of integer ``indices``. The total log-likelihood is the sum over all blocks.
+
+    :param int n_blocks: The total number of data blocks.
+
+    :param start: \
+        vector of model parameters which correspond to the parameter-space coordinates at
+        which the chain will start.
+
+    :param widths: \
+        vector of standard deviations which serve as initial guesses for the widths of the
+        proposal distribution for each model parameter. If not specified, the starting widths
+        will be approximated as 5% of the values in 'start'.
+
+    :param int batch_size: \
+        The number of additional data blocks which are evaluated at each stage of the
+        sequential test.
+
+    :param float tolerance: \
+        The probability of error allowed in each stage of the sequential test. Smaller values
+        give more accurate decisions at the cost of evaluating more data. Setting the tolerance
+        to zero causes every decision to use all the data blocks.
+    """
+    def __init__(self, log_prior = None, log_likelihood = None, n_blocks = None, start = None, widths = None,
+                 batch_size = 50, tolerance = 0.05, temperature = 1.):
+
+        self.log_prior = log_prior
+        self.log_likelihood = log_likelihood
+        self.n_blocks = n_blocks
+        self.batch_size = batch_size
+        self.tolerance = tolerance
+        self.data_fractions = []
+
+        if start is not None:
+            # the full posterior is only evaluated once, at the starting position, and
+            # the resulting value is used as the first entry of the chain
+            self.current_terms = self.log_likelihood(array(start), arange(self.n_blocks))
+            self.reset_block_cache()
+            start_prob = self.log_prior(array(start)) + self.current_terms.sum()
+            super(SubsamplingChain, self).__init__(posterior = lambda theta: start_prob, start = start,
+                                                   widths = widths, temperature = temperature)
+            self.posterior = self.full_posterior
+        else:
+            super(SubsamplingChain, self).__init__(temperature = temperature)
+
+    def full_posterior(self, theta):
+        return self.log_prior(theta) + self.log_likelihood(theta, arange(self.n_blocks)).sum()
+
+    def reset_block_cache(self):
+        # the cached log-likelihood terms at the current position are valid where
+        # their label matches the label of the current position, so the cache can be
+        # invalidated after each step without having to reset the whole array
+        self.term_labels = where(isnan(self.current_terms), -1, 0)
+        self.position_label = 0
+        # blocks which have been drawn for the current proposal are labelled in the same way
+        self.drawn_labels = zeros(self.n_blocks, dtype = int)
+        self.proposal_label = 0
+
+    def draw_blocks(self, n, m):
+        """
+        Returns *m* more block indices drawn without replacement, given that *n* have already
+        been drawn for the current proposal. Indices are drawn ahead in batches which double
+        in size, so the cost depends only on the number of blocks used by the proposal rather
+        than the total number of blocks. Candidate indices which were already drawn are
+        rejected, until more than half the blocks are needed, at which point all remaining
+        blocks are shuffled instead.
+        """
+        N = self.n_blocks
+        if n == 0:
+            self.proposal_label += 1
+            self.drawn = zeros(0, dtype = int)
+        label = self.proposal_label
+        target = min(n + m, N)
+        while len(self.drawn) < target:
+            k = min(max(len(self.drawn), m), N - len(self.drawn))
+            if len(self.drawn) + k > N // 2:
+                remaining = (self.drawn_labels != label).nonzero()[0]
+                new = remaining[permutation(len(remaining))]
+            else:
+                new = zeros(0, dtype = int)
+                while len(new) < k:
+                    candidates = unique(randint(0, N, size = k - len(new)))
+                    candidates = candidates[self.drawn_labels[candidates] != label]
+                    self.drawn_labels[candidates] = label
+                    new = concatenate([new, candidates])
+            self.drawn_labels[new] = label
+            self.drawn = concatenate([self.drawn, new])
+        return self.drawn[n:n + m]
+
+    def take_step(self):
+        """
+        Draws samples from the proposal distribution until one is accepted by
+        the sequential subsampling test.
+        """
+        theta = array(self.get_last())
+        lp_old = self.log_prior(theta)
+        blocks_used = 0
+        while True:
+            proposal = array([p.proposal() for p in self.params])
+            accept, terms, indices = self.sequential_test(theta, proposal, lp_old)
+            blocks_used += len(indices)
+            if accept: break
+
+        # the cached terms of the current position are only valid for the
+        # blocks which were evaluated at the accepted proposal
+        self.position_label += 1
+        self.current_terms[indices] = terms
+        self.term_labels[indices] = self.position_label
+
+        for p, v in zip(self.params, proposal):
+            p.add_sample(v)
+
+        # store an unbiased estimate of the log-probability based on the evaluated blocks
+        lp_new = self.log_prior(proposal)
+        self.probs.append((lp_new + self.n_blocks * terms.mean()) * self.inv_temp)
+        self.data_fractions.append(blocks_used / self.n_blocks)
+        self.n += 1
+
+    def sequential_test(self, theta, proposal, lp_old):
+        N = self.n_blocks
+        lp_new = self.log_prior(proposal)
+        # the threshold which the mean log-likelihood difference must exceed for acceptance
+        mu_0 = (log(random()) / self.inv_temp + lp_old - lp_new) / N
+
+        new_terms = []
+        used = []
+        d_sum = 0.
+        d_sqr = 0.
+        n = 0
+        while True:
+            indices = self.draw_blocks(n, self.batch_size)
+            used.append(indices)
+            n += len(indices)
+
+            # evaluate any terms at the current position which are not already cached
+            current = self.current_terms[indices]
+            missing = self.term_labels[indices] != self.position_label
+            if missing.any():
+                current[missing] = self.log_likelihood(theta, indices[missing])
+                self.current_terms[indices[missing]] = current[missing]
+                self.term_labels[indices[missing]] = self.position_label
+
+            terms = self.log_likelihood(proposal, indices)
+            new_terms.append(terms)
+            d = terms - current
+            d_sum += d.sum()
+            d_sqr += (d**2).sum()
+            d_mean = d_sum / n
+
+            # if all the data has been used the decision is exact
+            if n >= N: break
+            if n < 2: continue
+
+            # test whether the decision can be made with the required confidence
+            d_var = max(d_sqr - n * d_mean**2, 0.) / (n - 1.)
+            std_err = sqrt(d_var * (1. - (n - 1.) / (N - 1.)) / n)
+            if std_err == 0.: break
+            t_stat = abs(d_mean - mu_0) / std_err
+            if stdtr(n - 1, -t_stat) < self.tolerance: break
+
+        accept = d_mean > mu_0
+        # submit an estimate of the acceptance probability for the proposal width adjustment
+        log_ratio = self.inv_temp * (lp_new - lp_old + N * d_mean)
+        for p in self.params:
+            p.submit_accept_prob(min(exp(min(log_ratio, 0.)), 1.))
+        return accept, concatenate(new_terms), concatenate(used)
+
+    def data_fraction(self, burn = None):
+        """
+        Returns the average fraction of the data blocks which were evaluated per step of the chain.
+        As several proposals may be tested in each step, this value can exceed 1.
+
+        :param int burn: \
+            Number of steps to discard from the start of the chain. If not specified, the
+            value of self.burn is used instead.
+        """
+        if burn is None: burn = self.burn
+        return mean(self.data_fractions[max(burn - 1, 0):])
+
+    def get_items(self):
+        items = super(SubsamplingChain, self).get_items()
+        # blocks whose cached terms are not valid for the current position are stored as nan
+        terms = self.current_terms.copy()
+        terms[self.term_labels != self.position_label] = nan
+        items.extend([
+            ('n_blocks', self.n_blocks),
+            ('batch_size', self.batch_size),
+            ('tolerance', self.tolerance),
+            ('data_fractions', array(self.data_fractions)),
+            ('current_terms', terms) ])
+        return items
+
+    def load_items(self, D):
+        super(SubsamplingChain, self).load_items(D)
+        self.n_blocks = int(D['n_blocks'])
+        self.batch_size = int(D['batch_size'])
+        self.tolerance = float(D['tolerance'])
+        self.data_fractions = list(D['data_fractions'])
+        self.current_terms = array(D['current_terms'], dtype = float)
+        self.reset_block_cache()
+        self.posterior = self.full_posterior
+
+    @classmethod
+    def load(cls, filename, log_prior = None, log_likelihood = None):
+        """
+        Load a chain object which has been previously saved using the save() method.
+
+        :param str filename: \
+            file path of the .npz file containing the chain object data, or of the
+            directory if the chain was saved with ``as_directory = True``.
+
+        :param func log_prior: The log-prior function used by the chain.
+
+        :param func log_likelihood: \
+            The log-likelihood function used by the chain. This argument, and ``log_prior``,
+            need only be specified if new samples are to be added to the chain.
+        """
+        D = load_chain_directory(filename) if isdir(filename) else load(filename)
+        chain = cls(log_prior = log_prior, log_likelihood = log_likelihood)
+        chain.load_items(D)
+        return chain
+
+
+
+
+
+
 class HamiltonianChain(MarkovChain):
     """
     Class for performing Hamiltonian Monte-Carlo sampling.
@@ -1156,7 +3044,9 @@ class HamiltonianChain(MarkovChain):
     :param func grad: \
         A function which returns the gradient of the log-posterior probability density
         for a given set of model parameters theta. If this function is not given, the
-        gradient will instead be estimated by finite difference.
+        gradient will instead be estimated by central finite difference. Passing an
+        instance of ``FiniteDifference`` allows the finite-difference settings to be
+        chosen, including batched or parallel evaluation of the perturbed points.
 
     :param start: \
         Vector of model parameters which correspond to the parameter-space coordinates
@@ -1183,7 +3073,9 @@ class HamiltonianChain(MarkovChain):
 
         self.posterior = posterior
         # if no gradient function is supplied, default to finite difference
+        self.fd = None
         if grad is None:
+            self.fd = FiniteDifference(function = posterior)
             self.grad = self.finite_diff
         else:
             self.grad = grad
@@ -1208,11 +3100,16 @@ class HamiltonianChain(MarkovChain):
         self.temperature = temperature
         self.inv_temp = 1. / temperature
 
+        self.blobs = None
         if start is not None:
-            self.theta = [start]
+            self.theta = SampleStore(n_params = len(start))
+            self.theta.append(start)
             self.probs = [self.posterior(start)*self.inv_temp]
             self.leapfrog_steps = [0]
             self.L = len(start)
+            if hasattr(self.posterior, 'blob'):
+                self.blobs = BlobStore()
+                self.blobs.append(self.posterior.blob)
         self.n = 1
 
         # set the variance to 1 if none supplied
@@ -1237,7 +3134,7 @@ class HamiltonianChain(MarkovChain):
         while not accept:
             r0 = normal(size = self.L)/sqrt(self.variance)
             t0 = self.theta[-1]
-            H0 = 0.5*dot(r0, r0/self.variance) - self.probs[-1]
+            H0 = 0.5*dot(r0, r0*self.variance) - self.probs[-1]
 
             r = copy(r0)
             t = copy(t0)
@@ -1248,7 +3145,8 @@ class HamiltonianChain(MarkovChain):
 
             steps_taken += n_steps
             p = self.posterior(t) * self.inv_temp
-            H = 0.5*dot(r, r / self.variance) - p
+            blob = getattr(self.posterior, 'blob', None)
+            H = 0.5*dot(r, r * self.variance) - p
             test = exp( H0 - H )
 
             if isfinite(test):
@@ -1266,6 +3164,8 @@ class HamiltonianChain(MarkovChain):
         self.theta.append( t )
         self.probs.append( p )
         self.leapfrog_steps.append( steps_taken )
+        if self.blobs is not None:
+            self.blobs.append(blob)
         self.n += 1
 
     def run_leapfrog(self, t, r, g, L):
@@ -1274,19 +3174,14 @@ class HamiltonianChain(MarkovChain):
         return t, r, g
 
     def hamiltonian(self, t, r):
-        return 0.5*dot(r, r / self.variance) - self.posterior(t) * self.inv_temp
+        return 0.5*dot(r, r * self.variance) - self.posterior(t) * self.inv_temp
 
     def estimate_mass(self, burn = 1, thin = 1):
         self.variance = var( array( self.theta[burn::thin] ), axis = 0)
 
     def finite_diff(self, t):
-        p = self.posterior(t) * self.inv_temp
-        G = zeros(self.L)
-        for i in range(self.L):
-            delta = zeros(self.L)+1
-            delta[i] += 1e-5
-            G[i] = (self.posterior(t * delta) * self.inv_temp - p) / ( t[i] * 1e-5 )
-        return G
+        # the tempering is applied by the caller, so the un-tempered gradient is returned
+        return self.fd(t)
 
     def standard_leapfrog(self, t, r, g):
         r2 = r + (0.5*self.ES.epsilon)*g
@@ -1326,9 +3221,26 @@ class HamiltonianChain(MarkovChain):
 
     def get_parameter(self, n, burn = None, thin = None):
         """
-        Return sample values for a chosen parameter.
+        Return sample values for a chosen parameter.
+
+        :param int n: Index of the parameter for which samples are to be returned.
+
+        :param int burn: Number of samples to discard from the start of the chain. If not \
+                         specified, the value of self.burn is used instead.
+
+        :param int thin: Instead of returning every sample which is not discarded as part \
+                         of the burn-in, every *m*'th sample is returned for a specified \
+                         integer *m*. If not specified, the value of self.thin is used instead.
+
+        :return: \
+            The samples for the *n*'th parameter, as a ``numpy.ndarray`` view of the stored sample.
+        """
+        return self.get_sample_array(burn, thin)[:,n]
 
-        :param int n: Index of the parameter for which samples are to be returned.
+    def get_sample_array(self, burn = None, thin = None):
+        """
+        Return the sample generated by the chain as an array. The array is a view of the
+        stored sample, so no copy is made, and it should not be modified.
 
         :param int burn: Number of samples to discard from the start of the chain. If not \
                          specified, the value of self.burn is used instead.
@@ -1337,11 +3249,12 @@ class HamiltonianChain(MarkovChain):
                          of the burn-in, every *m*'th sample is returned for a specified \
                          integer *m*. If not specified, the value of self.thin is used instead.
 
-        :return: List of samples for parameter *n*'th parameter.
+        :return: \
+            The sample as a ``numpy.ndarray`` of shape (number of samples, number of parameters).
         """
         if burn is None: burn = self.burn
         if thin is None: thin = self.thin
-        return [v[n] for v in self.theta[burn::thin]]
+        return self.theta.get(burn, thin)
 
     def plot_diagnostics(self, show = True, filename = None, burn = None):
         """
@@ -1437,6 +3350,9 @@ class HamiltonianChain(MarkovChain):
     def mode(self):
         return self.theta[argmax(self.probs)]
 
+    def latest_steps(self, m):
+        return self.theta[-m:], array(self.probs[-m:])
+
     def estimate_burn_in(self):
         # first get an estimate based on when the chain first reaches
         # the top 1% of log-probabilities
@@ -1448,7 +3364,55 @@ class HamiltonianChain(MarkovChain):
         epsl_estimate = chks[ argmax(epsl > 0.15) ] * self.ES.accept_rate
         return int(min(max(prob_estimate, epsl_estimate), 0.9*self.n))
 
-    def save(self, filename, compressed = False):
+    def get_tuning(self):
+        return {
+            'epsilon' : self.ES.epsilon,
+            'epsilon_chk_int' : self.ES.chk_int,
+            'inv_mass' : self.variance,
+            'steps' : self.steps
+        }
+
+    def set_tuning(self, tuning):
+        inv_mass = array(tuning['inv_mass'], dtype = float)
+        if inv_mass.ndim > 0 and len(inv_mass) != self.L:
+            raise ValueError('the tuning settings are for a different number of parameters')
+        self.variance = inv_mass if inv_mass.ndim > 0 else float(inv_mass)
+        self.steps = int(tuning['steps'])
+        epsilon = float(tuning['epsilon'])
+        if len(self.ES.epsilon_values) == 1:
+            self.ES.epsilon = epsilon
+            self.ES.epsilon_values = [copy(epsilon)]
+        else:
+            self.ES.adjust_epsilon(epsilon / self.ES.epsilon)
+        self.ES.chk_int = int(tuning['epsilon_chk_int'])
+
+    def save(self, filename, compressed = False, as_directory = False):
+        """
+        Save the entire state of the chain object as an .npz file.
+
+        :param str filename: file path to which the chain will be saved.
+
+        :param bool compressed: If set to ``True``, the .npz file is compressed.
+
+        :param bool as_directory: \
+            If set to ``True``, the chain is instead saved as a directory of .npy files
+            at the given path, which ``load`` opens using memory-mapping, so that only
+            the parts of the sample which are accessed are read from disk.
+        """
+        # build the dict
+        D = {}
+        for key, value in self.get_items():
+            D[key] = value
+
+        # save as npz
+        if as_directory:
+            save_chain_directory(filename, D)
+        elif compressed:
+            savez_compressed(filename, **D)
+        else:
+            savez(filename, **D)
+
+    def get_items(self):
         items = [
             ('bounded', self.bounded),
             ('lwr_bounds', self.lwr_bounds),
@@ -1456,7 +3420,7 @@ class HamiltonianChain(MarkovChain):
             ('widths', self.widths),
             ('inv_mass', self.variance),
             ('inv_temp', self.inv_temp),
-            ('theta', self.theta),
+            ('theta', array(self.theta)),
             ('probs', self.probs),
             ('leapfrog_steps', self.leapfrog_steps),
             ('L', self.L),
@@ -1468,49 +3432,232 @@ class HamiltonianChain(MarkovChain):
             ('n', self.n)
         ]
 
+        if self.blobs is not None:
+            items.append(('blobs', self.blobs.get(0, 1)))
+
         items.extend( self.ES.get_items() )
+        return items
 
-        # build the dict
-        D = {}
-        for key, value in items:
-            D[key] = value
+    @classmethod
+    def load(cls, filename, posterior = None, grad = None):
+        """
+        Load a chain object which has been previously saved using the save() method.
 
-        # save as npz
-        if compressed:
-            savez_compressed(filename, **D)
+        :param str filename: \
+            file path of the .npz file containing the chain object data, or of the
+            directory if the chain was saved with ``as_directory = True``, in which case
+            the sample is memory-mapped rather than read into memory.
+
+        :param posterior: The posterior which was sampled by the chain.
+
+        :param grad: The gradient of the posterior which was sampled by the chain.
+        """
+        D = load_chain_directory(filename) if isdir(filename) else load(filename)
+        chain = cls(posterior=posterior, grad=grad)
+        chain.load_items(D)
+        return chain
+
+    def load_items(self, D):
+        self.bounded = bool(D['bounded'])
+        self.variance = array(D['inv_mass'])
+        self.inv_temp = float(D['inv_temp'])
+        self.temperature = 1. / self.inv_temp
+        self.probs = load_probabilities(D['probs'])
+        self.leapfrog_steps = list(D['leapfrog_steps'])
+        self.L = int(D['L'])
+        self.n = int(D['n'])
+        self.steps = int(D['steps'])
+        self.burn = int(D['burn'])
+        self.thin = int(D['thin'])
+        self.print_status = bool(D['print_status'])
+        self.n = int(D['n'])
+
+        self.theta = SampleStore(data = D['theta'])
+        if 'blobs' in D:
+            self.blobs = BlobStore(D['blobs'])
+
+        if self.bounded:
+            self.lwr_bounds = array(D['lwr_bounds'])
+            self.upr_bounds = array(D['upr_bounds'])
+            self.widths = array(D['widths'])
+
+        # build the epsilon selector
+        self.ES.load_items(D)
+
+
+
+
+
+
+class StochasticGradientChain(HamiltonianChain):
+    """
+    Class for stochastic-gradient MCMC sampling, where the gradient of the log-posterior
+    is estimated at each update using only a small random subset (a 'minibatch') of the
+    data. This allows the cost of each update to scale with the minibatch size rather
+    than the size of the full data set.
+
+    Two algorithms are available: stochastic-gradient Hamiltonian Monte-Carlo (SGHMC),
+    which simulates Hamiltonian dynamics with a friction term that counteracts the noise
+    introduced by the gradient estimates, and stochastic-gradient Langevin dynamics (SGLD).
+    In both cases the inverse-mass acts as a diagonal preconditioner.
+
+    As no Metropolis-Hastings correction is applied, the sample is only approximately drawn
+    from the posterior, with an error which decreases as the step-size ``epsilon`` is reduced.
+
+    :param func grad: \
+        A function with the signature ``grad(theta, indices)`` which returns an estimate of
+        the gradient of the log-posterior using only the data specified by the array of
+        integer ``indices``. The estimate should be unbiased, so the likelihood gradient
+        computed from the minibatch should be scaled by ``n_data / len(indices)``.
+
+    :param start: \
+        Vector of model parameters which correspond to the parameter-space coordinates
+        at which the chain will start.
+
+    :param int n_data: \
+        The total number of data points (or blocks of data) over which the likelihood
+        is summed. This argument is not required if ``index_sampler`` is given.
+
+    :param int batch_size: \
+        The number of data indices in each minibatch.
+
+    :param index_sampler: \
+        A function which takes no arguments and returns an array of data indices to be
+        used for the next gradient estimate. If not specified, an instance of
+        ``MinibatchSampler`` is used.
+
+    :param float epsilon: \
+        The step-size used in the simulation of the dynamics.
+
+    :param float friction: \
+        The friction coefficient used by SGHMC. The product ``friction * epsilon``
+        should be kept well below 1.
+
+    :param str method: \
+        The algorithm used to generate samples, either "sghmc" or "sgld".
+
+    :param int steps: \
+        The number of updates made between each sample which is stored in the chain.
+
+    :param func posterior: \
+        A function which returns the full log-posterior probability. This argument is
+        optional, and if given is used only to record the log-probability of each stored
+        sample for diagnostic purposes.
+
+    :param inv_mass: \
+        A vector specifying the inverse-mass value to be used for each parameter, which
+        should ideally be set to the variance of the marginal distribution of each parameter.
+
+    :param float temperature: \
+        The temperature of the markov chain.
+    """
+    def __init__(self, grad = None, start = None, n_data = None, batch_size = 100, index_sampler = None,
+                 epsilon = 1e-3, friction = 1., method = 'sghmc', steps = 10, posterior = None,
+                 inv_mass = None, temperature = 1):
+
+        super(StochasticGradientChain, self).__init__(posterior = posterior, grad = grad, epsilon = epsilon,
+                                                      temperature = temperature, inv_mass = inv_mass)
+
+        if method not in ['sghmc', 'sgld']:
+            raise ValueError('method must be either "sghmc" or "sgld"')
+
+        self.method = method
+        self.friction = friction
+        self.steps = steps
+        if inv_mass is not None:
+            self.variance = array(inv_mass, dtype = float)
+
+        if index_sampler is None and n_data is not None:
+            index_sampler = MinibatchSampler(n_data = n_data, batch_size = batch_size)
+        self.index_sampler = index_sampler
+
+        if start is not None:
+            if index_sampler is None:
+                raise ValueError('either the n_data or index_sampler argument must be specified')
+            start = array(start, dtype = float)
+            self.theta = SampleStore(n_params = len(start))
+            self.theta.append(start)
+            self.probs = [self.log_probability(start)]
+            self.leapfrog_steps = [0]
+            self.L = len(start)
+
+    def take_step(self):
+        """
+        Takes the next step in the chain by making a series of stochastic-gradient updates.
+        """
+        eps = self.ES.epsilon
+        t = array(self.theta[-1], dtype = float)
+        r = normal(size = self.L) / sqrt(self.variance)
+        for i in range(self.steps):
+            g = self.grad(t, self.index_sampler()) * self.inv_temp
+            if self.method == 'sghmc':
+                t = t + eps * r * self.variance
+                noise = normal(size = self.L) * sqrt(2 * self.friction * eps / self.variance)
+                r = r + eps * g - (eps * self.friction) * r + noise
+            else:
+                t = t + (0.5 * eps) * self.variance * g + normal(size = self.L) * sqrt(eps * self.variance)
+
+        self.theta.append(t)
+        self.probs.append(self.log_probability(t))
+        self.leapfrog_steps.append(self.steps)
+        self.n += 1
+
+    def log_probability(self, t):
+        if self.posterior is None:
+            return nan
         else:
-            savez(filename, **D)
+            return self.posterior(t) * self.inv_temp
+
+    def get_items(self):
+        items = super(StochasticGradientChain, self).get_items()
+        items.extend([('method', self.method), ('friction', self.friction)])
+        # the settings of the default minibatch sampler can be stored, but not a user-supplied function
+        if isinstance(self.index_sampler, MinibatchSampler):
+            items.extend([('n_data', self.index_sampler.n_data), ('batch_size', self.index_sampler.batch_size)])
+        return items
+
+    def load_items(self, D):
+        super(StochasticGradientChain, self).load_items(D)
+        self.method = str(D['method'])
+        self.friction = float(D['friction'])
 
     @classmethod
-    def load(cls, filename, posterior = None, grad = None):
-        D = load(filename)
-        chain = cls(posterior=posterior, grad=grad)
+    def load(cls, filename, grad = None, posterior = None, n_data = None, batch_size = None, index_sampler = None):
+        """
+        Load a chain object which has been previously saved using the save() method.
 
-        chain.bounded = bool(D['bounded'])
-        chain.variance = array(D['inv_mass'])
-        chain.inv_temp = float(D['inv_temp'])
-        chain.temperature = 1. / chain.inv_temp
-        chain.probs = list(D['probs'])
-        chain.leapfrog_steps = list(D['leapfrog_steps'])
-        chain.L = int(D['L'])
-        chain.n = int(D['n'])
-        chain.steps = int(D['steps'])
-        chain.burn = int(D['burn'])
-        chain.thin = int(D['thin'])
-        chain.print_status = bool(D['print_status'])
-        chain.n = int(D['n'])
+        :param str filename: \
+            file path of the .npz file containing the chain object data, or of the
+            directory if the chain was saved with ``as_directory = True``.
 
-        t = D['theta']
-        chain.theta = [ t[i,:] for i in range(t.shape[0]) ]
+        :param grad: The minibatch gradient function used by the chain.
 
-        if chain.bounded:
-            chain.lwr_bounds = array(D['lwr_bounds'])
-            chain.upr_bounds = array(D['upr_bounds'])
-            chain.widths = array(D['widths'])
+        :param posterior: The full log-posterior, if it was given to the chain.
 
-        # build the epsilon selector
-        chain.ES.load_items(D)
+        :param int n_data: \
+            The total number of data points. If not specified, the value used by the
+            saved chain is used instead.
+
+        :param int batch_size: \
+            The number of data indices in each minibatch. If not specified, the value
+            used by the saved chain is used instead.
 
+        :param index_sampler: \
+            A function which returns the data indices for each gradient estimate. This must
+            be given if the saved chain used its own ``index_sampler`` and is to be advanced.
+        """
+        D = load_chain_directory(filename) if isdir(filename) else load(filename)
+        chain = cls(grad=grad, posterior=posterior)
+        chain.load_items(D)
+
+        if index_sampler is None:
+            if n_data is None and 'n_data' in D:
+                n_data = int(D['n_data'])
+            if batch_size is None:
+                batch_size = int(D['batch_size']) if 'batch_size' in D else 100
+            if n_data is not None:
+                index_sampler = MinibatchSampler(n_data = n_data, batch_size = batch_size)
+        chain.index_sampler = index_sampler
         return chain
 
 
@@ -1518,6 +3665,37 @@ class HamiltonianChain(MarkovChain):
 
 
 
+class MinibatchSampler(object):
+    """
+    Generates minibatches of data indices for use with ``StochasticGradientChain``.
+
+    The indices are drawn by stepping through a random permutation of the data, such
+    that every data point is used exactly once per pass (or 'epoch') through the data.
+
+    :param int n_data: The total number of data points.
+    :param int batch_size: The number of indices in each minibatch.
+    """
+    def __init__(self, n_data, batch_size):
+        self.n_data = n_data
+        self.batch_size = min(batch_size, n_data)
+        self.order = permutation(self.n_data)
+        self.position = 0
+        self.epochs = 0
+
+    def __call__(self):
+        if self.position + self.batch_size > self.n_data:
+            self.order = permutation(self.n_data)
+            self.position = 0
+            self.epochs += 1
+        batch = self.order[self.position:self.position + self.batch_size]
+        self.position += self.batch_size
+        return batch
+
+
+
+
+
+
 class EpsilonSelector(object):
     def __init__(self, epsilon):
 
@@ -1562,27 +3740,427 @@ class EpsilonSelector(object):
         else: # increase the check interval
             self.chk_int = int((self.growth_factor * self.chk_int) * 0.1) * 10
 
-    def adjust_epsilon(self, ratio):
-        self.epsilon *= ratio
-        self.epsilon_values.append(copy(self.epsilon))
-        self.epsilon_checks.append(self.epsilon_checks[-1] + self.num)
-        self.avg = 0
-        self.var = 0
-        self.num = 0
+    def adjust_epsilon(self, ratio):
+        self.epsilon *= ratio
+        self.epsilon_values.append(copy(self.epsilon))
+        self.epsilon_checks.append(self.epsilon_checks[-1] + self.num)
+        self.avg = 0
+        self.var = 0
+        self.num = 0
+
+    def get_items(self):
+        return [(k,v) for k,v in self.__dict__.items()]
+
+    def load_items(self, dictionary):
+        self.epsilon = float(dictionary['epsilon'])
+        self.epsilon_values = list(dictionary['epsilon_values'])
+        self.epsilon_checks = list(dictionary['epsilon_checks'])
+        self.avg = float(dictionary['avg'])
+        self.var = float(dictionary['var'])
+        self.num = float(dictionary['num'])
+        self.accept_rate = float(dictionary['accept_rate'])
+        self.chk_int = int(dictionary['chk_int'])
+        self.growth_factor = float(dictionary['growth_factor'])
+
+
+
+
+
+
+class BatchEvaluator(object):
+    """
+    Evaluates a function at a batch of points, either through a single call to a
+    vectorised function, by distributing the points across a pool of processes,
+    or serially.
+
+    :param func function: \
+        The function to be evaluated, which takes a parameter vector as a
+        ``numpy.ndarray`` and returns a float.
+
+    :param bool vectorised: \
+        If set to ``True``, the function is instead called once with a 2D
+        ``numpy.ndarray`` of shape (number of points, number of parameters),
+        and must return a 1D array containing the value at each point.
+
+    :param int n_processes: \
+        The number of processes over which the points are distributed when the
+        function is not vectorised. The function must be picklable if this is
+        greater than 1.
+    """
+    def __init__(self, function = None, vectorised = False, n_processes = 1):
+        self.function = function
+        self.vectorised = vectorised
+        self.n_processes = n_processes
+        self.pool = None
+
+    def __call__(self, points):
+        """
+        Evaluate the function at each of the given points.
+
+        :param points: \
+            The points as a 2D ``numpy.ndarray`` of shape (number of points, number of
+            parameters), or a list of parameter vectors.
+
+        :return: \
+            A ``numpy.ndarray`` containing the function value at each point, whose first
+            dimension corresponds to the points. If the function returns a float, this is
+            a 1D array.
+        """
+        if self.vectorised:
+            values = array(self.function(array(points)), dtype = float)
+            return values.reshape(len(points)) if values.size == len(points) else values
+        elif self.n_processes > 1:
+            if self.pool is None: self.pool = Pool(self.n_processes)
+            return array(self.pool.map(self.function, [p for p in points]), dtype = float)
+        else:
+            return array([self.function(p) for p in points], dtype = float)
+
+    def close(self):
+        """
+        Shut down the process pool, if one has been created.
+        """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def __getstate__(self):
+        # process pools cannot be pickled, so one is re-created if needed after unpickling
+        state = self.__dict__.copy()
+        state['pool'] = None
+        return state
+
+
+
+
+
+
+class FiniteDifference(object):
+    """
+    Estimates the gradient of a function using finite differences, where all of
+    the perturbed points are evaluated as a single batch.
+
+    The perturbed points can be passed to a vectorised function in one call, or
+    distributed across a pool of processes, so that the cost of a gradient
+    evaluation is a single round-trip rather than one call per parameter.
+    Instances can be passed as the ``grad`` argument of ``HamiltonianChain``.
+
+    :param func function: \
+        A function which takes the vector of model parameters as a ``numpy.ndarray``
+        and returns a float, for example a log-posterior.
+
+    :param str method: \
+        Either "central", which requires 2N function evaluations for N parameters and
+        has an error of second order in the step size, or "forward", which requires
+        N + 1 evaluations and has a first-order error.
+
+    :param step: \
+        The size of the perturbation applied to each parameter, either as a float or
+        as an array specifying a step for each parameter. If not specified, a value of
+        1e-5 is used for central differences and 1e-7 for forward differences.
+
+    :param bool relative: \
+        If set to ``True``, the step for each parameter is scaled by the magnitude of
+        that parameter's value, with a floor of 1 so that parameters equal to zero are
+        perturbed by the absolute step. If ``False``, the steps are used as given.
+
+    :param bool vectorised: \
+        If set to ``True``, the function is called once with a 2D ``numpy.ndarray`` of
+        all perturbed points, and must return a 1D array of function values.
+
+    :param int n_processes: \
+        The number of processes across which perturbed points are evaluated when
+        the function is not vectorised.
+    """
+    def __init__(self, function = None, method = 'central', step = None, relative = True,
+                 vectorised = False, n_processes = 1):
+        if method not in ['central', 'forward']:
+            raise ValueError('method must be either "central" or "forward"')
+
+        if step is None:
+            step = 1e-5 if method == 'central' else 1e-7
+
+        self.method = method
+        self.step = step
+        self.relative = relative
+        self.evaluator = BatchEvaluator(function = function, vectorised = vectorised, n_processes = n_processes)
+
+    def __call__(self, theta):
+        """
+        Estimate the gradient of the function at the given point.
+
+        :param theta: The parameter vector as a ``numpy.ndarray``.
+
+        :return: The estimated gradient as a ``numpy.ndarray``.
+        """
+        t = array(theta, dtype = float)
+        h = self.step_sizes(t)
+        D = diag(h)
+        if self.method == 'central':
+            f = self.evaluator(concatenate([t + D, t - D]))
+            return (f[:t.size] - f[t.size:]) / (2*h)
+        else:
+            f = self.evaluator(concatenate([t[None,:], t + D]))
+            return (f[1:] - f[0]) / h
+
+    def step_sizes(self, theta):
+        if self.relative:
+            return self.step * maximum(abs(theta), 1.)
+        else:
+            return zeros(theta.size) + self.step
+
+    def close(self):
+        """
+        Shut down the process pool used to evaluate perturbed points, if one exists.
+        """
+        self.evaluator.close()
+
+
+
+
+
+
+def find_map(posterior, start, grad = None, bounds = None, vectorised = False, n_processes = 1):
+    """
+    Finds the maximum a-posteriori (MAP) estimate using gradient-based optimisation, and
+    constructs a Laplace approximation to the posterior at that point, which can be used to
+    initialise samplers (see ``LaplaceApproximation``).
+
+    :param func posterior: \
+        a function which takes the vector of model parameters as a ``numpy.ndarray``,
+        and returns the posterior log-probability.
+
+    :param start: Vector of model parameters from which the optimisation will start.
+
+    :param func grad: \
+        A function which returns the gradient of the log-posterior probability density
+        for a given set of model parameters. If not given, the gradient is estimated
+        using ``FiniteDifference``.
+
+    :param bounds: \
+        A list of (lower, upper) pairs specifying bounds on each parameter for the optimisation.
+
+    :param bool vectorised: \
+        If set to ``True``, and the gradient is estimated by finite-difference, the posterior
+        is called with a 2D ``numpy.ndarray`` of the perturbed points (see ``FiniteDifference``).
+
+    :param int n_processes: \
+        The number of processes used to evaluate the perturbed points when the gradient
+        is estimated by finite-difference.
+
+    :return: An instance of ``LaplaceApproximation``.
+    """
+    if grad is None:
+        gradient = FiniteDifference(function = posterior, vectorised = vectorised, n_processes = n_processes)
+    else:
+        gradient = grad
+
+    result = minimize(lambda t: -posterior(t), x0 = array(start, dtype = float), method = 'L-BFGS-B',
+                      jac = lambda t: -array(gradient(t), dtype = float), bounds = bounds)
+    mode = result.x
+
+    # estimate the hessian by central differences of the gradient
+    L = len(mode)
+    H = zeros([L, L])
+    for i in range(L):
+        h = 1e-4 * max(abs(mode[i]), 1.)
+        dx = zeros(L)
+        dx[i] = h
+        H[:,i] = (array(gradient(mode + dx)) - array(gradient(mode - dx))) / (2*h)
+
+    if grad is None:
+        gradient.close()
+
+    return LaplaceApproximation(mode = mode, hessian = 0.5*(H + H.T), log_probability = -result.fun)
+
+
+
+
+
+
+class LaplaceApproximation(object):
+    """
+    A multivariate-normal approximation to the posterior, centred on the maximum
+    a-posteriori estimate with a covariance given by the inverse of the negative
+    hessian of the log-posterior. Instances are typically created using ``find_map``.
+
+    Samplers which start from the mode using tuning settings derived from the approximation
+    require much less burn-in than those started from an arbitrary point. For example:
+
+    .. code-block:: python
+
+        laplace = find_map(posterior, start)
+        chain = PcaChain(posterior = posterior, start = laplace.mode)
+        laplace.initialise(chain)
+
+    :param mode: The maximum a-posteriori estimate.
+
+    :param hessian: The hessian of the log-posterior at the mode.
+
+    :param float log_probability: \
+        The posterior log-probability at the mode. If not given, the log-evidence
+        estimate ``log_evidence`` is set to ``None``.
+    """
+    def __init__(self, mode = None, hessian = None, log_probability = None):
+        self.mode = array(mode, dtype = float)
+        self.hessian = array(hessian, dtype = float)
+        self.log_probability = log_probability
+        self.L = len(self.mode)
+
+        # the covariance is found from the eigen-decomposition of the precision, so
+        # that any non-positive eigenvalues (e.g. if the optimiser stopped at a boundary
+        # or saddle-point) can be replaced with small positive values
+        w, V = eigh(-self.hessian)
+        if any(w <= 0.):
+            warn('the hessian at the mode is not negative-definite - the Laplace approximation may be unreliable')
+            w = maximum(w, 1e-10 * max(abs(w).max(), 1.))
+        self.precision = dot(V * w, V.T)
+        self.covariance = dot(V / w, V.T)
+        self.variances = 1. / w  # variance along each of the eigenvectors
+        self.eigenvectors = V
+        if log_probability is not None:
+            self.log_evidence = log_probability + 0.5*self.L*log(2*pi) - 0.5*log(w).sum()
+        else:
+            self.log_evidence = None
+
+    def widths(self):
+        """
+        Returns the standard deviation of the approximation for each parameter.
+        """
+        return sqrt(self.covariance.diagonal())
+
+    def conditional_widths(self):
+        """
+        Returns the standard deviation of each parameter when all others are held fixed.
+        """
+        return 1. / sqrt(self.precision.diagonal())
+
+    def get_sample(self, n):
+        """
+        Draws a sample from the approximation, which can be used for example as the
+        starting positions of the walkers of an ``EnsembleSampler``.
+
+        :param int n: The number of points in the sample.
+
+        :return: A 2D ``numpy.ndarray`` of shape (n, number of parameters).
+        """
+        z = normal(size = [n, self.L]) * sqrt(self.variances)
+        return self.mode + dot(z, self.eigenvectors.T)
+
+    def initialise(self, chain):
+        """
+        Sets the tuning settings of a chain using the approximation. The proposal widths of
+        ``MarkovChain`` and ``GibbsChain`` instances, the directions and covariance of ``PcaChain``,
+        the proposal covariance of ``BlockGibbsChain`` and ``AdaptiveMetropolisChain`` and the
+        inverse-mass of ``HamiltonianChain`` are all supported.
+
+        :param chain: The chain object to be initialised.
+        """
+        if isinstance(chain, HamiltonianChain):
+            chain.variance = self.covariance.diagonal().copy()
+
+        elif isinstance(chain, BlockGibbsChain):
+            for g, pc in zip(chain.groups, chain.proposals):
+                pc.chol = cholesky(self.covariance[g,:][:,g], lower = True)
+                pc.adapted = True
+                for i, w in zip(g, pc.widths()):
+                    chain.params[i].set_sigma(w)
+
+        elif isinstance(chain, PcaChain):
+            chain.covar = self.covariance.copy()
+            chain.directions = [self.eigenvectors[:,i] for i in range(self.L)]
+            for p, v in zip(chain.params, self.variances):
+                p.set_sigma(2.38 * sqrt(v))
+
+        elif isinstance(chain, GibbsChain):
+            for p, w in zip(chain.params, self.conditional_widths()):
+                p.set_sigma(2.38 * w)
+
+        elif isinstance(chain, MarkovChain):
+            for p, w in zip(chain.params, self.widths()):
+                p.set_sigma(2.38 * w / sqrt(self.L))
+
+        else:
+            raise TypeError('chain type is not supported - for EnsembleSampler, use get_sample to generate starting positions')
+
+
+
+
+
+
+class Prefetcher(object):
+    """
+    Manages the speculative evaluation of proposals for the markov-chain samplers.
+    Instances are created by the ``enable_prefetching`` method of the chains, and
+    should not normally be created directly.
+
+    Predicted proposals and their acceptance thresholds are evaluated in parallel,
+    and the results are stored so they can be retrieved when the chain tests the
+    same proposal against the same threshold. The ``hits`` and ``misses`` attributes
+    count how many of the chain's evaluations were served from the prefetched values.
+    """
+    def __init__(self, posterior, n_processes = 2, depth = None, inv_temp = 1.):
+        self.depth = n_processes if depth is None else depth
+        self.inv_temp = inv_temp
+        self.evaluator = BatchEvaluator(function = SpeculativeEvaluation(posterior), n_processes = n_processes)
+        self.cache = {}
+        self.remaining = 0
+        self.hits = 0
+        self.misses = 0
+
+    def update(self, predictor, *args):
+        """
+        Evaluates a new batch of predicted proposals if the current batch has been used up.
+
+        :param predictor: \
+            A function which returns lists of the predicted proposals and (tempered) thresholds,
+            given the number of proposals to predict followed by ``args``.
+        """
+        if self.remaining == 0:
+            proposals, thresholds = predictor(self.depth, *args)
+            tasks = [(x, t / self.inv_temp) for x, t in zip(proposals, thresholds)]
+            values = self.evaluator(tasks)
+            self.cache = {(x.tobytes(), t) : v for x, t, v in zip(proposals, thresholds, values)}
+            self.remaining = self.depth
+        self.remaining -= 1
+
+    def lookup(self, theta, threshold):
+        value = self.cache.pop((array(theta, dtype = float).tobytes(), threshold), None)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def reset(self):
+        # the chain has moved, so any remaining predictions are invalid
+        self.cache = {}
+        self.remaining = 0
+
+    def close(self):
+        self.evaluator.close()
+
 
-    def get_items(self):
-        return [(k,v) for k,v in self.__dict__.items()]
 
-    def load_items(self, dictionary):
-        self.epsilon = float(dictionary['epsilon'])
-        self.epsilon_values = list(dictionary['epsilon_values'])
-        self.epsilon_checks = list(dictionary['epsilon_checks'])
-        self.avg = float(dictionary['avg'])
-        self.var = float(dictionary['var'])
-        self.num = float(dictionary['num'])
-        self.accept_rate = float(dictionary['accept_rate'])
-        self.chk_int = int(dictionary['chk_int'])
-        self.growth_factor = float(dictionary['growth_factor'])
+
+
+
+class SpeculativeEvaluation(object):
+    """
+    Evaluates the posterior for a (position, threshold) pair in a worker process,
+    matching the evaluation the chain itself would make. Returns the value together
+    with a flag indicating whether it is the exact log-probability.
+    """
+    def __init__(self, posterior):
+        self.posterior = posterior
+
+    def __call__(self, task):
+        theta, threshold = task
+        if hasattr(self.posterior, 'bounded_evaluation'):
+            value = self.posterior.bounded_evaluation(theta, threshold)
+            return value, getattr(self.posterior, 'completed', value >= threshold)
+        else:
+            return self.posterior(theta), True
 
 
 
@@ -1609,9 +4187,58 @@ class ChainPool(object):
 
 
 
+class StreamingMean(object):
+    """
+    Accumulates the mean of a stream of correlated values, and estimates the uncertainty
+    in the mean using the method of batch-means, without storing the values.
+
+    :param int batch_size: The number of consecutive values averaged in each batch.
+    """
+    def __init__(self, batch_size = 50):
+        self.batch_size = batch_size
+        self.count = 0
+        self.total = 0.
+        self.batch_total = 0.
+        self.batch_count = 0
+        self.n_batches = 0
+        self.batch_sum = 0.
+        self.batch_sqr_sum = 0.
+
+    def add(self, x):
+        self.count += 1
+        self.total += x
+        self.batch_total += x
+        self.batch_count += 1
+        if self.batch_count == self.batch_size:
+            m = self.batch_total / self.batch_size
+            self.n_batches += 1
+            self.batch_sum += m
+            self.batch_sqr_sum += m**2
+            self.batch_total = 0.
+            self.batch_count = 0
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count > 0 else nan
+
+    @property
+    def error(self):
+        if self.n_batches < 2:
+            return nan
+        m = self.batch_sum / self.n_batches
+        v = (self.batch_sqr_sum / self.n_batches - m**2) * self.n_batches / (self.n_batches - 1)
+        return sqrt(max(v, 0.) / self.n_batches)
+
+
+
+
+
+
 def tempering_process(chain, connection, end, proc_seed):
     # used to ensure each process has a different random seed
     seed(proc_seed)
+    # tracks the mean un-tempered log-probability for thermodynamic integration
+    log_prob_mean = StreamingMean()
     # main loop
     while not end.is_set():
         # poll the pipe until there is something to read
@@ -1628,22 +4255,37 @@ def tempering_process(chain, connection, end, proc_seed):
 
         # advance the chain
         if task == 'advance':
-            for _ in range(D['advance_count']): chain.take_step()
+            for _ in range(D['advance_count']):
+                chain.take_step()
+                log_prob_mean.add(chain.probs[-1] / chain.inv_temp)
             connection.send('advance_complete') # send signal to confirm completion
 
-        # return the current position of the chain
+        # return the current position of the chain, and any derived quantities stored for it
         elif task == 'send_position':
-            connection.send((chain.get_last(), chain.probs[-1]))
+            blobs = getattr(chain, 'blobs', None)
+            blob = blobs.data[blobs.n-1] if blobs is not None else None
+            connection.send((chain.get_last(), chain.probs[-1], blob))
 
         # update the position of the chain
         elif task == 'update_position':
             chain.replace_last(D['position'])
             chain.probs[-1] = D['probability'] * chain.inv_temp
+            if getattr(chain, 'blobs', None) is not None:
+                chain.blobs.data[chain.blobs.n-1] = D['blob']
+                chain.current_blob = D['blob']
 
         # return the local chain object
         elif task == 'send_chain':
             connection.send(chain)
 
+        # return the mean un-tempered log-probability and its uncertainty
+        elif task == 'send_log_prob_mean':
+            connection.send((log_prob_mean.mean, log_prob_mean.error, log_prob_mean.count))
+
+        # discard the log-probabilities accumulated so far (e.g. after burn-in)
+        elif task == 'reset_log_prob_mean':
+            log_prob_mean = StreamingMean()
+
 
 
 
@@ -1767,6 +4409,7 @@ class ParallelTempering(object):
         data = [pipe.recv() for pipe in self.connections]
         positions = [ k[0] for k in data ]
         probabilities = [ k[1] for k in data ]
+        blobs = [ k[2] for k in data ]
 
         # randomly pair up indices for all the processes
         proposed_swaps = self.tight_pairs()
@@ -1784,11 +4427,13 @@ class ParallelTempering(object):
             if random() <= exp(-dt*dp): # check if the swap is successful
                 Di = {'task' : 'update_position',
                       'position' : positions[i],
-                      'probability' : pi}
+                      'probability' : pi,
+                      'blob' : blobs[i]}
 
                 Dj = {'task' : 'update_position',
                       'position' : positions[j],
-                      'probability' : pj}
+                      'probability' : pj,
+                      'blob' : blobs[j]}
 
                 self.connections[i].send(Dj)
                 self.connections[j].send(Di)
@@ -1927,6 +4572,71 @@ class ParallelTempering(object):
         # receive the chains and return them
         return [ pipe.recv() for pipe in self.connections ]
 
+    def log_evidence(self, log_volume = None):
+        """
+        Estimates the log-evidence using thermodynamic integration over the chain temperatures.
+
+        The derivative of the log-normalisation of the tempered posterior with respect to
+        inverse temperature is the mean un-tempered log-probability of the chain at that
+        inverse temperature, which each process accumulates as its chain advances. This is
+        integrated over the inverse temperatures of the chains, giving
+        the log-evidence relative to that of the hottest chain. The log-probabilities accumulated
+        before a call to ``reset_evidence`` (e.g. during burn-in) are not included.
+
+        As the whole posterior is tempered, the normalisation at zero inverse temperature is the
+        volume of the parameter space, which is only finite when all parameters are bounded. If
+        the log of this volume is given, the integral is extended to zero inverse temperature,
+        assuming the mean log-probability below the lowest inverse temperature is equal to that
+        of the hottest chain. This is accurate when the lowest inverse temperature is small.
+
+        :param float log_volume: \
+            The log of the volume of the (bounded) parameter space. If not given, the
+            log-evidence is returned relative to that of the hottest chain.
+
+        :return: \
+            The estimated log-evidence and its uncertainty. The uncertainty accounts for the
+            Monte-Carlo error in the mean log-probabilities, but not the discretisation error
+            of the temperature ladder.
+        """
+        D = {'task' : 'send_log_prob_mean'}
+        for pipe in self.connections:
+            pipe.send(D)
+        data = [pipe.recv() for pipe in self.connections]
+
+        betas = array(self.inv_temps)
+        means = array([k[0] for k in data])
+        errors = array([k[1] for k in data])
+        if any(k[2] == 0 for k in data):
+            raise ValueError('the chains must be advanced before the evidence can be estimated')
+
+        order = argsort(betas)
+        betas, means, errors = betas[order], means[order], errors[order]
+
+        # The mean log-probability typically varies as the inverse of the inverse temperature,
+        # so the integral is performed over log(beta) using the trapezium rule, which is much
+        # more accurate for the geometrically spaced temperatures commonly used.
+        w = zeros(len(betas))
+        dS = diff(log(betas))
+        w[:-1] += 0.5*dS
+        w[1:] += 0.5*dS
+        w *= betas
+
+        if log_volume is not None:
+            w[0] += betas[0]
+
+        log_z = (w*means).sum() + (0. if log_volume is None else log_volume)
+        error = sqrt(((w*errors)**2).sum())
+        return log_z, error
+
+    def reset_evidence(self):
+        """
+        Discard the log-probabilities accumulated by each process for the evidence
+        estimate, for example once the chains have finished burning-in.
+        """
+        D = {'task' : 'reset_log_prob_mean'}
+        for pipe in self.connections:
+            pipe.send(D)
+
     def shutdown(self):
         """
         Trigger a shutdown event which tells the processes holding each of
@@ -2044,10 +4754,37 @@ class EnsembleSampler(object):
         sys.stdout.flush()
         sys.stdout.write('\n')
 
+    def stream(self, n_steps, block = 100):
+        """
+        Advances all walkers by *n_steps* iterations, yielding the positions of the walkers
+        after each iteration in blocks as soon as they are produced. As the sampler only
+        stores the current positions, this allows the full history of the walkers to be
+        processed or written to disk while the sampler runs.
+
+        :param int n_steps: The total number of iterations.
+
+        :param int block: The number of iterations in each yielded block.
+
+        :return: \
+            A generator which yields the walker positions in each block as a ``numpy.ndarray``
+            of shape (number of iterations, number of walkers, number of parameters) alongside
+            the corresponding log-probabilities with shape (number of iterations, number of walkers).
+        """
+        if block < 1:
+            raise ValueError('block must be a positive integer')
+        while n_steps > 0:
+            m = min(block, n_steps)
+            thetas = zeros([m, self.N_walkers, self.N_params])
+            probs = zeros([m, self.N_walkers])
+            for k in range(m):
+                self.advance_all()
+                thetas[k,:,:] = self.theta
+                probs[k,:] = self.probs
+            n_steps -= m
+            yield thetas, probs
+
     def impose_boundaries(self, prop):
-        d = prop - self.lower
-        n = (d // self.width) % 2
-        return self.lower + (1 - 2*n)*(d % self.width) + n*self.width
+        return reflect_into_bounds(prop, self.lower, self.width)
 
     def pass_through(self, prop):
         return prop
@@ -2180,6 +4917,511 @@ class EnsembleSampler(object):
 
 
 
+class DifferentialEvolutionSampler(object):
+    """
+    Implementation of differential-evolution MCMC with sampling from an archive of past
+    states (DE-MCz), which uses a small population of chains to sample from a posterior.
+
+    Each chain generates proposals by adding a scaled difference between two randomly
+    selected members of the archive to its current position. As the archive is built from
+    the past states of all the chains, the proposals automatically adapt to the scale and
+    correlation structure of the posterior. At regular intervals the scale of the difference
+    is set to one, which allows chains to jump directly between separated modes. As proposals
+    do not depend on the current positions of the other chains, the posterior is evaluated for
+    the whole population at once, either through a vectorised posterior or across a pool of
+    processes. Proposals which are rejected cause the current position to be repeated.
+
+    :param func posterior: \
+        a function which takes the vector of model parameters as a ``numpy.ndarray``,
+        and returns the posterior log-probability.
+
+    :param starting_positions: \
+        A list of parameter vectors (or a 2D ``numpy.ndarray``) giving the starting position of
+        each chain in the population.
+
+    :param archive: \
+        A list of parameter vectors used to initialise the archive, which ideally should be
+        spread over the region of interest (e.g. drawn from the prior). If not specified, the
+        starting positions are used. At least three archive members are required.
+
+    :param bounds: \
+        A list of [lower, upper] limit pairs for each parameter. Proposals outside the
+        limits are reflected back inside them.
+
+    :param float gamma: \
+        The scale of the difference vectors. If not specified, the value 2.38 / sqrt(2d)
+        is used for d parameters.
+
+    :param int jump_interval: \
+        The number of generations between mode-jumping generations, in which the scale of
+        the difference vectors is set to one.
+
+    :param int archive_interval: \
+        The number of generations between additions of the current states to the archive.
+
+    :param float noise: \
+        The standard deviation of a small random perturbation added to each proposal, as
+        a fraction of the standard deviation of the archive for each parameter.
+
+    :param bool vectorised: \
+        If set to ``True``, the posterior is instead called with a 2D ``numpy.ndarray`` containing
+        the proposals for all chains, and must return a 1D array of log-probabilities.
+
+    :param int n_processes: \
+        The number of processes across which the posterior evaluations are distributed when
+        the posterior is not vectorised.
+    """
+    def __init__(self, posterior = None, starting_positions = None, archive = None, bounds = None, gamma = None,
+                 jump_interval = 10, archive_interval = 10, noise = 1e-4, vectorised = False, n_processes = 1):
+        self.posterior = posterior
+        self.evaluator = BatchEvaluator(function = posterior, vectorised = vectorised, n_processes = n_processes)
+
+        if starting_positions is not None:
+            self.theta = array(starting_positions, dtype = float)
+            self.N_walkers, self.N_params = self.theta.shape
+            self.probs = self.evaluator(self.theta)
+
+            self.archive = [array(v, dtype = float) for v in (self.theta if archive is None else archive)]
+            if len(self.archive) < 3:
+                raise ValueError('at least three archive members are required')
+            self.update_archive_scale()
+
+            # storage for the history of the chains
+            self.L = 1  # total number of generations
+            self.history = [self.theta.copy()]
+            self.prob_history = [self.probs.copy()]
+            self.acceptance = []
+
+            self.gamma = 2.38 / sqrt(2*self.N_params) if gamma is None else gamma
+
+        self.jump_interval = jump_interval
+        self.archive_interval = archive_interval
+        self.noise = noise
+
+        if bounds is not None and len(bounds) == self.N_params:
+            self.bounded = True
+            self.lower = array([k[0] for k in bounds])
+            self.upper = array([k[1] for k in bounds])
+            self.width = self.upper - self.lower
+            self.process_proposal = self.impose_boundaries
+        else:
+            if bounds is not None:
+                warn("""
+                     # 'bounds' keyword error #
+                     The number of given lower/upper bounds pairs does not match
+                     the number of model parameters - bounds were not imposed.
+                     """)
+            self.process_proposal = self.pass_through
+            self.bounded = False
+
+        self.print_status = True
+
+    def update_archive_scale(self):
+        self.archive_scale = array(self.archive).std(axis = 0)
+
+    def proposals(self):
+        """
+        Generates a proposal for every chain in the population.
+        """
+        jump = self.jump_interval is not None and self.L % self.jump_interval == 0
+        g = 1. if jump else self.gamma
+
+        n = len(self.archive)
+        r1 = randint(n, size = self.N_walkers)
+        r2 = randint(n - 1, size = self.N_walkers)
+        r2 += (r2 >= r1)  # ensure the two archive members are distinct
+
+        Z = self.archive
+        diffs = array([Z[i] - Z[j] for i, j in zip(r1, r2)])
+        e = normal(size = self.theta.shape) * (self.noise * self.archive_scale)
+        return self.process_proposal(self.theta + g*diffs + e)
+
+    def advance_all(self):
+        props = self.proposals()
+        p_new = self.evaluator(props)
+        accept = log(random(size = self.N_walkers)) < p_new - self.probs
+        self.theta[accept,:] = props[accept,:]
+        self.probs[accept] = p_new[accept]
+
+        self.L += 1
+        self.history.append(self.theta.copy())
+        self.prob_history.append(self.probs.copy())
+        self.acceptance.append(accept.mean())
+
+        if self.L % self.archive_interval == 0:
+            self.archive.extend(self.theta.copy())
+            self.update_archive_scale()
+
+    def advance(self, n):
+        """
+        Advances all chains in the population by *n* generations.
+
+        :param int n: number of generations.
+        """
+        t_start = time()
+        for k in range(n):
+            self.advance_all()
+
+            if self.print_status:
+                dt = time() - t_start
+                eta = int(dt * ((n/(k+1) - 1)))
+                msg = '\r  DifferentialEvolutionSampler:   [ {} / {} iterations completed  |  ETA: {} sec ]'.format(k+1,n,eta)
+                sys.stdout.write(msg)
+                sys.stdout.flush()
+
+        if self.print_status:
+            sys.stdout.write('\r  DifferentialEvolutionSampler:   [ {} / {} iterations completed ]                  '.format(n,n))
+            sys.stdout.flush()
+            sys.stdout.write('\n')
+
+    def get_sample(self, burn = 1, thin = 1):
+        """
+        Returns the sample generated by all chains in the population.
+
+        :param int burn: Number of generations to discard from the start of the chains.
+
+        :param int thin: \
+            Instead of returning every generation which is not discarded as part of the
+            burn-in, every *m*'th generation is returned for a specified integer *m*.
+
+        :return: A 2D ``numpy.ndarray`` of shape (number of samples, number of parameters).
+        """
+        return concatenate(self.history[burn::thin], axis = 0)
+
+    def get_parameter(self, n, burn = 1, thin = 1):
+        """
+        Returns the sample of the *n*'th parameter from all chains in the population.
+        """
+        return self.get_sample(burn = burn, thin = thin)[:,n]
+
+    def get_probabilities(self, burn = 1, thin = 1):
+        """
+        Returns the log-probabilities of the sample from all chains in the population.
+        """
+        return concatenate(self.prob_history[burn::thin])
+
+    def acceptance_rate(self):
+        """
+        Returns the fraction of proposals which have been accepted.
+        """
+        return mean(self.acceptance)
+
+    def impose_boundaries(self, prop):
+        return reflect_into_bounds(prop, self.lower, self.width)
+
+    def pass_through(self, prop):
+        return prop
+
+    def mode(self):
+        probs = array(self.prob_history)
+        g, i = divmod(probs.argmax(), self.N_walkers)
+        return self.history[g][i,:]
+
+    def matrix_plot(self, burn = 1, thin = 1, **kwargs):
+        params = [k for k in self.get_sample(burn = burn, thin = thin).T]
+        matrix_plot(samples = params, **kwargs)
+
+    def trace_plot(self, burn = 1, thin = 1, **kwargs):
+        params = [k for k in self.get_sample(burn = burn, thin = thin).T]
+        trace_plot(samples = params, **kwargs)
+
+    def close(self):
+        """
+        Shut down the process pool used to evaluate the posterior, if one has been created.
+        """
+        self.evaluator.close()
+
+    def save(self, filename):
+        D = {
+            'history':array(self.history),
+            'prob_history':array(self.prob_history),
+            'archive':array(self.archive),
+            'acceptance':array(self.acceptance),
+            'L':self.L,
+            'gamma':self.gamma,
+            'jump_interval':-1 if self.jump_interval is None else self.jump_interval,
+            'archive_interval':self.archive_interval,
+            'noise':self.noise,
+            'bounded':self.bounded
+        }
+
+        if self.bounded:
+            D['lower'] = self.lower
+            D['upper'] = self.upper
+
+        savez(filename, **D)
+
+    @classmethod
+    def load(cls, filename, posterior = None, vectorised = False, n_processes = 1):
+        D = load(filename)
+        bounds = list(zip(D['lower'], D['upper'])) if bool(D['bounded']) else None
+        jump_interval = int(D['jump_interval'])
+        sampler = cls(posterior = posterior, bounds = None, jump_interval = None if jump_interval < 0 else jump_interval,
+                      archive_interval = int(D['archive_interval']), noise = float(D['noise']),
+                      vectorised = vectorised, n_processes = n_processes)
+
+        sampler.history = [v for v in D['history']]
+        sampler.prob_history = [v for v in D['prob_history']]
+        sampler.theta = sampler.history[-1].copy()
+        sampler.probs = sampler.prob_history[-1].copy()
+        sampler.N_walkers, sampler.N_params = sampler.theta.shape
+        sampler.archive = [v for v in D['archive']]
+        sampler.update_archive_scale()
+        sampler.acceptance = list(D['acceptance'])
+        sampler.L = int(D['L'])
+        sampler.gamma = float(D['gamma'])
+
+        if bounds is not None:
+            sampler.bounded = True
+            sampler.lower = D['lower']
+            sampler.upper = D['upper']
+            sampler.width = sampler.upper - sampler.lower
+            sampler.process_proposal = sampler.impose_boundaries
+
+        return sampler
+
+
+
+
+
+
+class ImportanceReweighting(object):
+    """
+    Re-weights the sample from a finished chain so that it represents a modified posterior,
+    for example one with a changed prior or an additional measurement, without running a
+    new chain.
+
+    The log-ratio of the modified posterior to the posterior sampled by the chain is
+    evaluated at each stored sample, and converted to Pareto-smoothed importance weights
+    (PSIS), where the largest raw weights are replaced by quantiles of a generalised-Pareto
+    distribution fitted to the upper tail of the weights. The estimated shape parameter
+    of the fitted distribution, ``k_hat``, indicates whether the re-weighted sample is
+    reliable - values below 0.5 are good, values between 0.5 and 0.7 are acceptable, and
+    for values above 0.7 the modified posterior is too different from the original and a
+    new chain should be run.
+
+    :param chain: \
+        The finished chain, which must provide the ``get_sample_array`` and ``get_probabilities``
+        methods, e.g. a ``MarkovChain``, ``PcaChain`` or ``HamiltonianChain`` instance.
+
+    :param func posterior: \
+        A function which takes the vector of model parameters as a ``numpy.ndarray``, and
+        returns the log-probability of the modified posterior.
+
+    :param bool log_ratio: \
+        If set to ``True``, ``posterior`` is instead taken to return the log-ratio of the
+        modified posterior to the original, which is often much cheaper to evaluate, for
+        example when a single measurement is added to the likelihood.
+
+    :param int burn: \
+        Number of samples to discard from the start of the chain. If not specified,
+        the value of chain.burn is used instead.
+
+    :param int thin: \
+        Rather than using every sample which is not discarded as part of the burn-in,
+        every *m*'th sample is used for a specified integer *m*. If not specified, the
+        value of chain.thin is used instead.
+
+    :param bool vectorised: \
+        If set to ``True``, ``posterior`` is called once with a 2D ``numpy.ndarray`` containing
+        all of the samples.
+
+    :param int n_processes: \
+        The number of processes over which the evaluations of ``posterior`` are distributed.
+    """
+    def __init__(self, chain = None, posterior = None, log_ratio = False, burn = None, thin = None,
+                 vectorised = False, n_processes = 1):
+        if burn is None: burn = chain.burn
+        if thin is None: thin = chain.thin
+        self.sample = array(chain.get_sample_array(burn = burn, thin = thin))
+        self.L = self.sample.shape[1]
+        # the chain samples the posterior raised to its inverse-temperature
+        inv_temp = getattr(chain, 'inv_temp', 1.)
+        chain_probs = array(chain.get_probabilities(burn = burn, thin = thin), dtype = float)
+
+        evaluator = BatchEvaluator(function = posterior, vectorised = vectorised, n_processes = n_processes)
+        values = evaluator(self.sample)
+        evaluator.close()
+
+        if log_ratio:
+            self.probs = chain_probs / inv_temp + values
+        else:
+            self.probs = values
+
+        self.log_weights, self.k_hat = pareto_smoothed_weights(self.probs - chain_probs)
+        self.weights = exp(self.log_weights)
+
+        if self.k_hat > 0.7:
+            warn(
+                """\n
+                [ ImportanceReweighting warning ]
+                >> The estimated Pareto shape parameter k_hat = {:.2f} exceeds 0.7, so the
+                >> re-weighted sample is unreliable. A new chain should be run instead.
+                """.format(self.k_hat)
+            )
+
+    @property
+    def effective_sample_size(self):
+        """
+        The effective number of samples in the re-weighted sample.
+        """
+        return 1. / (self.weights**2).sum()
+
+    def resample(self, n = None):
+        """
+        Draw an un-weighted sample from the re-weighted sample using systematic resampling.
+
+        :param int n: The number of points to draw. Defaults to the size of the chain sample.
+
+        :return: Indices of the selected points.
+        """
+        if n is None: n = len(self.weights)
+        positions = (arange(n) + random()) / n
+        inds = cumsum(self.weights).searchsorted(positions)
+        return permutation(inds.clip(0, len(self.weights)-1))
+
+    def get_parameter(self, n):
+        """
+        Return the sample values for a chosen parameter, which correspond to the weights
+        given by the ``weights`` attribute.
+
+        :param int n: Index of the parameter for which samples are to be returned.
+        """
+        return self.sample[:,n]
+
+    def get_marginal(self, n, unimodal = False):
+        """
+        Estimate the 1D marginal distribution of a chosen parameter under the modified
+        posterior, using an un-weighted sample drawn from the re-weighted sample.
+
+        :param int n: \
+            Index of the parameter for which the marginal distribution is to be estimated.
+
+        :param bool unimodal: \
+            If set to ``True``, the UnimodalPdf class is used to estimate the density,
+            otherwise a GaussianKDE object is returned.
+        """
+        values = self.sample[self.resample(), n]
+        if unimodal:
+            return UnimodalPdf(values)
+        else:
+            return GaussianKDE(values)
+
+    def get_interval(self, interval = 0.95, samples = None):
+        """
+        Return the samples which lie inside a chosen highest-density interval of the
+        modified posterior.
+
+        :param float interval: \
+            Total probability of the desired interval. The samples with the highest
+            modified posterior log-probability which together make up this fraction
+            of the total weight are returned.
+
+        :param int samples: \
+            If specified, this number of points is drawn from the interval in proportion
+            to their weights, so the returned weights are all equal.
+
+        :return: List containing sample points stored as tuples, the corresponding modified
+                 posterior log-probability values, and the normalised weights of the points.
+        """
+        inds = self.probs.argsort()[::-1]
+        # keep the highest-probability points until the requested weight is contained
+        cumulative = cumsum(self.weights[inds])
+        n_keep = min(cumulative.searchsorted(interval) + 1, len(inds))
+        inds = inds[:n_keep]
+        weights = self.weights[inds] / self.weights[inds].sum()
+
+        if samples is not None:
+            positions = (arange(samples) + random()) / samples
+            picks = cumsum(weights).searchsorted(positions).clip(0, n_keep-1)
+            inds = inds[picks]
+            weights = full(samples, 1. / samples)
+
+        return list(zip(*self.sample[inds,:].T)), self.probs[inds], weights
+
+    def sample_hdi(self, n, fraction = 0.95):
+        """
+        Estimate the highest-density interval of a chosen parameter under the modified posterior.
+
+        :param int n: Index of the parameter for which the interval is to be estimated.
+
+        :param float fraction: The fraction of the total probability contained by the interval.
+
+        :return: tuple specifying the lower and upper bounds of the interval.
+        """
+        return sample_hdi(self.sample[:,n], fraction, weights = self.weights)
+
+    def matrix_plot(self, params = None, **kwargs):
+        """
+        Construct a 'matrix plot' of the parameters (or a subset) under the modified posterior,
+        using an un-weighted sample drawn from the re-weighted sample. See the documentation
+        of ``inference.plotting.matrix_plot`` for a description of the available keyword arguments.
+        """
+        if params is None: params = range(self.L)
+        sample = self.sample[self.resample(),:]
+        matrix_plot([sample[:,i] for i in params], **kwargs)
+
+
+
+
+def pareto_smoothed_weights(log_weights):
+    """
+    Convert log importance-ratios into normalised Pareto-smoothed importance weights.
+
+    :param log_weights: The log importance-ratios as a 1D ``numpy.ndarray``.
+
+    :return: The log of the normalised smoothed weights, and the estimated Pareto shape parameter.
+    """
+    x = array(log_weights, dtype = float)
+    x -= x.max()
+    n = len(x)
+    # the number of weights in the tail to which the generalised-Pareto distribution is fitted
+    M = int(min(0.2 * n, 3 * sqrt(n)))
+    inds = argsort(x)
+    tail = inds[n-M:]
+    cutoff = exp(x[inds[n-M-1]])
+
+    if M <= 4:
+        k = inf
+    else:
+        exceedances = exp(x[tail]) - cutoff
+        k, sigma = generalised_pareto_fit(exceedances)
+        if isfinite(k):
+            # replace the tail weights with the expected order statistics of the fit
+            p = (arange(M) + 0.5) / M
+            if abs(k) < 1e-12:
+                q = -log(1 - p)
+            else:
+                q = expm1(-k * log(1 - p)) / k
+            # smoothed weights are truncated at the largest raw weight
+            x[tail] = minimum(log(sigma * q + cutoff), 0.)
+
+    x -= logsumexp(x)
+    return x, k
+
+
+def generalised_pareto_fit(x):
+    # Empirical-Bayes estimate of the generalised-Pareto distribution parameters
+    # following Zhang & Stephens (2009), with the weakly-informative prior on the shape
+    # parameter used by Vehtari et al. in the PSIS algorithm. 'x' must be sorted.
+    n = len(x)
+    m = 30 + int(sqrt(n))
+    b = 1 - sqrt(m / (arange(1, m+1) - 0.5))
+    b /= 3 * x[int(n/4 + 0.5) - 1]
+    b += 1 / x[-1]
+    k = log1p(-b[:,None] * x[None,:]).mean(axis = 1)
+    profile = n * (log(-b / k) - k - 1)
+    w = 1. / exp(profile[None,:] - profile[:,None]).sum(axis = 1)
+    b_post = (b * w).sum() / w.sum()
+    k_post = log1p(-b_post * x).mean()
+    sigma = -k_post / b_post
+    # shrink the shape estimate towards 0.5
+    k_post = (n * k_post + 5.) / (n + 10.)
+    return k_post, sigma
+
+
+
+
 def ESS(x):
     # get the autocorrelation
     f = irfft(abs(rfft(x - mean(x)))**2)
@@ -4,7 +4,7 @@
 """
 
 from numpy import exp, log, mean, std, sqrt, tanh, cos, cov
-from numpy import array, linspace, sort, searchsorted, pi, argmax, argsort, logaddexp
+from numpy import array, linspace, sort, searchsorted, pi, argmax, argsort, logaddexp, cumsum, arange
 from numpy.random import random
 from scipy.integrate import quad, simps
 from scipy.optimize import minimize, minimize_scalar, differential_evolution
@@ -608,7 +608,7 @@ class BinaryTree:
 
 
 
-def sample_hdi(sample, fraction, allow_double = False):
+def sample_hdi(sample, fraction, allow_double = False, weights = None):
     """
     Estimate the highest-density interval(s) for a given sample.
 
@@ -625,6 +625,11 @@ def sample_hdi(sample, fraction, allow_double = False):
         When set to True, a double-interval is returned instead if one exists whose total length
         is meaningfully shorter than the optimal single interval.
 
+    :param weights: \
+        Importance weights for each element of the sample. If specified, the interval
+        is instead the shortest which contains the chosen fraction of the total weight.
+        Double-intervals are not supported for weighted samples.
+
     :return: tuple(s) specifying the lower and upper bounds of the highest-density interval(s)
     """
 
@@ -632,6 +637,10 @@ def sample_hdi(sample, fraction, allow_double = False):
     if not 0. < fraction < 1.: raise ValueError('fraction parameter must be between 0 and 1')
     if not hasattr(sample, '__len__') or len(sample) < 2: raise ValueError('The sample must have at least 2 elements')
 
+    if weights is not None:
+        if allow_double: raise ValueError('allow_double is not supported for weighted samples')
+        return weighted_sample_hdi(sample, fraction, weights)
+
     s = array(sample)
     if len(s.shape) > 1: s = s.flatten()
     s = sort(s)
@@ -667,6 +676,33 @@ def sample_hdi(sample, fraction, allow_double = False):
 
 
 
+def weighted_sample_hdi(sample, fraction, weights):
+    s = array(sample).flatten()
+    w = array(weights, dtype = float).flatten()
+    if w.size != s.size: raise ValueError('sample and weights must have the same number of elements')
+
+    inds = argsort(s)
+    s = s[inds]
+    c = cumsum(w[inds])
+    c /= c[-1]
+
+    # for each possible lower limit, find the smallest upper limit for which the
+    # weight above the lower limit is at least the requested fraction of the total,
+    # which matches the un-weighted estimate when the weights are all equal
+    j = searchsorted(c, c + fraction - 1e-12)
+    valid = j < s.size
+    if not valid.any():
+        warn('The weights are too concentrated to estimate the interval for the given fraction')
+        return (s[0], s[-1])
+
+    i = arange(s.size)[valid]
+    widths = s[j[valid]] - s[i]
+    k = widths.argmin()
+    return (s[i[k]], s[j[valid][k]])
+
+
+
+
 class dbl_interval_length(object):
     def __init__(self, sample, fraction):
         self.sample = sort(sample)
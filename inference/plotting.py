@@ -2,7 +2,7 @@
 """
 .. moduleauthor:: Chris Bowman <chris.bowman.physics@gmail.com>
 """
-from numpy import array, meshgrid, linspace, sqrt, ceil, ndarray
+from numpy import array, meshgrid, linspace, sqrt, ceil, ndarray, take_along_axis, expand_dims
 from itertools import product, cycle
 from warnings import warn
 from inference.pdf_tools import GaussianKDE, KDE2D, sample_hdi
@@ -275,7 +275,9 @@ def hdi_plot(x, sample, intervals=(0.35, 0.65, 0.95), colormap='Blues', axis=Non
 
     :param samples: \
         A ``numpy.ndarray`` containing the sample data, which has shape ``(n, len(x))`` where
-        ``n`` is the number of samples.
+        ``n`` is the number of samples. Alternatively, an object with an ``hdi(fraction)``
+        method which returns the lower and upper limits of the intervals, such as an
+        instance of ``inference.predictive.PosteriorPredictive``.
 
     :keyword intervals: \
         A tuple containing the fractions of the total probability for each interval.
@@ -300,17 +302,20 @@ def hdi_plot(x, sample, intervals=(0.35, 0.65, 0.95), colormap='Blues', axis=Non
     if not all( (intervals > 0.) & (intervals < 1.) ):
         raise ValueError('All intervals must be greater than 0 and less than 1')
 
-    # check the sample data has compatible dimensions
-    s = array(sample)
-    if s.shape[1] != len(x):
-        if s.shape[0] == len(x):
-            s = s.T
-        else:
-            raise ValueError('"x" and "sample" have incompatible dimensions')
+    if hasattr(sample, 'hdi'):
+        get_interval = sample.hdi
+    else:
+        # check the sample data has compatible dimensions
+        s = array(sample)
+        if s.shape[1] != len(x):
+            if s.shape[0] == len(x):
+                s = s.T
+            else:
+                raise ValueError('"x" and "sample" have incompatible dimensions')
 
-    # sort the sample data
-    s.sort(axis=0)
-    n = s.shape[0]
+        # sort the sample data
+        s.sort(axis=0)
+        get_interval = lambda frac: sorted_sample_hdi(s, frac)
 
     # construct the colors for each interval
     cmap = get_cmap(colormap)
@@ -324,22 +329,9 @@ def hdi_plot(x, sample, intervals=(0.35, 0.65, 0.95), colormap='Blues', axis=Non
     # if not plotting axis is given, then use default pyplot
     if axis is None: axis = plt
 
-    from numpy import take_along_axis, expand_dims
-
     # iterate over the intervals and plot each
     for frac, col in zip(intervals, colors):
-        L = int(frac * n)
-
-        # check that we have enough samples to estimate the HDI for the chosen fraction
-        if n > L:
-            # find the optimal single HDI
-            widths = s[L:,:] - s[:n-L,:]
-            i = expand_dims(widths.argmin(axis=0), axis=0)
-            lwr = take_along_axis(s,i,0).squeeze()
-            upr = take_along_axis(s,i+L,0).squeeze()
-        else:
-            lwr = s[0,:]
-            upr = s[-1,:]
+        lwr, upr = get_interval(frac)
 
         if label_intervals:
             axis.fill_between(x, lwr, upr, color=col, label = '{}% HDI'.format(int(100*frac)))
@@ -351,6 +343,27 @@ def hdi_plot(x, sample, intervals=(0.35, 0.65, 0.95), colormap='Blues', axis=Non
 
 
 
+def sorted_sample_hdi(s, frac):
+    # find the optimal single HDI for each column of a sorted sample
+    n = s.shape[0]
+    L = int(frac * n)
+
+    # check that we have enough samples to estimate the HDI for the chosen fraction
+    if n > L:
+        widths = s[L:,:] - s[:n-L,:]
+        i = expand_dims(widths.argmin(axis=0), axis=0)
+        lwr = take_along_axis(s,i,0).squeeze()
+        upr = take_along_axis(s,i+L,0).squeeze()
+    else:
+        lwr = s[0,:]
+        upr = s[-1,:]
+    return lwr, upr
+
+
+
+
+
+
 def transition_matrix_plot(ax=None, matrix=None, colormap='viridis', exclude_diagonal=False, upper_triangular=False):
     """
     Plot the transition matrix of a Markov chain
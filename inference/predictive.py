@@ -0,0 +1,212 @@
+
+"""
+.. moduleauthor:: Chris Bowman <chris.bowman.physics@gmail.com>
+"""
+
+import sys
+from time import time
+from itertools import islice
+
+from numpy import array, zeros, concatenate, cumsum, floor, interp, isfinite, arange, bincount, inf, full
+
+from inference.mcmc import BatchEvaluator
+from inference.plotting import hdi_plot
+
+
+
+
+class PosteriorPredictive(object):
+    """
+    Computes summaries of the posterior-predictive distribution of a model, such as its
+    quantiles and highest-density intervals, by evaluating the model for each point in
+    a sample (for example one produced by an MCMC chain).
+
+    The sample is processed in chunks, where the model evaluations in each chunk can be
+    distributed across a pool of processes. Rather than storing the model predictions,
+    their distribution at each model output is accumulated in a histogram, so the memory
+    required does not depend on the size of the sample. The histogram range for each output
+    is set from the first chunk, and is doubled (by merging pairs of bins) whenever a later
+    prediction falls outside it, so quantiles and intervals are accurate to within roughly
+    one bin-width, i.e. a fraction ``1 / n_bins`` of the range of the predictions.
+
+    :param func model: \
+        A function which takes the vector of model parameters as a ``numpy.ndarray``, and
+        returns the model predictions as a 1D ``numpy.ndarray``, or a float for a model
+        with a single output.
+
+    :param int n_bins: The number of histogram bins used for each model output.
+
+    :param int chunk_size: The number of sample points evaluated in each chunk.
+
+    :param bool vectorised: \
+        If set to ``True``, the model is called once per chunk with a 2D ``numpy.ndarray``
+        of sample points, and must return a 2D array of predictions.
+
+    :param int n_processes: The number of processes over which the model evaluations are distributed.
+    """
+    def __init__(self, model = None, n_bins = 1000, chunk_size = 1000, vectorised = False, n_processes = 1):
+        if n_bins % 2 != 0:
+            raise ValueError('n_bins must be an even number')
+        self.evaluator = BatchEvaluator(function = model, vectorised = vectorised, n_processes = n_processes)
+        self.n_bins = n_bins
+        self.chunk_size = chunk_size
+
+        self.counts = None  # histogram counts with shape (number of outputs, n_bins)
+        self.lower = None  # lower edge of the histogram for each output
+        self.bin_width = None  # histogram bin-width for each output
+        self.totals = None  # sum of the predictions for each output
+        self.n_predictions = 0
+
+        self.print_status = True
+
+    def process(self, sample):
+        """
+        Evaluate the model for each point in a sample, and add the predictions to the summaries.
+
+        :param sample: \
+            The sample points as a 2D ``numpy.ndarray``, a list of parameter vectors
+            (e.g. as returned by ``MarkovChain.get_sample``) or any iterable which
+            yields parameter vectors, which is consumed one chunk at a time.
+        """
+        t_start = time()
+        points = iter(sample)
+        n_points = 0
+        while True:
+            chunk = list(islice(points, self.chunk_size))
+            if len(chunk) == 0: break
+            # ensure one row per point, as models with a single output may return a 1D array
+            predictions = array(self.evaluator(array(chunk, dtype = float)), dtype = float)
+            self.add_predictions(predictions.reshape([len(chunk), -1]))
+            n_points += len(chunk)
+
+            if self.print_status:
+                msg = '\r  PosteriorPredictive:   [ {} samples processed  |  time elapsed: {:.1f} sec ]'
+                sys.stdout.write(msg.format(n_points, time() - t_start))
+                sys.stdout.flush()
+
+        if self.print_status:
+            sys.stdout.write('\n')
+
+    def add_predictions(self, predictions):
+        """
+        Add a set of model predictions to the summaries.
+
+        :param predictions: \
+            The predictions as a 2D ``numpy.ndarray`` of shape (number of predictions, number of outputs).
+            A 1D array is treated as the predictions of a model with a single output.
+        """
+        P = array(predictions, dtype = float)
+        if P.ndim == 1: P = P.reshape([P.size, 1])
+        P = P[isfinite(P).all(axis = 1),:]
+        if P.shape[0] == 0: return
+
+        if self.counts is None:
+            self.initialise_histograms(P)
+        elif P.shape[1] != self.counts.shape[0]:
+            raise ValueError('the number of model outputs has changed')
+
+        # expand the histograms of any outputs where predictions fall outside the range
+        B = self.n_bins
+        for j in (P.min(axis = 0) < self.lower).nonzero()[0]:
+            while P[:,j].min() < self.lower[j]:
+                self.expand(j, downward = True)
+        for j in (P.max(axis = 0) >= self.lower + B*self.bin_width).nonzero()[0]:
+            while P[:,j].max() >= self.lower[j] + B*self.bin_width[j]:
+                self.expand(j, downward = False)
+
+        # add the predictions to the histograms
+        k = floor((P - self.lower[None,:]) / self.bin_width[None,:]).astype(int).clip(0, B-1)
+        flat_inds = (k + B*arange(P.shape[1])[None,:]).flatten()
+        self.counts += bincount(flat_inds, minlength = self.counts.size).reshape(self.counts.shape)
+        self.totals += P.sum(axis = 0)
+        self.n_predictions += P.shape[0]
+
+    def initialise_histograms(self, P):
+        lwr, upr = P.min(axis = 0), P.max(axis = 0)
+        span = upr - lwr
+        span[span == 0.] = abs(upr[span == 0.]) + 1.
+        self.lower = lwr - 0.05*span
+        self.bin_width = 1.1*span / self.n_bins
+        self.counts = zeros([P.shape[1], self.n_bins])
+        self.totals = zeros(P.shape[1])
+
+    def expand(self, j, downward = False):
+        # double the histogram range by merging pairs of bins, so the new bin edges
+        # are a subset of the old edges and no re-binning error is introduced
+        B = self.n_bins
+        merged = self.counts[j,:].reshape([B//2, 2]).sum(axis = 1)
+        empty = zeros(B//2)
+        if downward:
+            self.counts[j,:] = concatenate([empty, merged])
+            self.lower[j] -= B*self.bin_width[j]
+        else:
+            self.counts[j,:] = concatenate([merged, empty])
+        self.bin_width[j] *= 2
+
+    def edges(self, j):
+        return self.lower[j] + self.bin_width[j]*arange(self.n_bins + 1)
+
+    @property
+    def mean(self):
+        """
+        The mean of the predictions for each model output.
+        """
+        return self.totals / self.n_predictions
+
+    def quantiles(self, q):
+        """
+        Estimate quantiles of the predictions for each model output.
+
+        :param q: The quantile, or a sequence of quantiles, as fractions between 0 and 1.
+
+        :return: \
+            A ``numpy.ndarray`` of shape (number of quantiles, number of outputs), or
+            a 1D array if a single quantile is given.
+        """
+        q = array(q, dtype = float)
+        result = zeros([q.size, self.counts.shape[0]])
+        for j in range(self.counts.shape[0]):
+            C = concatenate([[0.], cumsum(self.counts[j,:])])
+            result[:,j] = interp(q.flatten() * C[-1], C, self.edges(j))
+        return result[0,:] if q.ndim == 0 else result
+
+    def hdi(self, fraction):
+        """
+        Estimate the highest-density interval of the predictions for each model output.
+
+        :param float fraction: The fraction of the total probability to be contained by the interval.
+
+        :return: \
+            The lower and upper limits of the interval for each output, as two 1D ``numpy.ndarray``.
+        """
+        if not 0. < fraction < 1.: raise ValueError('fraction parameter must be between 0 and 1')
+        n_outputs = self.counts.shape[0]
+        lwr, upr = full(n_outputs, inf), full(n_outputs, inf)
+        for j in range(n_outputs):
+            C = concatenate([[0.], cumsum(self.counts[j,:])])
+            edges = self.edges(j)
+            # for each bin edge as the lower limit, find the upper limit which
+            # contains the requested fraction of the predictions
+            targets = C + fraction*C[-1]
+            valid = targets <= C[-1]
+            upper = interp(targets[valid], C, edges)
+            i = (upper - edges[valid]).argmin()
+            lwr[j], upr[j] = edges[valid][i], upper[i]
+        return lwr, upr
+
+    def plot(self, x, intervals = (0.35, 0.65, 0.95), **kwargs):
+        """
+        Plot highest-density intervals of the predictions using ``inference.plotting.hdi_plot``,
+        which accepts the same keyword arguments.
+
+        :param x: The x-axis locations of the model outputs.
+
+        :param intervals: A tuple containing the fractions of the total probability for each interval.
+        """
+        hdi_plot(x, self, intervals = intervals, **kwargs)
+
+    def close(self):
+        """
+        Shut down the process pool used to evaluate the model, if one has been created.
+        """
+        self.evaluator.close()
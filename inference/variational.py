@@ -0,0 +1,274 @@
+
+"""
+.. moduleauthor:: Chris Bowman <chris.bowman.physics@gmail.com>
+"""
+
+import sys
+from time import time
+
+from numpy import array, zeros, exp, log, sqrt, dot, diag, tril, nan
+from numpy.random import normal
+
+from inference.mcmc import FiniteDifference, BatchEvaluator
+from inference.pdf_tools import UnimodalPdf, GaussianKDE
+from inference.plotting import matrix_plot
+
+
+
+
+class GaussianVariational(object):
+    """
+    Approximates the posterior with a multivariate-normal distribution using variational
+    inference, providing posterior summaries at a small fraction of the cost of MCMC.
+
+    The mean and covariance of the approximation are chosen to maximise the evidence
+    lower bound (ELBO), using stochastic gradients estimated from a small number of
+    random draws from the approximation at each iteration ('reparameterisation'
+    gradients, as in automatic-differentiation variational inference), with the
+    step-sizes chosen by the Adam algorithm. The covariance is either diagonal
+    ('mean-field') or a full covariance specified by its Cholesky factor ('full-rank').
+
+    The approximation cannot represent skewed, heavy-tailed or multi-modal posteriors,
+    and mean-field approximations typically under-estimate the posterior variance
+    when the parameters are correlated.
+
+    :param func posterior: \
+        a function which takes the vector of model parameters as a ``numpy.ndarray``,
+        and returns the posterior log-probability.
+
+    :param start: \
+        vector of model parameters at which the mean of the approximation is initialised.
+        Starting from the maximum a-posteriori estimate (see ``find_map``) reduces the
+        number of iterations required.
+
+    :param widths: \
+        vector of initial standard deviations of the approximation for each parameter.
+        The parameters are re-scaled using the widths of the approximation as the
+        optimisation proceeds, so these need only be rough guesses. If not specified,
+        the widths will be approximated as 5% of the values in 'start'.
+
+    :param func grad: \
+        A function which returns the gradient of the log-posterior probability density
+        for a given set of model parameters. If not given, the gradient is estimated
+        using ``FiniteDifference``.
+
+    :param bool full_rank: \
+        If set to ``True``, a full covariance matrix is used, otherwise the covariance is diagonal.
+
+    :param int n_draws: The number of random draws used to estimate the gradient at each iteration.
+
+    :param float learning_rate: The initial step-size of the Adam algorithm.
+
+    :param bool vectorised: \
+        If set to ``True``, the posterior is called with a 2D ``numpy.ndarray`` of points when
+        estimating gradients by finite-difference or evaluating the ELBO.
+
+    :param int n_processes: \
+        The number of processes used to evaluate the posterior when estimating gradients
+        by finite-difference or evaluating the ELBO.
+    """
+    def __init__(self, posterior = None, start = None, widths = None, grad = None, full_rank = False, n_draws = 10,
+                 learning_rate = 0.05, vectorised = False, n_processes = 1):
+        self.posterior = posterior
+        self.start = array(start, dtype = float)
+        self.L = len(self.start)
+        if widths is None:
+            widths = [ (s!=0.)*abs(s)*0.05 + (s==0.) for s in self.start ]
+        self.centre = self.start.copy()
+        self.scales = array(widths, dtype = float)
+
+        self.fd = FiniteDifference(function = posterior, vectorised = vectorised, n_processes = n_processes)
+        self.grad = self.fd if grad is None else grad
+        self.evaluator = BatchEvaluator(function = posterior, vectorised = vectorised, n_processes = n_processes)
+
+        self.full_rank = full_rank
+        self.n_draws = n_draws
+        self.learning_rate = learning_rate
+
+        # the variational parameters are defined for the scaled parameters (theta - centre) / scales,
+        # where the approximation has mean 'mu' and the log of the diagonal of the cholesky
+        # factor of its covariance is 'log_diag'. The elements below the diagonal of the
+        # cholesky factor are stored in 'lower' if the covariance is full-rank.
+        self.mu = zeros(self.L)
+        self.log_diag = zeros(self.L)
+        self.lower = zeros([self.L, self.L])
+
+        # Adam moment estimates for each of the variational parameters
+        self.moments = [[zeros(v.shape), zeros(v.shape)] for v in self.variational_parameters()]
+        self.iterations = 0
+        self.rescale_interval = 10
+
+        self.elbo_interval = 10
+        self.elbo_history = []
+        self.elbo_iterations = []
+        self.print_status = True
+
+    def variational_parameters(self):
+        if self.full_rank:
+            return [self.mu, self.log_diag, self.lower]
+        else:
+            return [self.mu, self.log_diag]
+
+    @property
+    def cholesky(self):
+        return diag(exp(self.log_diag)) + tril(self.lower, -1)
+
+    @property
+    def mean(self):
+        """
+        The mean of the approximation.
+        """
+        return self.centre + self.scales * self.mu
+
+    @property
+    def covariance(self):
+        """
+        The covariance matrix of the approximation.
+        """
+        C = self.cholesky * self.scales[:,None]
+        return dot(C, C.T)
+
+    def draw(self, z):
+        return self.centre + self.scales * (self.mu + dot(z, self.cholesky.T))
+
+    def fit(self, iterations = 1000):
+        """
+        Performs a chosen number of iterations of the ELBO maximisation.
+
+        :param int iterations: The number of iterations.
+        """
+        t_start = time()
+        for k in range(iterations):
+            self.take_step()
+
+            if self.print_status and (k+1) % 100 == 0:
+                elbo = self.elbo_history[-1] if len(self.elbo_history) > 0 else nan
+                msg = '\r  GaussianVariational:   [ {} / {} iterations completed  |  ELBO: {:.6g}  |  time elapsed: {:.1f} sec ]'
+                sys.stdout.write(msg.format(k+1, iterations, elbo, time() - t_start))
+                sys.stdout.flush()
+
+        if self.print_status:
+            sys.stdout.write('\n')
+
+    def take_step(self):
+        z = normal(size = [self.n_draws, self.L])
+        thetas = self.draw(z)
+        g = array([self.grad(t) for t in thetas]) * self.scales  # gradients w.r.t. scaled parameters
+
+        # gradients of the ELBO with respect to each variational parameter, where
+        # the derivative of the entropy of the approximation is included
+        G = dot(g.T, z) / self.n_draws
+        gradients = [g.mean(axis = 0), G.diagonal() * exp(self.log_diag) + 1.]
+        if self.full_rank:
+            gradients.append(tril(G, -1))
+
+        # the step-size decays so that the noise in the stochastic gradients averages out
+        self.iterations += 1
+        rate = self.learning_rate / sqrt(1. + self.iterations / 100.)
+        b1, b2 = 0.9, 0.999
+        for v, dv, m in zip(self.variational_parameters(), gradients, self.moments):
+            m[0] = b1*m[0] + (1 - b1)*dv
+            m[1] = b2*m[1] + (1 - b2)*dv**2
+            m_hat = m[0] / (1 - b1**self.iterations)
+            v_hat = m[1] / (1 - b2**self.iterations)
+            v += rate * m_hat / (sqrt(v_hat) + 1e-8)
+
+        if self.iterations % self.rescale_interval == 0:
+            self.rescale()
+
+        if self.iterations % self.elbo_interval == 0:
+            self.elbo_history.append(self.elbo(z))
+            self.elbo_iterations.append(self.iterations)
+
+    def rescale(self):
+        """
+        Re-centres the scaled parameters on the mean of the approximation, and re-scales
+        them using its marginal standard deviations.
+        """
+        # The Adam steps have a roughly fixed size in the scaled parameters, so scales which
+        # are much smaller than the posterior widths make the mean converge very slowly.
+        # This is an exact change of variables, where the moment estimates are transformed
+        # so that the steps taken by Adam are unchanged.
+        new_scales = sqrt(self.covariance.diagonal())
+        r = new_scales / self.scales
+        chol = self.cholesky / r[:,None]
+
+        self.centre = self.mean
+        self.scales = new_scales
+        self.mu[:] = 0.
+        self.log_diag[:] = log(chol.diagonal())
+        self.lower[:] = tril(chol, -1)
+
+        # gradients with respect to the mean and the lower elements scale with r
+        self.moments[0][0] *= r
+        self.moments[0][1] *= r**2
+        if self.full_rank:
+            self.moments[2][0] *= r[:,None]
+            self.moments[2][1] *= r[:,None]**2
+
+    def elbo(self, z = None):
+        """
+        Returns a Monte-Carlo estimate of the evidence lower bound (up to an additive constant).
+        """
+        if z is None: z = normal(size = [self.n_draws, self.L])
+        probs = self.evaluator(self.draw(z))
+        entropy = self.log_diag.sum() + log(self.scales).sum()
+        return probs.mean() + entropy
+
+    def get_sample(self, n = 10000):
+        """
+        Draws a sample from the approximation.
+
+        :param int n: The number of points in the sample.
+
+        :return: List containing sample points stored as tuples.
+        """
+        return list(zip(*self.draw(normal(size = [n, self.L])).T))
+
+    def get_parameter(self, n, n_samples = 10000):
+        """
+        Return sample values for a chosen parameter.
+
+        :param int n: Index of the parameter for which samples are to be returned.
+
+        :param int n_samples: The number of samples drawn from the approximation.
+
+        :return: List of samples for parameter *n*.
+        """
+        return list(self.mean[n] + sqrt(self.covariance[n,n]) * normal(size = n_samples))
+
+    def get_marginal(self, n, unimodal = False, n_samples = 10000):
+        """
+        Estimate the 1D marginal distribution of a chosen parameter from a sample
+        drawn from the approximation, as in ``MarkovChain.get_marginal``.
+
+        :param int n: \
+            Index of the parameter for which the marginal distribution is to be estimated.
+
+        :param bool unimodal: \
+            If set to ``True``, the UnimodalPdf class is used to estimate the density,
+            otherwise a GaussianKDE object is returned.
+
+        :param int n_samples: The number of samples drawn from the approximation.
+        """
+        if unimodal:
+            return UnimodalPdf(self.get_parameter(n, n_samples = n_samples))
+        else:
+            return GaussianKDE(self.get_parameter(n, n_samples = n_samples))
+
+    def matrix_plot(self, params = None, n_samples = 5000, **kwargs):
+        """
+        Construct a 'matrix plot' of the parameters (or a subset) using a sample drawn from
+        the approximation. See the documentation of ``inference.plotting.matrix_plot`` for
+        a description of the available keyword arguments.
+        """
+        if params is None: params = range(self.L)
+        sample = self.draw(normal(size = [n_samples, self.L]))
+        matrix_plot([sample[:,i] for i in params], **kwargs)
+
+    def close(self):
+        """
+        Shut down any process pools used to evaluate the posterior.
+        """
+        self.fd.close()
+        self.evaluator.close()
@@ -0,0 +1,63 @@
+
+import pytest
+import unittest
+
+from numpy import array, log, pi, inf
+from numpy.random import seed, uniform
+from inference.evidence import SmcSampler, NestedSampler
+
+
+def gaussian_likelihood(t):
+    return -0.5*((t / 0.3)**2).sum()
+
+def box_prior(t):
+    # uniform prior over [-5, 5] in both dimensions
+    return -2*log(10.) if (abs(t) <= 5).all() else -inf
+
+# the exact log-evidence for the above likelihood and prior
+exact_log_evidence = log(2*pi*0.3**2 / 100)
+
+
+
+
+class test_evidence(unittest.TestCase):
+
+    def test_smc_sampler(self):
+        seed(1)
+        smc = SmcSampler(log_likelihood=gaussian_likelihood, log_prior=box_prior, particles=uniform(-5, 5, size=(1000, 2)))
+        smc.print_status = False
+        smc.run()
+
+        self.assertEqual(smc.temperatures[-1], 1.)
+        self.assertLess(abs(smc.log_evidence - exact_log_evidence), 0.4)
+        sample = smc.get_sample()
+        self.assertEqual(sample.shape, (1000, 2))
+        self.assertTrue((abs(sample.std(axis=0) - 0.3) < 0.05).all())
+
+        with pytest.raises(ValueError):
+            SmcSampler(log_likelihood=gaussian_likelihood, log_prior=box_prior, particles=array([[0., 0.], [6., 0.]]))
+
+    def test_nested_sampler(self):
+        seed(2)
+        ns = NestedSampler(log_likelihood=gaussian_likelihood, log_prior=box_prior, live_points=uniform(-5, 5, size=(200, 2)),
+                           bounds=[[-5, 5], [-5, 5]], n_replace=10)
+        ns.print_status = False
+        ns.run()
+
+        self.assertLess(ns.remaining_fraction(), ns.tolerance)
+        self.assertTrue(0.05 < ns.log_evidence_error < 0.3)
+        self.assertLess(abs(ns.log_evidence - exact_log_evidence), 3*ns.log_evidence_error)
+
+        points, weights = ns.get_sample()
+        self.assertEqual(len(points), len(weights))
+        self.assertAlmostEqual(weights.sum(), 1.)
+        sample = ns.get_resampled(2000)
+        self.assertTrue((abs(sample.std(axis=0) - 0.3) < 0.05).all())
+        self.assertTrue((abs(sample) <= 5).all())
+
+
+
+
+if __name__ == '__main__':
+
+    unittest.main()
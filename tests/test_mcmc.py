@@ -1,9 +1,17 @@
 
+import os
 import pytest
+import tempfile
 import unittest
 
-from numpy import array, sqrt
-from inference.mcmc import GibbsChain, HamiltonianChain
+from numpy import array, memmap, sqrt, sort, concatenate, allclose, shares_memory, argmax, mean, log, inf, exp, linspace, unique, pi, arange
+from numpy.random import normal, seed, uniform
+from numpy.linalg import inv, det
+from inference.mcmc import GibbsChain, HamiltonianChain, FiniteDifference, StochasticGradientChain
+from inference.mcmc import SubsamplingChain, DecomposedPosterior, MarkovChain, PcaChain, PosteriorEmulator
+from inference.mcmc import BlockGibbsChain, ChromaticGibbsChain, greedy_colouring, IncrementalPosterior
+from inference.mcmc import AdaptiveMetropolisChain, DifferentialEvolutionSampler, ParallelTempering, ImportanceReweighting, BlobPosterior
+from inference.mcmc import find_map, EnsembleSampler, LaplaceApproximation
 
 
 def rosenbrock(t):
@@ -34,6 +42,57 @@ class ToroidalGaussian(object):
         return -g/self.w2
 
 
+def vectorised_rosenbrock(t):
+    # evaluates the rosenbrock posterior for a 2D array of points
+    return array([rosenbrock(v) for v in t])
+
+
+class LineSumPosterior(IncrementalPosterior):
+    # a sum of gaussian lines, where each line has an amplitude and a centre
+    def __init__(self):
+        self.x = linspace(0, 10, 50)
+        self.line_evaluations = 0
+        self.proposals = 0
+        self.y = self.model([1., 3., 2., 7.])
+
+    def propose(self, theta):
+        self.proposals += 1
+        return super(LineSumPosterior, self).propose(theta)
+
+    def line(self, a, c):
+        self.line_evaluations += 1
+        return a*exp(-0.5*(self.x - c)**2)
+
+    def model(self, theta):
+        return sum(self.line(theta[2*k], theta[2*k+1]) for k in range(len(theta) // 2))
+
+    def initial_state(self, theta):
+        lines = [self.line(theta[2*k], theta[2*k+1]) for k in range(len(theta) // 2)]
+        return lines, sum(lines)
+
+    def update_state(self, state, theta, changed):
+        lines, total = list(state[0]), state[1]
+        for k in unique(changed // 2):
+            new = self.line(theta[2*k], theta[2*k+1])
+            total = total + (new - lines[k])
+            lines[k] = new
+        return lines, total
+
+    def log_probability(self, theta, state):
+        return -0.5*(((self.y - state[1]) / 0.1)**2).sum()
+
+
+def line_prediction_posterior(t):
+    # gaussian posterior which also returns the prediction of a straight-line model
+    prediction = t[0] + t[1]*linspace(0, 1, 10)
+    return -0.5*(t**2).sum(), prediction
+
+
+def box_gaussian(t):
+    # gaussian with a normalised uniform prior over [-5, 5]
+    return -0.5*(t[0] / 0.3)**2 - log(10.)
+
+
 
 
 class test_mcmc_samplers(unittest.TestCase):
@@ -56,8 +115,697 @@ class test_mcmc_samplers(unittest.TestCase):
         posterior = ToroidalGaussian()
         chain = HamiltonianChain(posterior=posterior, grad=posterior.gradient, start=[1, 0.1, 0.1])
         chain.advance(3000)
+        # a finite-difference estimator is only needed when no gradient is given
+        self.assertIsNone(chain.fd)
+
+    def test_finite_difference(self):
+        posterior = ToroidalGaussian()
+        # include a zero-valued parameter, which previously broke the step-size scaling
+        theta = array([1.05, 0.2, 0.])
+        exact = posterior.gradient(theta)
+
+        for method in ['central', 'forward']:
+            fd = FiniteDifference(function=posterior, method=method)
+            self.assertTrue(allclose(fd(theta), exact, rtol=1e-3, atol=1e-3))
+
+        fd = FiniteDifference(function=posterior, step=1e-6, relative=False)
+        self.assertTrue(allclose(fd(theta), exact, rtol=1e-4, atol=1e-4))
+
+        # check batched evaluation via a vectorised function and a process pool
+        point = array([0.5, 0.3])
+        serial = FiniteDifference(function=rosenbrock)(point)
+        vec = FiniteDifference(function=vectorised_rosenbrock, vectorised=True)(point)
+        pooled = FiniteDifference(function=rosenbrock, n_processes=2)
+        self.assertTrue(allclose(serial, vec))
+        self.assertTrue(allclose(serial, pooled(point)))
+        pooled.close()
+
+        # check HamiltonianChain runs using the default finite-difference gradient
+        chain = HamiltonianChain(posterior=posterior, start=[1, 0.1, 0.1])
+        chain.advance(100)
+        self.assertIsInstance(chain.fd, FiniteDifference)
+
+    def test_stochastic_gradient_chain(self):
+        seed(1)
+        N = 10000
+        data = normal(loc=3., scale=1., size=N)
+
+        def minibatch_gradient(theta, indices):
+            return array([(N / len(indices)) * (data[indices] - theta[0]).sum()])
+
+        for method, epsilon in [('sghmc', 0.1), ('sgld', 0.5)]:
+            chain = StochasticGradientChain(grad=minibatch_gradient, start=[0.], n_data=N, batch_size=100,
+                                            epsilon=epsilon, inv_mass=[1e-4], method=method)
+            chain.print_status = False
+            chain.advance(1000)
+            sample_mean = mean(chain.get_parameter(0, burn=200))
+            self.assertLess(abs(sample_mean - data.mean()), 0.05)
+
+            # the sampler settings should be restored, so the loaded chain can be advanced
+            with tempfile.TemporaryDirectory() as tmp:
+                filename = os.path.join(tmp, 'sg_chain.npz')
+                chain.save(filename)
+                loaded = StochasticGradientChain.load(filename, grad=minibatch_gradient)
+            self.assertEqual(loaded.method, method)
+            self.assertEqual(loaded.friction, chain.friction)
+            self.assertEqual(loaded.index_sampler.n_data, N)
+            self.assertEqual(loaded.index_sampler.batch_size, 100)
+            loaded.advance(100)
+            self.assertEqual(loaded.n, chain.n + 100)
+            self.assertTrue(len(set(loaded.get_parameter(0, burn=chain.n))) > 1)
+
+    def test_subsampling_chain(self):
+        seed(2)
+        N = 5000
+        data = normal(loc=3., scale=2., size=N)
+
+        def log_likelihood(theta, indices):
+            mu, sigma = theta
+            return -0.5*((data[indices] - mu) / sigma)**2 - log(sigma)
+
+        def log_prior(theta):
+            return 0. if theta[1] > 0 else -1e50
+
+        chain = SubsamplingChain(log_prior=log_prior, log_likelihood=log_likelihood, n_blocks=N,
+                                 start=[2.9, 2.1], widths=[0.05, 0.05], batch_size=100)
+        chain.print_status = False
+        chain.advance(1000)
+        self.assertLess(abs(mean(chain.get_parameter(0, burn=200)) - data.mean()), 0.15)
+        self.assertTrue(0. < chain.data_fraction() < 3.)
+
+        # the full likelihood should only be evaluated once at the starting position
+        evaluated = []
+        def counted_likelihood(theta, indices):
+            evaluated.append(len(indices))
+            return log_likelihood(theta, indices)
+
+        chain = SubsamplingChain(log_prior=log_prior, log_likelihood=counted_likelihood, n_blocks=N,
+                                 start=[2.9, 2.1], widths=[0.05, 0.05])
+        self.assertEqual(sum(evaluated), N)
+        self.assertAlmostEqual(chain.probs[0], log_likelihood(array([2.9, 2.1]), arange(N)).sum())
+
+        # blocks are drawn without replacement for each proposal
+        drawn = concatenate([chain.draw_blocks(k, 700) for k in range(0, N, 700)])
+        self.assertEqual(len(drawn), N)
+        self.assertEqual(len(unique(drawn)), N)
+        chain.print_status = False
+        chain.advance(100)
+
+        # the subsampling state should be restored, so the loaded chain can be advanced
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'subsampling_chain.npz')
+            chain.save(filename)
+            loaded = SubsamplingChain.load(filename, log_prior=log_prior, log_likelihood=log_likelihood)
+        self.assertEqual(loaded.n_blocks, N)
+        self.assertTrue(allclose(loaded.data_fractions, chain.data_fractions))
+        valid = loaded.term_labels == loaded.position_label
+        self.assertTrue(allclose(loaded.current_terms[valid], log_likelihood(array(chain.get_last()), arange(N))[valid]))
+        loaded.advance(100)
+        self.assertEqual(loaded.n, chain.n + 100)
+        self.assertGreater(len(set(loaded.get_parameter(0, burn=chain.n))), 1)
+
+    def test_early_rejection(self):
+        def prior(t):
+            return 0. if all(abs(t) < 3) else -inf
+
+        blocks = [lambda t: -0.5*(t[0] - 1)**2, lambda t: -0.5*((t[1] + t[0]) / 0.5)**2]
+
+        for chain_class in [MarkovChain, GibbsChain, PcaChain]:
+            posterior = DecomposedPosterior(prior, blocks)
+            start = array([0.5, -0.5])
+            self.assertAlmostEqual(posterior(start), sum(b(start) for b in blocks))
+
+            chain = chain_class(posterior=posterior, start=start, widths=[1., 1.])
+            chain.print_status = False
+            chain.advance(500)
+            self.assertEqual(len(chain.probs), chain.n)
+            self.assertGreater(posterior.skipped_evaluations, 0)
+            self.assertGreater(posterior.truncated_evaluations, 0)
+            summary = posterior.rejection_summary()
+            self.assertTrue(0. < summary['skipped'] + summary['truncated'] < 1.)
+
+        # with early rejection the accept / reject outcome is used as the acceptance probability
+        # estimate, which should agree on average with the exact acceptance probability
+        seed(5)
+        chain = MarkovChain(posterior=posterior, start=start, widths=[1., 1.])
+        estimates, exact = [], []
+        for proposal in start + normal(size=(2000, 2)):
+            accept, p_new, accept_prob = chain.metropolis_test(start, proposal, chain.probs[0])
+            self.assertEqual(accept_prob, float(accept))
+            estimates.append(accept_prob)
+            exact.append(min(exp(posterior(proposal) - chain.probs[0]), 1.))
+        self.assertGreater(posterior.truncated_evaluations, 0)
+        self.assertLess(abs(mean(estimates) - mean(exact)), 0.03)
+
+        # so the adapted proposal widths should match those found without early rejection
+        rosenbrock_blocks = [lambda t: -t[0]**2 * (1 + 0.5/3), lambda t: -15*(t[1] - t[0]**2)**2, lambda t: -0.5*t[1]**2 / 3]
+        widths = []
+        for target in [rosenbrock, DecomposedPosterior(lambda t: 0., rosenbrock_blocks)]:
+            seed(0)
+            chain = GibbsChain(posterior=target, start=[0., 0.], widths=[1., 1.])
+            chain.print_status = False
+            chain.advance(20000)
+            widths.append(array([p.sigma for p in chain.params]))
+        self.assertTrue(allclose(widths[1], widths[0], rtol=0.15))
+
+    def test_delayed_acceptance(self):
+        seed(4)
+        calls = []
+        def posterior(t):
+            calls.append(1)
+            return -0.5*((t[0] - 1)**2 + ((t[1] - t[0]) / 0.5)**2)
+
+        for chain_class in [GibbsChain, PcaChain]:
+            calls.clear()
+            emulator = PosteriorEmulator(min_points=30, max_points=100)
+            chain = chain_class(posterior=posterior, start=[0., 0.], widths=[1., 1.], emulator=emulator)
+            chain.print_status = False
+            chain.advance(1000)
+
+            self.assertTrue(emulator.ready)
+            self.assertGreater(emulator.screened, 0)
+            # every proposal which passed screening required one posterior call
+            self.assertEqual(len(calls), emulator.passed + emulator.min_points + 1)
+            self.assertLess(abs(mean(chain.get_parameter(0, burn=200)) - 1.), 0.3)
+
+    def test_prefetching(self):
+        for chain_class in [MarkovChain, GibbsChain, PcaChain]:
+            samples = []
+            for prefetch in [False, True]:
+                seed(7)
+                chain = chain_class(posterior=rosenbrock, start=[0.5, 0.5], widths=[1., 1.])
+                chain.print_status = False
+                if prefetch: chain.enable_prefetching(n_processes=2, depth=3)
+                chain.advance(200)
+                samples.append((array(chain.get_sample(burn=0)), array(chain.probs)))
+                if prefetch:
+                    self.assertGreater(chain.prefetcher.hits, 0)
+                    chain.disable_prefetching()
+
+            # the prefetching chain must be identical to the serial chain
+            self.assertTrue((samples[0][0] == samples[1][0]).all())
+            self.assertTrue((samples[0][1] == samples[1][1]).all())
+
+    def test_gibbs_slice_sampling(self):
+        seed(5)
+        def posterior(t):
+            return -0.5*((t[0] - 1)**2 + ((t[1] - t[0]) / 0.5)**2)
+
+        # deliberately poor initial widths, which the slice widths should recover from
+        chain = GibbsChain(posterior=posterior, start=[0., 0.], widths=[0.01, 100.], slice_sampling=True)
+        chain.print_status = False
+        chain.advance(3000)
+
+        x = array(chain.get_parameter(0, burn=500))
+        self.assertTrue((x[1:] != x[:-1]).all())  # slice-sampling updates always move
+        self.assertLess(abs(x.mean() - 1.), 0.2)
+        self.assertTrue(all(0.1 < p.sigma < 10. for p in chain.params))
+
+        # the slice-sampling settings and adaptation counters should survive saving and loading
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'slice_chain.npz')
+            chain.save(filename)
+            loaded = GibbsChain.load(filename, posterior=posterior)
+        self.assertTrue(loaded.slice_sampling)
+        self.assertTrue((loaded.expansions == chain.expansions).all())
+        self.assertTrue((loaded.slice_updates == chain.slice_updates).all())
+        loaded.advance(10)
+        self.assertEqual(loaded.n, chain.n + 10)
+
+        with pytest.raises(ValueError):
+            GibbsChain(posterior=posterior, start=[0., 0.], slice_sampling=True, emulator=PosteriorEmulator())
+        with pytest.raises(ValueError):
+            chain.enable_prefetching(n_processes=2)
+
+    def test_block_gibbs_chain(self):
+        seed(6)
+        calls = [0]
+        def posterior(t):
+            calls[0] += 1
+            # strongly correlated pair, plus an independent parameter
+            return -0.5*(((t[0] + t[1]) / 2.)**2 + ((t[0] - t[1]) / 0.05)**2 + t[2]**2)
+
+        chain = BlockGibbsChain(posterior=posterior, start=[0.5, 0.5, 0.], widths=[0.1, 0.1, 0.1], groups=[[0, 1]])
+        chain.print_status = False
+        chain.advance(6000)
+
+        # one posterior call per block per step
+        self.assertEqual(len(chain.groups), 2)
+        self.assertEqual(calls[0], 2*6000 + 1)
+
+        x = array(chain.get_parameter(0, burn=2000))
+        y = array(chain.get_parameter(1, burn=2000))
+        self.assertLess(abs(x.std() - 1.), 0.25)
+        self.assertGreater(mean((x - x.mean())*(y - y.mean())) / (x.std()*y.std()), 0.99)
+
+        # the groups and adapted proposals should be restored, so the loaded chain keeps moving
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'block_chain.npz')
+            chain.save(filename)
+            loaded = BlockGibbsChain.load(filename, posterior=posterior)
+        self.assertEqual([list(g) for g in loaded.groups], [list(g) for g in chain.groups])
+        for pc, loaded_pc in zip(chain.proposals, loaded.proposals):
+            self.assertTrue(allclose(loaded_pc.chol, pc.chol))
+            self.assertEqual(loaded_pc.log_scale_adjust, pc.log_scale_adjust)
+            self.assertEqual(loaded_pc.count, pc.count)
+            self.assertTrue(loaded_pc.adapted)
+        loaded.advance(200)
+        x = array(loaded.get_parameter(0, burn=chain.n))
+        self.assertGreater(mean(x[1:] != x[:-1]), 0.1)
+
+        with pytest.raises(ValueError):
+            BlockGibbsChain(posterior=posterior, start=[0., 0., 0.], groups=[[0, 1], [1, 2]])
+
+    def test_proposal_scale_limit(self):
+        seed(3)
+        # a uniform distribution over a bounded region cannot reach the target acceptance
+        # rate, which should not cause the proposal scale to grow without limit
+        chain = BlockGibbsChain(posterior=lambda t: 0., start=[0., 0.], widths=[1., 1.], groups=[[0, 1]])
+        chain.set_boundaries(0, [-1, 1])
+        chain.set_boundaries(1, [-1, 1])
+        chain.print_status = False
+        chain.advance(3000)
+        self.assertLess(chain.proposals[0].log_scale_adjust, 10.01)
+        self.assertLess(abs(mean(chain.get_parameter(0, burn=500))), 0.1)
+
+    def test_chromatic_gibbs_chain(self):
+        seed(3)
+        # hierarchical model where per-channel parameters are linked only through a shared mean
+        n = 10
+        y = normal(size=n) + 2.
+
+        def posterior(t):
+            mu, c = t[0], t[1:]
+            return -0.5*((c - mu)**2).sum() - 0.5*(((y - c) / 0.5)**2).sum() - 0.5*mu**2 / 100
+
+        def local_posterior(t, i):
+            if i == 0:
+                return -0.5*((t[1:] - t[0])**2).sum() - 0.5*t[0]**2 / 100
+            return -0.5*(t[i] - t[0])**2 - 0.5*((y[i-1] - t[i]) / 0.5)**2
+
+        dependencies = [list(range(1, n+1))] + [[0]]*n
+        self.assertEqual(greedy_colouring(dependencies), [[0], list(range(1, n+1))])
+
+        chain = ChromaticGibbsChain(posterior=posterior, local_posterior=local_posterior, start=[0.]*(n+1),
+                                    widths=[0.5]*(n+1), dependencies=dependencies)
+        chain.print_status = False
+        chain.advance(3000)
+
+        # the log-probability tracked through the local terms should match the posterior
+        self.assertTrue(allclose(chain.probs[-1], posterior(array(chain.get_last()))))
+        self.assertLess(abs(mean(chain.get_parameter(0, burn=500)) - y.mean()), 0.3)
+
+        # a re-loaded chain should keep the colouring and continue with chromatic updates
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'chromatic_chain.npz')
+            chain.save(filename)
+            calls = []
+            new_chain = ChromaticGibbsChain.load(filename, posterior=posterior,
+                                                 local_posterior=lambda t, i: calls.append(i) or local_posterior(t, i))
+
+        self.assertEqual([list(c) for c in new_chain.colouring], [[0], list(range(1, n+1))])
+        new_chain.advance(100)
+        self.assertEqual(new_chain.n, chain.n + 100)
+        self.assertEqual(sorted(set(calls)), list(range(n+1)))
+        self.assertFalse(allclose(new_chain.get_last(), chain.get_last()))
+        self.assertTrue(allclose(new_chain.probs[-1], posterior(array(new_chain.get_last()))))
+
+        with pytest.raises(ValueError):
+            ChromaticGibbsChain(posterior=posterior, local_posterior=local_posterior, start=[0.]*(n+1),
+                                dependencies=dependencies, colouring=[list(range(n+1))])
+
+    def test_incremental_posterior(self):
+        posterior = LineSumPosterior()
+        start = [1.1, 2.9, 1.9, 7.1]
+
+        seed(8)
+        chain = GibbsChain(posterior=posterior, start=start, widths=[0.05]*4)
+        chain.print_status = False
+        posterior.line_evaluations = 0
+        posterior.proposals = 0
+        chain.advance(500)
+        # each single-parameter update should only re-calculate one line
+        self.assertGreater(posterior.proposals, 2000)
+        self.assertEqual(posterior.line_evaluations, posterior.proposals)
+
+        # the chain should match one which evaluates the full posterior each time
+        seed(8)
+        reference = GibbsChain(posterior=lambda t: posterior(t), start=start, widths=[0.05]*4)
+        reference.print_status = False
+        reference.advance(500)
+        self.assertTrue(allclose(chain.get_probabilities(), reference.get_probabilities()))
+        self.assertTrue(allclose(array(chain.get_sample()), array(reference.get_sample())))
+
+        with pytest.raises(ValueError):
+            chain.enable_prefetching(n_processes=2)
+
+        # subclasses which do not implement the required methods cannot be created
+        class IncompletePosterior(IncrementalPosterior):
+            def initial_state(self, theta):
+                return theta
+
+        with pytest.raises(TypeError):
+            IncompletePosterior()
+
+    def test_adaptive_metropolis_chain(self):
+        seed(4)
+        calls = [0]
+        def posterior(t):
+            calls[0] += 1
+            return -0.5*(((t[0] + t[1]) / 2.)**2 + ((t[0] - t[1]) / 0.1)**2)
+
+        chain = AdaptiveMetropolisChain(posterior=posterior, start=[0., 0.], widths=[1., 1.])
+        chain.print_status = False
+        chain.advance(8000)
+        self.assertEqual(calls[0], 8001)
+
+        # the proposal covariance should have adapted to the strong correlation
+        S = chain.proposal_covariance
+        self.assertGreater(S[0, 1] / sqrt(S[0, 0]*S[1, 1]), 0.95)
+
+        x = array(chain.get_parameter(0, burn=2000))
+        self.assertLess(abs(x.std() - 1.), 0.2)
+        acceptance = mean(x[1:] != x[:-1])
+        self.assertTrue(0.1 < acceptance < 0.4)
+
+        # the adapted proposal should be restored, so the loaded chain continues with it
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'am_chain.npz')
+            chain.save(filename)
+            new_chain = AdaptiveMetropolisChain.load(filename, posterior=posterior)
+        self.assertTrue(allclose(new_chain.proposal_covariance, S))
+        self.assertEqual(new_chain.proposals[0].target_rate, chain.proposals[0].target_rate)
+        self.assertEqual(new_chain.proposals[0].count, chain.proposals[0].count)
+        new_chain.advance(200)
+        self.assertEqual(new_chain.n, chain.n + 200)
+        self.assertEqual(calls[0], 8201)
+        y = array(new_chain.get_parameter(0, burn=chain.n))
+        self.assertTrue(0.05 < mean(y[1:] != y[:-1]) < 0.5)
+
+    def test_differential_evolution_sampler(self):
+        seed(2)
+        # bimodal posterior with well-separated modes
+        def posterior(t):
+            a = -0.5*(((t - 3.) / 0.5)**2).sum()
+            b = -0.5*(((t + 3.) / 0.5)**2).sum()
+            return max(a, b) + log(1 + exp(-abs(a - b)))
+
+        sampler = DifferentialEvolutionSampler(posterior=posterior, starting_positions=normal(size=(5, 2)),
+                                               archive=uniform(-6, 6, size=(30, 2)), bounds=[[-10, 10], [-10, 10]])
+        sampler.print_status = False
+        sampler.advance(3000)
+
+        x = sampler.get_parameter(0, burn=500)
+        self.assertEqual(len(x), 2501*5)
+        self.assertTrue(0.35 < mean(x > 0) < 0.65)  # both modes should be sampled
+        self.assertTrue(0.1 < sampler.acceptance_rate() < 0.5)
+
+        # proposals outside the bounds should be reflected back inside
+        prop = array([[-12., 3.], [25., 10.5]])
+        self.assertTrue(allclose(sampler.impose_boundaries(prop), [[-8., 3.], [-5., 9.5]]))
+
+        with pytest.raises(ValueError):
+            DifferentialEvolutionSampler(posterior=posterior, starting_positions=[[0., 0.], [1., 1.]])
+
+    def test_parallel_tempering_evidence(self):
+        seed(9)
+        chains = []
+        for k in range(13):
+            chain = AdaptiveMetropolisChain(posterior=box_gaussian, start=[0.], widths=[0.3], temperature=10**(0.25*k))
+            chain.set_boundaries(0, [-5, 5])
+            chains.append(chain)
+
+        pt = ParallelTempering(chains)
+        pt.advance(500)
+        pt.reset_evidence()
+        pt.advance(5000)
+        log_z, error = pt.log_evidence(log_volume=log(10.))
+        pt.shutdown()
+
+        exact = log(sqrt(2*pi)*0.3 / 10.)
+        self.assertTrue(0. < error < 0.1)
+        self.assertLess(abs(log_z - exact), 0.25)
+
+    def test_find_map(self):
+        seed(1)
+        mu = array([10., -3., 50.])
+        C = array([[1., 0.9, 0.], [0.9, 1., 0.], [0., 0., 4.]])
+        P = inv(C)
+        def posterior(t):
+            d = t - mu
+            return -0.5*d.dot(P).dot(d)
+
+        def gradient(t):
+            return -P.dot(t - mu)
+
+        for grad in [None, gradient]:
+            laplace = find_map(posterior, [0., 0., 0.], grad=grad)
+            self.assertTrue(allclose(laplace.mode, mu, atol=1e-4))
+            self.assertTrue(allclose(laplace.covariance, C, atol=1e-4))
+        self.assertAlmostEqual(laplace.log_evidence, 0.5*log(det(2*pi*C)), places=4)
+
+        # the evidence can only be estimated when the log-probability at the mode is given
+        approx = LaplaceApproximation(mode=mu, hessian=-P)
+        self.assertIsNone(approx.log_evidence)
+        self.assertTrue(allclose(approx.covariance, C))
+
+        # chains which are initialised from the approximation should need no burn-in
+        for chain_type in [MarkovChain, GibbsChain, PcaChain, AdaptiveMetropolisChain, HamiltonianChain]:
+            chain = chain_type(posterior=posterior, start=laplace.mode)
+            laplace.initialise(chain)
+            chain.print_status = False
+            chain.advance(1000)
+            x = array(chain.get_parameter(2))
+            self.assertLess(abs(x.std() - 2.), 0.5)
+
+        walkers = laplace.get_sample(20)
+        self.assertEqual(walkers.shape, (20, 3))
+        with pytest.raises(TypeError):
+            laplace.initialise(EnsembleSampler(posterior=posterior, starting_positions=walkers))
+
+    def test_tuning_transfer(self):
+        seed(3)
+        def posterior(t):
+            return -0.5*(((t[0] - t[1]) / 0.1)**2 + (t[0] + t[1])**2)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'tuning_test_file.npz')
+            for chain_type in [GibbsChain, PcaChain, AdaptiveMetropolisChain, HamiltonianChain]:
+                chain = chain_type(posterior=posterior, start=[1., 1.])
+                chain.print_status = False
+                chain.advance(2000)
+                chain.save_tuning(filename)
+
+                new_chain = chain_type(posterior=posterior, start=[0.5, 0.5])
+                new_chain.load_tuning(filename)
+                old_tuning, new_tuning = chain.get_tuning(), new_chain.get_tuning()
+                self.assertEqual(set(old_tuning.keys()), set(new_tuning.keys()))
+                for key in old_tuning:
+                    self.assertTrue(allclose(old_tuning[key], new_tuning[key]))
+
+            # tuning settings for a different number of parameters should be rejected
+            GibbsChain(posterior=posterior, start=[1., 1.]).save_tuning(filename)
+            with pytest.raises(ValueError):
+                GibbsChain(posterior=lambda t: 0., start=[0., 0., 0.]).load_tuning(filename)
+
+    def test_importance_reweighting(self):
+        seed(4)
+        def posterior(t):
+            return -0.5*(t**2).sum()
+
+        chain = PcaChain(posterior=posterior, start=[0.5, 0.5])
+        chain.print_status = False
+        chain.advance(20000)
+        chain.burn = 1000
+
+        # add a measurement of the first parameter with value 1 and uncertainty 1,
+        # giving a modified posterior for that parameter with mean 0.5 and variance 0.5
+        def new_measurement(t):
+            return -0.5*(t[0] - 1.)**2
+
+        rw = ImportanceReweighting(chain=chain, posterior=new_measurement, log_ratio=True)
+        self.assertLess(rw.k_hat, 0.5)
+        self.assertAlmostEqual(rw.weights.sum(), 1.)
+        x = rw.get_parameter(0)
+        mu = (rw.weights * x).sum()
+        sigma = sqrt((rw.weights * (x - mu)**2).sum())
+        self.assertLess(abs(mu - 0.5), 0.1)
+        self.assertLess(abs(sigma - sqrt(0.5)), 0.1)
+
+        lwr, upr = rw.sample_hdi(0, fraction=0.95)
+        self.assertLess(abs(lwr - (0.5 - 1.96*sqrt(0.5))), 0.2)
+        self.assertLess(abs(upr - (0.5 + 1.96*sqrt(0.5))), 0.2)
+        self.assertLess(abs(rw.get_marginal(0).mode - 0.5), 0.2)
+
+        sample, probs, weights = rw.get_interval(interval=0.5, samples=1000)
+        self.assertEqual(len(sample), 1000)
+        self.assertTrue((probs >= rw.probs.max() - 2.).all())
+
+        # a full evaluation of the modified posterior should give the same weights
+        full_rw = ImportanceReweighting(chain=chain, posterior=lambda t: posterior(t) + new_measurement(t))
+        self.assertTrue(allclose(full_rw.weights, rw.weights))
+
+    def test_blob_posterior(self):
+        seed(5)
+        x = linspace(0, 1, 10)
+        posterior = line_prediction_posterior
+
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'blob_test_file.npz')
+            for chain_type in [GibbsChain, PcaChain, BlockGibbsChain, HamiltonianChain]:
+                chain = chain_type(posterior=BlobPosterior(posterior), start=array([0.5, 0.5]))
+                chain.print_status = False
+                chain.advance(500)
+
+                # stored predictions should match the model evaluated at the samples
+                blobs = chain.get_blobs(burn=100, thin=3)
+                sample = array([chain.get_parameter(i, burn=100, thin=3) for i in range(2)]).T
+                self.assertEqual(blobs.shape, (len(sample), 10))
+                self.assertTrue(allclose(blobs, sample[:,0:1] + sample[:,1:2]*x[None,:]))
+
+                chain.save(filename)
+                loaded = chain_type.load(filename)
+                self.assertTrue(allclose(loaded.get_blobs(burn=0, thin=1), chain.get_blobs(burn=0, thin=1)))
+
+        with pytest.raises(ValueError):
+            GibbsChain(posterior=rosenbrock, start=[0., 0.]).get_blobs()
+
+        with pytest.raises(ValueError):
+            GibbsChain(posterior=BlobPosterior(posterior), start=[0., 0.]).enable_prefetching(2)
+
+        with pytest.raises(ValueError):
+            ChromaticGibbsChain(posterior=BlobPosterior(posterior), local_posterior=lambda t, i: 0.,
+                                start=[0., 0.], colouring=[[0], [1]])
+
+        # the stored predictions should follow the positions exchanged by parallel tempering
+        chains = [GibbsChain(posterior=BlobPosterior(posterior), start=[0.5, 0.5], temperature=T) for T in [1., 3., 9., 27.]]
+        for chain in chains:
+            chain.print_status = False
+        pt = ParallelTempering(chains)
+        pt.advance(200, swap_interval=5)
+        chains = pt.return_chains()
+        pt.shutdown()
+        self.assertGreater(pt.successful_swaps.sum(), 0)
+        for chain in chains:
+            sample = array([chain.get_parameter(i, burn=0, thin=1) for i in range(2)]).T
+            self.assertTrue(allclose(chain.get_blobs(burn=0, thin=1), sample[:,0:1] + sample[:,1:2]*x[None,:]))
+
+    def test_stream(self):
+        seed(7)
+        def posterior(t):
+            return -0.5*(t**2).sum()
+
+        for chain in [GibbsChain(posterior=posterior, start=[0.5, 0.5]), HamiltonianChain(posterior=posterior, start=array([0.5, 0.5]))]:
+            blocks = list(chain.stream(250, block=100))
+            self.assertEqual([b[0].shape for b in blocks], [(100, 2), (100, 2), (50, 2)])
+            self.assertEqual(chain.n, 251)
+            # the streamed blocks should match the stored history
+            samples = concatenate([b[0] for b in blocks])
+            probs = concatenate([b[1] for b in blocks])
+            self.assertTrue(allclose(samples[:,0], chain.get_parameter(0, burn=1, thin=1)))
+            self.assertTrue(allclose(probs, chain.get_probabilities(burn=1, thin=1)))
+
+        walkers = normal(size=[10, 2])
+        sampler = EnsembleSampler(posterior=posterior, starting_positions=walkers)
+        positions, probs = next(sampler.stream(20, block=20))
+        self.assertEqual(positions.shape, (20, 10, 2))
+        self.assertEqual(probs.shape, (20, 10))
+        self.assertTrue(allclose(positions[-1], sampler.theta))
+
+        # a non-positive block size would never advance the sampler
+        for sampler in [chain, sampler]:
+            with pytest.raises(ValueError):
+                next(sampler.stream(10, block=0))
+
+    def test_sample_array(self):
+        seed(8)
+        def posterior(t):
+            return -0.5*(t**2).sum()
+
+        chain = GibbsChain(posterior=posterior, start=[0.5, 0.5, 0.5])
+        chain.print_status = False
+        chain.advance(2000)
+
+        sample = chain.get_sample_array(burn=100, thin=3)
+        self.assertEqual(sample.shape, (len(range(100, chain.n, 3)), 3))
+        self.assertTrue(shares_memory(sample, chain.store.data))
+        self.assertTrue(shares_memory(chain.get_parameter(1), chain.store.data))
+        self.assertTrue(allclose(array(chain.get_sample(burn=100, thin=3)), sample))
+        self.assertEqual(tuple(chain.mode()), chain.get_sample(burn=0, thin=1)[argmax(chain.probs)])
+
+        # storage grows as required without changing the existing samples
+        first = chain.get_sample_array(burn=0, thin=1).copy()
+        chain.advance(2000)
+        self.assertTrue(allclose(chain.get_sample_array(burn=0, thin=1)[:len(first)], first))
+
+        hmc = HamiltonianChain(posterior=posterior, start=array([0.5, 0.5]))
+        hmc.print_status = False
+        hmc.advance(50)
+        self.assertEqual(hmc.get_sample_array(burn=0).shape, (51, 2))
+        self.assertTrue(shares_memory(hmc.get_parameter(0), hmc.theta.data))
+
+    def test_get_interval(self):
+        seed(9)
+        def posterior(t):
+            return -0.5*(t**2).sum()
+
+        chain = GibbsChain(posterior=posterior, start=[0.5, 0.5])
+        chain.print_status = False
+        chain.advance(3000)
+
+        for interval, burn in [(0.95, 100), (0.05, 0), (0.5, 2000), (0.95, 100)]:
+            sample, probs = chain.get_interval(interval=interval, burn=burn, thin=1)
+            all_probs = sort(chain.get_probabilities(burn=burn, thin=1))
+            k = len(all_probs) - int(len(all_probs)*(1 - interval))
+            self.assertTrue(allclose(probs, all_probs[-k:]))
+            self.assertTrue(allclose(probs, [posterior(array(t)) for t in sample]))
+
+        # the cached ordering must be updated once the chain takes new steps
+        chain.advance(1000)
+        sample, probs = chain.get_interval(interval=0.5, burn=0, samples=200)
+        self.assertEqual(len(sample), 200)
+        self.assertGreaterEqual(probs.min(), sort(chain.probs)[len(chain.probs) // 2 - 1])
+
+    def test_directory_save(self):
+        seed(10)
+        x = linspace(0, 1, 5)
+        def posterior(t):
+            return -0.5*(t**2).sum(), t[0] + t[1]*x
+
+        with tempfile.TemporaryDirectory() as tmp:
+            directory = os.path.join(tmp, 'directory_test_chain')
+            for chain_type in [GibbsChain, PcaChain, HamiltonianChain]:
+                chain = chain_type(posterior=BlobPosterior(posterior), start=array([0.5, 0.5]))
+                chain.print_status = False
+                chain.advance(500)
+                chain.save(directory, as_directory=True)
+
+                loaded = chain_type.load(directory, posterior=BlobPosterior(posterior))
+                loaded.print_status = False
+                # the loaded sample should be memory-mapped rather than read into memory
+                sample = loaded.get_sample_array(burn=0, thin=1)
+                self.assertIsInstance(sample, memmap)
+                self.assertTrue(allclose(sample, chain.get_sample_array(burn=0, thin=1)))
+                self.assertTrue(allclose(loaded.get_probabilities(burn=10, thin=3), chain.get_probabilities(burn=10, thin=3)))
+                self.assertTrue(allclose(loaded.get_blobs(burn=0, thin=1), chain.get_blobs(burn=0, thin=1)))
+                self.assertTrue(allclose(loaded.mode(), chain.mode()))
+
+                # the loaded chain can be advanced without modifying the saved files
+                loaded.advance(100)
+                self.assertEqual(len(loaded.get_sample_array(burn=0, thin=1)), 601)
+                self.assertEqual(len(chain_type.load(directory).get_probabilities(burn=0, thin=1)), 501)
 
+            # saving a chain without derived quantities should not leave the old blobs behind
+            GibbsChain(posterior=rosenbrock, start=[0.5, 0.5]).save(directory, as_directory=True)
+            with pytest.raises(ValueError):
+                GibbsChain.load(directory).get_blobs()
 
+            # directories which do not contain a saved chain should not be overwritten
+            other = os.path.join(tmp, 'other')
+            os.makedirs(other)
+            open(os.path.join(other, 'notes.txt'), 'w').close()
+            with pytest.raises(ValueError):
+                chain.save(other, as_directory=True)
 
 
 if __name__ == '__main__':
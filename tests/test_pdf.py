@@ -5,7 +5,7 @@ import unittest
 from inference.pdf_tools import GaussianKDE, UnimodalPdf, sample_hdi
 from numpy.random import normal, exponential
 
-from numpy import linspace, zeros
+from numpy import linspace, zeros, ones, allclose
 
 
 class test_pdf_tools(unittest.TestCase):
@@ -47,6 +47,10 @@ class test_pdf_tools(unittest.TestCase):
         sample = normal(size=3000) + exponential(scale=3., size=3000)
         interval = sample_hdi(sample, fraction=0.95)
 
+        # unit weights should give the same interval as the un-weighted sample
+        weighted_interval = sample_hdi(sample, fraction=0.95, weights=ones(3000))
+        self.assertTrue(allclose(interval, weighted_interval, atol=0.05))
+
 
 if __name__ == '__main__':
 
@@ -0,0 +1,79 @@
+
+import unittest
+
+from numpy import linspace, allclose, sort, percentile
+from numpy.random import seed, normal
+import matplotlib.pyplot as plt
+from inference.predictive import PosteriorPredictive
+from inference.plotting import hdi_plot, sorted_sample_hdi
+
+
+x = linspace(0, 1, 20)
+
+def model(theta):
+    return theta[0] + theta[1]*x
+
+def vectorised_model(theta):
+    return theta[:,0:1] + theta[:,1:2]*x[None,:]
+
+
+
+
+class test_predictive(unittest.TestCase):
+
+    def test_posterior_predictive(self):
+        seed(6)
+        sample = normal(size=[20000, 2])
+        predictions = vectorised_model(sample)
+
+        # the first chunk does not span the full range of predictions,
+        # so the histograms must be expanded as later chunks arrive
+        pp = PosteriorPredictive(model=model, chunk_size=100)
+        pp.print_status = False
+        pp.process(sorted(sample.tolist(), key=lambda t: abs(t[0])))
+        self.assertEqual(pp.n_predictions, 20000)
+        self.assertTrue(allclose(pp.mean, predictions.mean(axis=0)))
+
+        # the quantile and interval estimates should agree with the exact sample values
+        # to within a few bin-widths
+        tolerance = 5*pp.bin_width.max()
+        q = pp.quantiles([0.05, 0.5, 0.95])
+        self.assertTrue(allclose(q, percentile(predictions, [5, 50, 95], axis=0), atol=tolerance))
+        lwr, upr = pp.hdi(0.9)
+        exact_lwr, exact_upr = sorted_sample_hdi(sort(predictions, axis=0), 0.9)
+        self.assertTrue(allclose(lwr, exact_lwr, atol=tolerance))
+        self.assertTrue(allclose(upr, exact_upr, atol=tolerance))
+
+        # vectorised evaluation should give consistent summaries
+        vpp = PosteriorPredictive(model=vectorised_model, chunk_size=5000, vectorised=True)
+        vpp.print_status = False
+        vpp.process(sample)
+        self.assertTrue(allclose(vpp.mean, pp.mean))
+        tolerance = 5*max(pp.bin_width.max(), vpp.bin_width.max())
+        self.assertTrue(allclose(vpp.quantiles([0.05, 0.5, 0.95]), q, atol=tolerance))
+        v_lwr, v_upr = vpp.hdi(0.9)
+        self.assertTrue(allclose(v_lwr, lwr, atol=tolerance))
+        self.assertTrue(allclose(v_upr, upr, atol=tolerance))
+
+        pp.plot(x)
+        hdi_plot(x, predictions)
+        plt.close('all')
+
+    def test_scalar_model(self):
+        seed(7)
+        sample = normal(size=[250, 2])
+        # a chunk of 1D predictions from a scalar model must not be treated as a single prediction
+        for vectorised, scalar_model in [(False, lambda t: 2*t[0]), (True, lambda t: 2*t[:,0])]:
+            pp = PosteriorPredictive(model=scalar_model, chunk_size=100, vectorised=vectorised)
+            pp.print_status = False
+            pp.process(sample)
+            self.assertEqual(pp.n_predictions, 250)
+            self.assertEqual(pp.counts.shape[0], 1)
+            self.assertTrue(allclose(pp.mean, 2*sample[:,0].mean()))
+            tolerance = 5*pp.bin_width.max()
+            self.assertTrue(allclose(pp.quantiles(0.5), 2*percentile(sample[:,0], 50), atol=tolerance))
+
+
+if __name__ == '__main__':
+
+    unittest.main()
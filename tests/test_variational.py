@@ -0,0 +1,72 @@
+
+import unittest
+
+from numpy import array, dot, allclose, sqrt
+from numpy.random import seed
+from numpy.linalg import inv
+from inference.variational import GaussianVariational
+
+
+# correlated gaussian posterior
+target_mean = array([2., -1.])
+target_cov = array([[1.0, 0.6], [0.6, 0.5]])
+target_precision = inv(target_cov)
+
+def posterior(theta):
+    dx = theta - target_mean
+    return -0.5*dot(dx, dot(target_precision, dx))
+
+def gradient(theta):
+    return -dot(target_precision, theta - target_mean)
+
+
+
+
+class test_variational(unittest.TestCase):
+
+    def test_full_rank(self):
+        seed(3)
+        # the default widths are 5% of the starting values, which are much smaller than the posterior widths
+        vi = GaussianVariational(posterior=posterior, start=[3., 0.5], grad=gradient, full_rank=True)
+        vi.print_status = False
+        vi.fit(iterations=3000)
+
+        self.assertTrue(allclose(vi.mean, target_mean, atol=0.1))
+        self.assertTrue(allclose(vi.covariance, target_cov, atol=0.1))
+
+        sample = array(vi.get_sample(5000))
+        self.assertEqual(sample.shape, (5000, 2))
+        self.assertTrue(allclose(sample.mean(axis=0), target_mean, atol=0.1))
+        pdf = vi.get_marginal(0)
+        self.assertTrue(abs(pdf.mode - target_mean[0]) < 0.3)
+
+        # re-scaling the parameters should not change the approximation
+        vi = GaussianVariational(posterior=posterior, start=[3., 0.5], grad=gradient, full_rank=True)
+        for k in range(5):
+            vi.take_step()
+        mean, cov = vi.mean, vi.covariance
+        vi.rescale()
+        self.assertTrue(allclose(vi.scales, sqrt(cov.diagonal())))
+        self.assertTrue(allclose(vi.mean, mean))
+        self.assertTrue(allclose(vi.covariance, cov))
+
+    def test_mean_field(self):
+        seed(4)
+        # gradients are estimated by finite-difference when grad is not given
+        vi = GaussianVariational(posterior=posterior, start=[1., 1.])
+        vi.print_status = False
+        vi.fit(iterations=3000)
+
+        # the optimal mean-field variances are the reciprocals of the diagonal of the precision
+        self.assertTrue(allclose(vi.mean, target_mean, atol=0.1))
+        self.assertTrue(allclose(vi.covariance.diagonal(), 1. / target_precision.diagonal(), rtol=0.15))
+        self.assertEqual(vi.covariance[0,1], 0.)
+        self.assertTrue(len(vi.elbo_history) > 0)
+        vi.close()
+
+
+
+
+if __name__ == '__main__':
+
+    unittest.main()